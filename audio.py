@@ -0,0 +1,629 @@
+"""
+This module contains the audio input service, used from the Listen class (sense.py).
+
+The microphone is opened ONCE, when the PDA starts, and it stays open until the program exits.
+A background thread reads the frames and stores them in a bounded ring buffer.
+The wake-word (Porcupine) and the speech-to-intent (Rhino) engines are 'consumers' of that buffer.
+Switching between 'idle', 'engaged' and 'disengaged' modes only changes which consumer is active,
+so there is no open/start/stop/delete cycle of the audio device between the modes.
+
+The frames come from an AudioSource: the microphone (PvRecorderSource) or recorded WAV files (WavFileSource),
+so the same Listen pipeline can be replayed without a live microphone (see replay.py).
+
+Note: every frame is converted ONCE to array('h') in the capture thread.
+From there on it is passed by reference (to the engines, the pre-roll buffer and the debug WAV sink),
+without packing or copying it again.
+"""
+
+# ======================== IMPORT =========================
+import os
+import queue
+import threading
+import time
+import wave
+from array import array
+from collections import deque
+
+import numpy as np
+from pvrecorder import PvRecorder
+
+from events import Signals as sig
+
+
+# ======================= CLASSES =========================
+
+class PcmRingBuffer:
+    """
+    Fixed-size ring buffer, keeping the last N seconds of 16-bit PCM.
+    It is backed by one preallocated array('h'), so writing a frame is a slice copy, without new allocations.
+    """
+
+    def __init__(self, seconds, sample_rate=16000):
+        self.sample_rate = sample_rate
+        self.capacity = max(int(seconds * sample_rate), 1)
+
+        self.__buffer = array('h', bytes(2 * self.capacity))
+        self.__pos = 0  # where the next sample is written
+        self.__filled = 0  # how many valid samples the buffer has (up to capacity)
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return self.__filled
+
+    def write(self, pcm):
+        if not isinstance(pcm, array):
+            pcm = array('h', pcm)
+
+        n = len(pcm)
+        if n >= self.capacity:
+            # only the last 'capacity' samples are kept
+            pcm = pcm[n - self.capacity:]
+            n = self.capacity
+
+        with self.__lock:
+            end = self.__pos + n
+            if end <= self.capacity:
+                self.__buffer[self.__pos:end] = pcm
+            else:
+                first_part = self.capacity - self.__pos
+                self.__buffer[self.__pos:] = pcm[:first_part]
+                self.__buffer[:n - first_part] = pcm[first_part:]
+
+            self.__pos = end % self.capacity
+            self.__filled = min(self.__filled + n, self.capacity)
+
+    def snapshot(self, seconds=None):
+        """Returns a copy of the last 'seconds' of audio (all of it if None), in chronological order."""
+        with self.__lock:
+            n = self.__filled
+            if seconds is not None:
+                n = min(n, int(seconds * self.sample_rate))
+
+            start = (self.__pos - n) % self.capacity
+            if start + n <= self.capacity:
+                return self.__buffer[start:start + n]
+            return self.__buffer[start:] + self.__buffer[:self.__pos]
+
+    def clear(self):
+        with self.__lock:
+            self.__pos = 0
+            self.__filled = 0
+
+    @staticmethod
+    def split_frames(pcm, frame_length):
+        """Splits a snapshot into engine-sized frames. The incomplete frame at the beginning is dropped."""
+        start = len(pcm) % frame_length
+        for i in range(start, len(pcm), frame_length):
+            yield pcm[i:i + frame_length]
+
+
+class AudioSource:
+    """
+    Base class of the frame sources used from AudioCapture.
+    read() returns the next frame as array('h'), and raises EOFError when the source has no more audio.
+    'is_live' sources (the microphone) can not wait. The recorded ones are paced by the consumer (see AudioCapture).
+    """
+
+    is_live = False
+
+    def __init__(self, frame_length=512, sample_rate=16000):
+        self.frame_length = frame_length
+        self.sample_rate = sample_rate
+
+    def open(self):
+        ...
+
+    def read(self):
+        raise NotImplementedError
+
+    def close(self):
+        ...
+
+
+class PvRecorderSource(AudioSource):
+    """The microphone."""
+
+    is_live = True
+
+    def __init__(self, device_index=-1, frame_length=512, sample_rate=16000):
+        super().__init__(frame_length, sample_rate)
+        self.device_index = device_index
+        self.__recorder = None
+
+    def open(self):
+        self.__recorder = PvRecorder(device_index=self.device_index, frame_length=self.frame_length)
+        self.__recorder.start()
+        print(f"[Audio: capture started on device {self.device_index}]")
+
+    def read(self):
+        return array('h', self.__recorder.read())
+
+    def close(self):
+        if self.__recorder is not None:
+            try:
+                self.__recorder.stop()
+            except Exception as e:
+                print(f"ERR: while stopping the recorder: {e}")
+            self.__recorder.delete()
+            self.__recorder = None
+
+
+class WavFileSource(AudioSource):
+    """
+    Replays 16 kHz, mono, 16-bit WAV files (one clip or a whole corpus, one after another).
+    - speed=1.0 replays in real time, speed=4.0 four times faster, speed=0 as fast as possible.
+    - 'gap_sec' seconds of silence are inserted after every file, so the engines can finalize.
+    - 'position' is the number of samples replayed so far (the audio time, independent of the speed).
+    """
+
+    def __init__(self, paths, frame_length=512, sample_rate=16000, speed=1.0, gap_sec=0.0, loop=False):
+        super().__init__(frame_length, sample_rate)
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        self.speed = speed
+        self.gap_sec = gap_sec
+        self.loop = loop
+
+        self.position = 0
+        self.__pcm = array('h')
+        self.__offset = 0
+        self.__file_index = 0
+        self.__start_time = None
+
+    def __load(self, path):
+        with wave.open(path, 'rb') as wav_file:
+            if wav_file.getnchannels() != 1 or wav_file.getsampwidth() != 2 or wav_file.getframerate() != self.sample_rate:
+                raise ValueError(f"{path}: only {self.sample_rate} Hz, mono, 16-bit WAV files are supported")
+            pcm = array('h')
+            pcm.frombytes(wav_file.readframes(wav_file.getnframes()))
+        pcm.frombytes(bytes(2 * int(self.gap_sec * self.sample_rate)))  # the silence after the file
+        return pcm
+
+    def open(self):
+        self.position = 0
+        self.__offset = 0
+        self.__file_index = 0
+        self.__pcm = array('h')
+        self.__start_time = time.monotonic()
+
+    def read(self):
+        while len(self.__pcm) - self.__offset < self.frame_length:
+            if self.__file_index >= len(self.paths):
+                if not self.loop or not self.paths:
+                    raise EOFError("end of the replayed audio")
+                self.__file_index = 0
+            self.__pcm = self.__pcm[self.__offset:] + self.__load(self.paths[self.__file_index])
+            self.__offset = 0
+            self.__file_index += 1
+
+        frame = self.__pcm[self.__offset:self.__offset + self.frame_length]
+        self.__offset += self.frame_length
+        self.position += self.frame_length
+
+        if self.speed > 0:
+            # pacing: the frame is not returned before its (scaled) real time
+            due_time = self.__start_time + self.position / self.sample_rate / self.speed
+            delay = due_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return frame
+
+
+class AudioCapture:
+    """
+    Long-lived capture service, owning the microphone.
+    - The capture thread reads a frame from the recorder and appends it to a ring buffer (deque with maxlen).
+    - Every frame gets a sequence number. Each consumer keeps a cursor (the last sequence number it has read),
+      so the same ring buffer is shared between the consumers without copying the frames.
+    - Only the ACTIVE consumer is allowed to read. The others are simply waiting for their turn.
+    - A live source (the microphone) never waits: if the consumer is too slow, its oldest frames are overwritten.
+      A recorded source is 'lossless': the capture thread waits for the active consumer, so no frame is lost.
+    """
+
+    __BUFFER_FRAMES = 64  # ~2 seconds of audio at 16kHz and 512 samples per frame.
+    __REOPEN_DELAY = 1  # seconds to wait before reopening the recorder after an error.
+
+    def __init__(self, frame_length=512, device_index=-1, buffer_frames=None, preroll_sec=0, sample_rate=16000,
+                 source=None):
+        self.frame_length = frame_length
+        self.device_index = device_index
+
+        # where the frames come from. By default, the microphone.
+        self.source = source or PvRecorderSource(device_index, frame_length, sample_rate)
+        self.lossless = not self.source.is_live
+
+        # the last 'preroll_sec' seconds of audio, kept as a continuous PCM block (see activate())
+        self.preroll = PcmRingBuffer(preroll_sec, sample_rate) if preroll_sec > 0 else None
+
+        self.__is_open = False
+        self.__frames = deque(maxlen=buffer_frames or self.__BUFFER_FRAMES)  # elements: (seq, pcm)
+        self.__seq = -1  # sequence number of the last captured frame
+        self.__cond = threading.Condition()
+
+        self.__cursors = {}  # consumer name -> sequence number of the last frame it has read
+        self.__consumed = -1  # the last frame read by any consumer (used by the lossless sources)
+        self.active = None  # name of the consumer allowed to read (for example 'porcupine' or 'rhino')
+
+        self.overruns = 0  # how many frames were lost, because the active consumer was too slow
+
+        # set from the ringing signal (see interrupt()). The next read() of the active consumer returns None immediately.
+        # It is kept per consumer: the read of one consumer does not take the interrupt of another.
+        self.__interrupted = set()
+        sig.add_ringing_listener(self.interrupt)
+
+        self.__stop = False
+        self.thread_is_finished = False
+        self.thread = None
+
+    # ------------- capture thread -------------
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.__stop = False
+        self.thread_is_finished = False
+        self.thread = threading.Thread(target=self.__capture_thread, daemon=True)
+        self.thread.start()
+
+    def __close(self):
+        if self.__is_open:
+            self.__is_open = False
+            try:
+                self.source.close()
+            except Exception as e:
+                print(f"ERR: while closing the audio source: {e}")
+
+    def __capture_thread(self):
+        while not self.__stop and not sig.program_terminate:
+            try:
+                if not self.__is_open:
+                    self.source.open()
+                    self.__is_open = True
+
+                pcm = self.source.read()
+                self._push(pcm)
+
+            except EOFError:
+                break  # a replayed source has no more audio
+
+            except Exception as e:
+                print(f"ERR: in audio capture: {e}")
+                self.__close()
+                time.sleep(self.__REOPEN_DELAY)
+
+        self.__close()
+
+        # wake up any consumer waiting for a frame, so it can see the capture has stopped
+        with self.__cond:
+            self.thread_is_finished = True
+            self.__cond.notify_all()
+
+    def __can_push(self):
+        if self.__stop or sig.program_terminate:
+            return True
+        return self.__seq - self.__consumed < self.__frames.maxlen - 1
+
+    def _push(self, pcm):
+        with self.__cond:
+            if self.lossless:
+                # back-pressure: wait until there is an active consumer, with space left in its part of the buffer
+                while not self.__cond.wait_for(self.__can_push, timeout=0.5):
+                    pass
+            if self.preroll is not None and not self.lossless:
+                self.preroll.write(pcm)
+            self.__seq += 1
+            self.__frames.append((self.__seq, pcm))
+            self.__cond.notify_all()
+
+    def stop(self):
+        with self.__cond:
+            self.__stop = True
+            self.__cond.notify_all()
+        sig.remove_ringing_listener(self.interrupt)
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+            if self.thread_is_finished:
+                print("AUDIO capture thread stopped successfully.")
+
+    @property
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def consumer_position(self, name):
+        """Number of samples the consumer 'name' has read so far."""
+        with self.__cond:
+            return (self.__cursors.get(name, -1) + 1) * self.frame_length
+
+    @property
+    def position(self):
+        """Number of samples captured so far. Used to measure latencies in audio time (see replay.py)."""
+        return (self.__seq + 1) * self.frame_length
+
+    # ------------- consumers -------------
+    def subscribe(self, name):
+        """Register a consumer. It does not receive any frame until it is activated."""
+        with self.__cond:
+            self.__cursors.setdefault(name, self.__seq)
+
+    def activate(self, name, with_preroll=False):
+        """
+        Make 'name' the only consumer reading frames. It starts reading from the NEXT captured frame.
+        (for a lossless source: from the first frame no consumer has read yet)
+        Note: this is just a pointer swap, the audio device is not touched.
+        If 'with_preroll' is True, it returns the pre-roll audio captured right before the switch.
+        It is taken under the same lock, so the pre-roll and the live frames do not overlap or leave a gap.
+        """
+        preroll = None
+        with self.__cond:
+            if with_preroll and self.preroll is not None:
+                preroll = self.preroll.snapshot()
+            self.__cursors[name] = self.__consumed if self.lossless else self.__seq
+            self.active = name
+            self.__interrupted.discard(name)  # an interrupt of its previous listening, never read
+            self.__cond.notify_all()
+        return preroll
+
+    def deactivate(self, name=None):
+        with self.__cond:
+            if name is None or self.active == name:
+                self.active = None
+            self.__cond.notify_all()
+
+    def interrupt(self):
+        """
+        Wakes up the consumer waiting in read(), without waiting for the next frame.
+        It is registered as a ringing listener, so a ringing message breaks the listening within one frame.
+        """
+        with self.__cond:
+            if self.active is not None:
+                self.__interrupted.add(self.active)
+            self.__cond.notify_all()
+
+    def read(self, name, timeout=None):
+        """
+        Returns the next frame for consumer 'name'.
+        Returns None if the consumer is not active (anymore), the capture is stopped, the timeout passed,
+        or the read was interrupted (see interrupt()).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.__cond:
+            while True:
+                if name in self.__interrupted:
+                    self.__interrupted.discard(name)
+                    return None
+
+                if self.active != name or self.__stop or sig.program_terminate:
+                    return None
+
+                cursor = self.__cursors.get(name, self.__seq)
+                if cursor < self.__seq:
+                    oldest_seq = self.__frames[0][0]
+                    if cursor + 1 < oldest_seq:
+                        # the consumer was too slow, and the ring buffer overwrote its frames
+                        self.overruns += oldest_seq - cursor - 1
+                        cursor = oldest_seq - 1
+
+                    seq, pcm = self.__frames[cursor + 1 - oldest_seq]
+                    self.__cursors[name] = seq
+                    if self.lossless and seq > self.__consumed and self.preroll is not None:
+                        # a recorded source is read ahead, so the pre-roll follows the consumed frames instead
+                        self.preroll.write(pcm)
+                    self.__consumed = max(self.__consumed, seq)
+                    if self.lossless:
+                        self.__cond.notify_all()  # the capture thread may wait for space in the buffer
+                    return pcm
+
+                if self.thread_is_finished:
+                    return None  # no more frames will come (the source ended)
+
+                if deadline is None:
+                    self.__cond.wait()
+                else:
+                    time_left = deadline - time.monotonic()
+                    if time_left <= 0:
+                        return None
+                    self.__cond.wait(time_left)
+
+
+class WavDebugSink:
+    """
+    Records audio frames into WAV files, for debugging.
+    The listening loop only puts the frame into a bounded queue (never blocks).
+    A background thread writes the frames to disk, and rotates the file every 'rotate_sec' seconds of audio.
+    Only the last 'keep_files' files are kept. If the queue is full, the frame is dropped (and counted).
+    """
+
+    def __init__(self, directory='debug_audio', enabled=False, rotate_sec=300, keep_files=5,
+                 sample_rate=16000, max_queue=256):
+        self.directory = directory
+        self.enabled = enabled  # the 'off switch'. If False, write() returns immediately.
+        self.rotate_sec = rotate_sec
+        self.keep_files = keep_files
+        self.sample_rate = sample_rate
+
+        self.dropped = 0
+
+        self.__queue = queue.Queue(maxsize=max_queue)
+        self.__wav_file = None
+        self.__file_frames = 0  # samples written into the current file
+        self.__file_count = 0
+        self.__files = deque()
+
+        self.thread = None
+        if enabled:
+            self.start()
+
+    def start(self):
+        self.enabled = True
+        if self.thread is None or not self.thread.is_alive():
+            os.makedirs(self.directory, exist_ok=True)
+            sig.add_terminate_listener(self.__wake_writer)
+            self.thread = threading.Thread(target=self.__writer_thread, daemon=True)
+            self.thread.start()
+
+    def __wake_writer(self):
+        try:
+            self.__queue.put_nowait(None)
+        except queue.Full:
+            pass  # the writer checks the termination after every frame
+
+    def stop(self):
+        self.enabled = False
+        if self.thread is not None and self.thread.is_alive():
+            self.__queue.put(None)  # wake up the writer, so it can close the file and exit
+            self.thread.join(timeout=2)
+
+    def write(self, pcm):
+        if not self.enabled:
+            return
+        try:
+            self.__queue.put_nowait(pcm)
+        except queue.Full:
+            self.dropped += 1
+
+    def __rotate(self):
+        if self.__wav_file is not None:
+            self.__wav_file.close()
+
+        self.__file_count += 1
+        filename = os.path.join(self.directory, time.strftime(f"pc_%Y%m%d_%H%M%S_{self.__file_count}.wav"))
+        self.__wav_file = wave.open(filename, "wb")
+        self.__wav_file.setparams((1, 2, self.sample_rate, 0, "NONE", "NONE"))
+        self.__file_frames = 0
+
+        self.__files.append(filename)
+        while len(self.__files) > self.keep_files:
+            old_file = self.__files.popleft()
+            try:
+                os.remove(old_file)
+            except OSError as e:
+                print(f"ERR: while removing old debug recording: {e}")
+
+    def __writer_thread(self):
+        while self.enabled and not sig.program_terminate:
+            pcm = self.__queue.get()  # woken up by stop() or the termination (see __wake_writer())
+            if pcm is None:
+                break
+
+            try:
+                if self.__wav_file is None or self.__file_frames >= self.rotate_sec * self.sample_rate:
+                    self.__rotate()
+                # array('h') exposes the buffer protocol, so the samples go to the file without packing.
+                self.__wav_file.writeframesraw(pcm)
+                self.__file_frames += len(pcm)
+            except Exception as e:
+                print(f"ERR: in debug recording: {e}")
+
+        if self.__wav_file is not None:
+            self.__wav_file.close()  # the header (length) is updated on close
+            self.__wav_file = None
+
+
+class VoiceActivityGate:
+    """
+    Lightweight voice activity detection (energy + zero-crossing rate), placed in front of the intent engine.
+    While the room is silent, the frames are held back, so the engine (Rhino) does not process them at all.
+    - A frame is 'speech' if its RMS energy is above the (adaptive) threshold,
+      and its zero-crossing rate is below 'zcr_max' (hiss and clicks have very high zcr).
+    - Speech starts after 'onset_frames' speech frames in a row. Then the pre-speech buffer
+      (the last 'pre_speech_frames' frames) is released first, so the first syllable is not cut.
+    - After the speech stops, the gate stays open for 'hangover_frames', so the engine can see the end of the utterance.
+    The gate keeps statistics per mode ('engaged', 'disengaged'...), see report().
+    """
+
+    def __init__(self, energy_threshold=300.0, noise_ratio=3.0, zcr_max=0.35,
+                 onset_frames=2, hangover_frames=16, pre_speech_frames=8):
+        self.energy_threshold = energy_threshold  # minimum RMS (int16 scale) to be considered speech
+        self.noise_ratio = noise_ratio  # the threshold is also at least 'noise_ratio' x the noise floor
+        self.zcr_max = zcr_max
+        self.onset_frames = onset_frames
+        self.hangover_frames = hangover_frames
+
+        self.noise_floor = None  # slowly follows the RMS of the silent frames
+        self.is_speech = False
+
+        self.__pre_speech = deque(maxlen=pre_speech_frames)
+        self.__speech_run = 0
+        self.__hangover = 0
+
+        # mode -> {'frames', 'passed', 'vad_time', 'engine_time', 'engine_frames'}
+        self.stats = {}
+        self.mode = None
+
+    def reset(self, mode=None):
+        """Called when a new listening starts. The noise floor is kept, it is a property of the room."""
+        self.mode = mode
+        self.is_speech = False
+        self.__pre_speech.clear()
+        self.__speech_run = 0
+        self.__hangover = 0
+        self.stats.setdefault(mode, {'frames': 0, 'passed': 0, 'vad_time': 0.0, 'engine_time': 0.0, 'engine_frames': 0})
+
+    def __classify(self, pcm):
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+        rms = float(np.sqrt(np.mean(samples * samples)))
+        zcr = float(np.count_nonzero(np.diff(np.signbit(samples)))) / len(samples)
+
+        threshold = self.energy_threshold
+        if self.noise_floor is not None:
+            threshold = max(threshold, self.noise_floor * self.noise_ratio)
+
+        is_speech = rms >= threshold and zcr <= self.zcr_max
+        if not is_speech:
+            # follow the noise floor only on the non-speech frames
+            self.noise_floor = rms if self.noise_floor is None else 0.95 * self.noise_floor + 0.05 * rms
+        return is_speech
+
+    def process(self, pcm):
+        """Returns a list of the frames to pass to the engine (empty while the gate is closed)."""
+        start = time.perf_counter()
+        stats = self.stats[self.mode]
+        stats['frames'] += 1
+
+        if self.__classify(pcm):
+            self.__speech_run += 1
+            self.__hangover = self.hangover_frames
+        else:
+            self.__speech_run = 0
+            if self.__hangover > 0:
+                self.__hangover -= 1
+
+        if self.is_speech:
+            if self.__hangover == 0:
+                self.is_speech = False
+            frames = [pcm]
+        elif self.__speech_run >= self.onset_frames:
+            # speech onset: release the pre-speech buffer first
+            self.is_speech = True
+            frames = list(self.__pre_speech)
+            frames.append(pcm)
+            self.__pre_speech.clear()
+        else:
+            self.__pre_speech.append(pcm)
+            frames = []
+
+        stats['passed'] += len(frames)
+        stats['vad_time'] += time.perf_counter() - start
+        return frames
+
+    def record_engine_time(self, seconds, frames=1):
+        """The listening loop reports how long the engine took, so the saved CPU time can be estimated."""
+        stats = self.stats[self.mode]
+        stats['engine_time'] += seconds
+        stats['engine_frames'] += frames
+
+    def report(self):
+        """Returns per-mode statistics: how many frames were held back, and the estimated CPU time saved."""
+        report = {}
+        for mode, stats in self.stats.items():
+            frames = stats['frames']
+            held = max(frames - stats['passed'], 0)
+            engine_cost = stats['engine_time'] / stats['engine_frames'] if stats['engine_frames'] else 0.0
+            saved = held * engine_cost - stats['vad_time']
+            report[mode] = {
+                'frames': frames,
+                'held_back': held,
+                'held_back_pct': round(100 * held / frames, 1) if frames else 0.0,
+                'engine_ms_per_frame': round(1000 * engine_cost, 3),
+                'vad_ms_per_frame': round(1000 * stats['vad_time'] / frames, 3) if frames else 0.0,
+                'cpu_saved_sec': round(saved, 2),
+            }
+        return report
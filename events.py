@@ -5,7 +5,6 @@ The main reason of creating it, is to tell all the 'on-running' loops and THREAD
 that an event has occurred, for example 'The program is exiting. Terminate all threads'.
 """
 import random
-import time
 from typing import List
 
 import threading
@@ -14,6 +13,11 @@ import threading
 class Signals:
     program_terminate = False  # signal for program termination. It stops all the running threads.
 
+    # Set together with 'program_terminate' (see terminate()). Waited on, instead of polling the flag every second.
+    terminate_event = threading.Event()
+    # Callbacks, called once on termination. The threads waiting on their own condition/event register here.
+    _terminate_listeners = []
+
     """ WORKING ON RINGING SIGNAL ===
     1. If a function running on a background needs an attention, it will engage sig.ringing_start().
     - This will call the user and wait for his response.
@@ -33,27 +37,117 @@ class Signals:
     _ringing_msg = None
     # ringing_msg is a simple string for engaging the user 'Sir are you there?'
 
+    # All the access to '_ringing_msg' is done under this condition, so the handoff is atomic.
+    # It is also used to wake up anything waiting for a ringing message (see wait_ringing_msg()).
+    _ringing_cond = threading.Condition()
+
+    # Callbacks, called every time a ringing message is set. The audio capture service registers here,
+    # so a waiting listen loop is woken up immediately, instead of polling for the message after every frame.
+    _ringing_listeners = []
+
+    # Set when the ringing should stop. The ringing thread waits on it, instead of sleeping, so it stops immediately.
+    _ringing_stop_event = threading.Event()
+
     is_ringing = False
     __thread = None
 
+    RINGING_SEQUENCES = {
+        'new-report': {
+            'sequence': ['wait', 'ring', 'wait', 'ring', 'wait', 'final', 'wait', 'end'],
+            'ringing-msg': ["Sir?", "Sir are you there?", "Sir!"],
+            'final-call': "Anyone?",
+            'end-msg': None
+        },
+        'answer-expected': {
+            'sequence': ['ring', 'wait', 'ring', 'wait', 'final', 'wait', 'end'],
+            'ringing-msg': ["Sir?", "Sir I need your answer.", "Sir!"],
+            'final-call': "I'm about to cancel your request.",
+            'end-msg': ["Ok whatever.", "Ok never mind."]
+        }
+    }
+
+    @classmethod
+    def predictable_phrases(cls):
+        """All the ringing messages. Used to synthesize them in advance (see phrase_warmer.py)."""
+        phrases = set()
+        for sequence in cls.RINGING_SEQUENCES.values():
+            phrases.update(sequence['ringing-msg'])
+            phrases.add(sequence['final-call'])
+            phrases.update(sequence['end-msg'] or [])
+        return phrases
+
+    @classmethod
+    def terminate(cls):
+        """Terminates the program: sets 'program_terminate', and wakes up everything waiting for it."""
+        cls.program_terminate = True
+        cls.terminate_event.set()
+        cls._ringing_stop_event.set()
+        with cls._ringing_cond:
+            cls._ringing_cond.notify_all()
+
+        for callback in list(cls._terminate_listeners):
+            try:
+                callback()
+            except Exception as e:
+                print(f"ERR: in terminate listener: {e}")
+
+    @classmethod
+    def add_terminate_listener(cls, callback):
+        if callback not in cls._terminate_listeners:
+            cls._terminate_listeners.append(callback)
+
+    @classmethod
+    def remove_terminate_listener(cls, callback):
+        if callback in cls._terminate_listeners:
+            cls._terminate_listeners.remove(callback)
+
+    @classmethod
+    def add_ringing_listener(cls, callback):
+        if callback not in cls._ringing_listeners:
+            cls._ringing_listeners.append(callback)
+
+    @classmethod
+    def remove_ringing_listener(cls, callback):
+        if callback in cls._ringing_listeners:
+            cls._ringing_listeners.remove(callback)
+
     @classmethod
     def set_ringing_msg(cls, msg: str):
         if msg:
-            cls._ringing_msg = msg
+            with cls._ringing_cond:
+                cls._ringing_msg = msg
+                cls._ringing_cond.notify_all()
+
+            for callback in list(cls._ringing_listeners):
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"ERR: in ringing listener: {e}")
 
     @classmethod
     def get_ringing_msg(cls):
         # Note: every time the ringing_msg is read, it is cleared.
-        if cls._ringing_msg is not None:
+        with cls._ringing_cond:
+            msg = cls._ringing_msg
+            cls._ringing_msg = None
+            return msg
+
+    @classmethod
+    def has_ringing_msg(cls):
+        return cls._ringing_msg is not None
+
+    @classmethod
+    def wait_ringing_msg(cls, timeout=None):
+        """Blocks until a ringing message is set (or the timeout pass). Returns the message and clears it."""
+        with cls._ringing_cond:
+            cls._ringing_cond.wait_for(lambda: cls._ringing_msg is not None, timeout=timeout)
             msg = cls._ringing_msg
             cls._ringing_msg = None
             return msg
-        else:
-            return None
 
     @classmethod
     def clear_ringing_msg(cls):
-        if cls._ringing_msg is not None:
+        with cls._ringing_cond:
             cls._ringing_msg = None
 
     @classmethod
@@ -62,29 +156,18 @@ class Signals:
         # if mode == 'new-report' it inject a message, then waits, then inject the message, then waits...
 
         # Note: The attempt counts are emilated by the length of the 'ringing-msg' list. Every call is 1 sec.
+        # Note: the 'tick' waits on '_ringing_stop_event', so ringing_stop() interrupts it immediately.
 
-        mode_sequence = {
-            'new-report': {
-                'sequence': ['wait', 'ring', 'wait', 'ring', 'wait', 'final', 'wait', 'end'],
-                'ringing-msg': ["Sir?", "Sir are you there?", "Sir!"],
-                'final-call': "Anyone?",
-                'end-msg': None
-            },
-            'answer-expected': {
-                'sequence': ['ring', 'wait', 'ring', 'wait', 'final', 'wait', 'end'],
-                'ringing-msg': ["Sir?", "Sir I need your answer.", "Sir!"],
-                'final-call': "I'm about to cancel your request.",
-                'end-msg': ["Ok whatever.", "Ok never mind."]
-            }
-        }
-
+        mode_sequence = cls.RINGING_SEQUENCES
         cls.is_ringing = True
         # print(f"Ringing started. Mode={mode}...")
 
         if mode == 'answer-expected':
-            ringing_sequence = mode_sequence[mode]
+            ringing_sequence = dict(mode_sequence[mode])
         else:
-            ringing_sequence = mode_sequence['new-report']
+            ringing_sequence = dict(mode_sequence['new-report'])
+        # the messages are popped out of the list while ringing, so the list is copied.
+        ringing_sequence['ringing-msg'] = list(ringing_sequence['ringing-msg'])
 
         for cmd in ringing_sequence['sequence']:
             # calling the user 3 times
@@ -109,8 +192,8 @@ class Signals:
 
                 if not cls.is_ringing or cls.program_terminate:
                     break
-                else:
-                    time.sleep(1)
+                elif cls._ringing_stop_event.wait(1):
+                    break
 
         if cls.program_terminate:
             print("RINGING thread stopped successfully.")
@@ -121,6 +204,7 @@ class Signals:
         # starting the thread
         if not cls.is_ringing:
             # print("Start ringing...")
+            cls._ringing_stop_event.clear()
             cls.__thread = threading.Thread(target=cls.__ringing_thread, args=(mode,))
             cls.__thread.start()
         else:
@@ -129,11 +213,13 @@ class Signals:
     @classmethod
     def ringing_stop(cls):
         cls.is_ringing = False
-        cls.clear_ringing_msg()
-        if cls.__thread is not None and cls.__thread.is_alive():
+        cls._ringing_stop_event.set()
+        if cls.__thread is not None and cls.__thread.is_alive() and cls.__thread is not threading.current_thread():
             print("The RINGING thread is running. Stopping it...")
             cls.__thread.join()
             print("RINGING thread stopped successfully.")
+        # cleared after the thread is stopped, so a message injected in the meantime is not left behind.
+        cls.clear_ringing_msg()
 
     @classmethod
     def ringing_restart(cls):
@@ -156,25 +242,48 @@ class EventReporter:
     """
 
     _reporter_queue: List[dict] = []
+    # all the access to the queue is done under this lock (the reports are added from many threads)
+    _lock = threading.Lock()
+
+    # Callbacks, called every time a report is added (the conversation orchestrator delivers it, if engaged).
+    _report_listeners = []
 
     is_reports = False
 
+    @classmethod
+    def add_report_listener(cls, callback):
+        if callback not in cls._report_listeners:
+            cls._report_listeners.append(callback)
+
+    @classmethod
+    def remove_report_listener(cls, callback):
+        if callback in cls._report_listeners:
+            cls._report_listeners.remove(callback)
+
     @classmethod
     def add_to_queue(cls, msg, msg_about='report'):
-        # TODO: add a protection if two methods try to update the queue at the same time...
         try:
             report_element = {'msg': msg, 'about': msg_about}
-            cls._reporter_queue.append(report_element)
+            with cls._lock:
+                cls._reporter_queue.append(report_element)
             # TODO: when we add to queue, the RINGING should be started from the function who added the report!!!
 
             print(f"A report is added: {msg}, {msg_about}.")
         except Exception as e:
             print(e)
+            return
+
+        for callback in list(cls._report_listeners):
+            try:
+                callback()
+            except Exception as e:
+                print(f"ERR: in report listener: {e}")
 
     @classmethod
     def clear_queue(cls):
         try:
-            cls._reporter_queue.clear()
+            with cls._lock:
+                cls._reporter_queue.clear()
             print("The Reporter Queue cleared successfully")
         except Exception as e:
             print(e)
@@ -183,15 +292,14 @@ class EventReporter:
 
     @classmethod
     def get_next_report(cls):
-        # TODO: Same protection as above, here
         try:
-            if cls._reporter_queue:
+            with cls._lock:
+                if not cls._reporter_queue:
+                    return None
                 element = cls._reporter_queue.pop()
-                print(f"Next to report: {element}")
                 elements_left = len(cls._reporter_queue)
-                return element, elements_left
-            else:
-                return None
+            print(f"Next to report: {element}")
+            return element, elements_left
         except Exception as e:
             print(e)
             return None
@@ -199,14 +307,52 @@ class EventReporter:
     # a generator version of get_nex_report() method...
     @classmethod
     def get_reports(cls):
-        while len(cls._reporter_queue) > 0:
-            try:
+        while True:
+            with cls._lock:
+                if not cls._reporter_queue:
+                    return
                 report = cls._reporter_queue.pop()
-                print(f"Next to report: {report}")
-                yield report
-            except Exception as e:
-                print(e)
-                yield None
+            print(f"Next to report: {report}")
+            yield report
+
+    @classmethod
+    def drain(cls):
+        """Takes all the reports out of the queue at once, in the order they were added."""
+        with cls._lock:
+            reports = list(cls._reporter_queue)
+            cls._reporter_queue.clear()
+        return reports
+
+    @staticmethod
+    def compose(reports, title=None):
+        """
+        Merges the reports into ONE message, grouped by 'about' (in the order the first report of each came),
+        so the related reports are said together. 'title' is put on front ('Sir, ...').
+        Returns (message, about). 'about' is 'report' if the reports are about different things.
+        """
+        groups = {}
+        for report in reports:
+            if isinstance(report, dict) and isinstance(report.get('msg'), str) and report['msg'].strip():
+                msg = report['msg'].strip()
+                if msg[-1] not in '.!?':
+                    msg += '.'
+                groups.setdefault(report.get('about', 'report'), []).append(msg)
+        if not groups:
+            return None, None
+
+        message = " ".join(msg for msgs in groups.values() for msg in msgs)
+        if title:
+            message = f"{title}, {message}"
+        about = next(iter(groups)) if len(groups) == 1 else 'report'
+        return message, about
+
+    @classmethod
+    def compose_reports(cls, title=None):
+        """Drains the queue and composes all the reports into one message (see compose()). Returns (message, about)."""
+        reports = cls.drain()
+        if reports:
+            print(f"Reports to deliver: {len(reports)}")
+        return cls.compose(reports, title=title)
 
 
 
@@ -0,0 +1,174 @@
+"""
+This module measures where the time goes in a conversation turn,
+from the wake-word detection to the first audio out, and further to the final answer.
+
+Every stage of the turn is recorded into a preallocated ring buffer (no allocations on the hot path):
+- span(stage): a 'with' block, recording how long the stage took.
+- mark(stage): a point in time, recorded as the time passed since the turn started (see begin_turn()).
+The percentiles (p50/p95/p99) per stage are returned from status(), and written to a file from dump().
+
+Usage (the same way as Signals and EventReporter):
+    from latency import LatencyTracer as tracer
+    tracer.begin_turn()
+    with tracer.span('tts_synthesis'):
+        ...
+    tracer.mark_once('first_audio')
+"""
+
+# ======================== IMPORT =========================
+import json
+import platform
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+
+
+# ======================= CLASSES =========================
+
+class LatencyTracer:
+    # The stages of a conversation turn, in the order they usually happen.
+    # A stage name not in the list is appended on its first use.
+    STAGES = [
+        'wake',  # Porcupine: processing of the frame, where the wake-word was detected
+        'wakeup_response',  # generating the wakeup reply
+        'speak_lookup',  # speak(): searching the phrase in the offline cache
+        'playback',  # the audio playback of one phrase (see playback.py)
+        'tts_synthesis',  # Google TTS request
+        'rhino_final',  # MARK: Rhino finalized the intent (since the turn started)
+        'respond',  # Response.respond(), the whole answer (including speaking it)
+        'task_process',  # time spent inside the skill generator (fetching/computing the answer)
+        'first_audio',  # MARK: the first audio out of the turn (since the turn started)
+    ]
+
+    __CAPACITY = 2048  # records kept in the ring buffer
+
+    _lock = threading.Lock()
+    _turns = array('l', [0] * __CAPACITY)  # turn id of the record
+    _stages = array('b', [0] * __CAPACITY)  # index of the stage in STAGES
+    _values = array('d', [0.0] * __CAPACITY)  # seconds
+    _pos = 0  # next write position
+    _count = 0  # valid records (up to capacity)
+
+    _turn_id = 0
+    _turn_start = None
+    _marked = set()  # stages already marked in the current turn (see mark_once())
+
+    enabled = True
+
+    @classmethod
+    def __stage_index(cls, stage):
+        try:
+            return cls.STAGES.index(stage)
+        except ValueError:
+            cls.STAGES.append(stage)
+            return len(cls.STAGES) - 1
+
+    @classmethod
+    def record(cls, stage, seconds):
+        if not cls.enabled:
+            return
+        with cls._lock:
+            pos = cls._pos
+            cls._turns[pos] = cls._turn_id
+            cls._stages[pos] = cls.__stage_index(stage)
+            cls._values[pos] = seconds
+            cls._pos = (pos + 1) % cls.__CAPACITY
+            cls._count = min(cls._count + 1, cls.__CAPACITY)
+
+    @classmethod
+    def begin_turn(cls, started_at=None):
+        """A new conversation turn starts (a wake-word or a command was detected)."""
+        with cls._lock:
+            cls._turn_id += 1
+            cls._turn_start = started_at if started_at is not None else time.perf_counter()
+            cls._marked = set()
+        return cls._turn_id
+
+    @classmethod
+    def mark(cls, stage):
+        """Records the time passed since the turn started."""
+        if cls._turn_start is not None:
+            cls.record(stage, time.perf_counter() - cls._turn_start)
+
+    @classmethod
+    def mark_once(cls, stage):
+        """Same as mark(), but only the first call in the turn is recorded (for example 'first_audio')."""
+        if cls._turn_start is not None and stage not in cls._marked:
+            cls._marked.add(stage)
+            cls.mark(stage)
+
+    @classmethod
+    @contextmanager
+    def span(cls, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.record(stage, time.perf_counter() - start)
+
+    @classmethod
+    def timed_generator(cls, stage, generator):
+        """
+        Wraps a generator, recording only the time spent INSIDE it (for the skill generators).
+        The time the caller spends between the items (for example speaking the prior message) is not counted.
+        """
+        total = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    total += time.perf_counter() - start
+                    break
+                total += time.perf_counter() - start
+                yield item
+        finally:
+            cls.record(stage, total)
+
+    @staticmethod
+    def __percentile(sorted_values, pct):
+        index = min(int(round(pct / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+        return sorted_values[index]
+
+    @classmethod
+    def status(cls):
+        """Returns {stage: {'count', 'p50', 'p95', 'p99', 'max'}} in milliseconds, for all recorded stages."""
+        with cls._lock:
+            per_stage = {}
+            for i in range(cls._count):
+                per_stage.setdefault(cls._stages[i], []).append(cls._values[i])
+
+            stages = list(cls.STAGES)
+
+        status = {}
+        for stage_index in sorted(per_stage):
+            values = sorted(per_stage[stage_index])
+            status[stages[stage_index]] = {
+                'count': len(values),
+                'p50': round(1000 * cls.__percentile(values, 50), 1),
+                'p95': round(1000 * cls.__percentile(values, 95), 1),
+                'p99': round(1000 * cls.__percentile(values, 99), 1),
+                'max': round(1000 * values[-1], 1),
+            }
+        return status
+
+    @staticmethod
+    def board():
+        """The board type, so the dumps from different boards (Pi 3, Pi 4, Edge2...) can be compared."""
+        try:
+            with open('/proc/device-tree/model') as file:
+                return file.read().strip('\x00').strip()
+        except OSError:
+            return f"{platform.system()} {platform.machine()}"
+
+    @classmethod
+    def dump(cls, filename='db/latency.json'):
+        try:
+            data = {'time': int(time.time()), 'board': cls.board(), 'turns': cls._turn_id, 'stages_ms': cls.status()}
+            with open(filename, 'w') as file:
+                json.dump(data, file, indent=2)
+            print(f"Latency stats saved to {filename}")
+        except Exception as e:
+            print(f"ERR: while saving latency stats: {e}")
@@ -0,0 +1,300 @@
+"""
+The CONVERSATION ORCHESTRATOR: the conversation loop 'idle - listen(engaged) - listen(disengaged) - idle'
+of the PDA, on an asyncio event loop (used from alex.py).
+
+Before, AlexAPI.run() and engage() were blocking loops: the PDA was either listening, or speaking, or fetching,
+and every waiting thread polled 'sig.program_terminate' once per second.
+Here, everything the conversation waits for is an awaitable:
+- the listening (the audio frames through Porcupine/Rhino), the speech and the skills are the same blocking calls,
+  run in executors (see BlockingAdapter). The event loop only awaits them,
+- the program termination, the ringing and the new reports are events, set from their threads
+  (see Signals.add_terminate_listener() and EventReporter.add_report_listener()).
+  The background threads (the senses, the warmer, the packer...) wait on the same termination event or listeners,
+- the timers: the silent timeouts of the listening modes (see AlexAPI.MODE_TIMEOUT).
+So the PDA can listen WHILE it is fetching and speaking: the wake-word stops the answer, the report or the ringing
+message (a barge-in), and the next command is taken right away.
+A new report stops the engaged listening, and it is spoken at once.
+On termination, the listening is cancelled within one audio frame.
+"""
+
+# ======================== IMPORT =========================
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from events import Signals as sig
+from events import EventReporter as reporter
+from latency import LatencyTracer as tracer
+from speech_scheduler import ALERT, ANSWER
+
+
+# ======================= CLASSES =========================
+
+class BlockingAdapter:
+    """Runs the blocking calls (Picovoice, the speech, the skills) in executors, and returns them as awaitables."""
+
+    def __init__(self):
+        # one listening at a time: the audio has one active consumer (see AudioCapture.activate())
+        self.listen_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='listen')
+        # the speech: waiting for the messages queued in the speech scheduler (see Speech.say())
+        self.speech_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='speech')
+        # the responses: the skill and the speech of its answer (see Response.respond())
+        self.task_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='respond')
+
+    @staticmethod
+    def __call(executor, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
+
+    def listen(self, function, *args, **kwargs):
+        return self.__call(self.listen_executor, function, *args, **kwargs)
+
+    def speak(self, function, *args, **kwargs):
+        return self.__call(self.speech_executor, function, *args, **kwargs)
+
+    def run(self, function, *args, **kwargs):
+        return self.__call(self.task_executor, function, *args, **kwargs)
+
+    def shutdown(self):
+        for executor in (self.listen_executor, self.speech_executor, self.task_executor):
+            executor.shutdown(wait=False)
+
+
+class ConversationOrchestrator:
+
+    def __init__(self, alex, adapter=None):
+        """'alex' is the AlexAPI: its listening, speech and responses are used."""
+        self.alex = alex
+        self.adapter = adapter or BlockingAdapter()
+
+        self.__loop = None
+        self.__terminated = None  # asyncio.Event, set on the program termination
+        self.__reports = None  # asyncio.Event, set when a new report is added
+
+        self.barge_ins = 0  # speech stopped by the wake-word
+
+    def run(self):
+        """Runs the conversation until the program terminates (blocking)."""
+        asyncio.run(self.__main())
+
+    # ------------- events from the threads -------------
+    def __on_terminate(self):
+        self.__loop.call_soon_threadsafe(self.__terminated.set)
+
+    def __on_report(self):
+        self.__loop.call_soon_threadsafe(self.__reports.set)
+
+    async def __main(self):
+        self.__loop = asyncio.get_running_loop()
+        self.__terminated = asyncio.Event()
+        self.__reports = asyncio.Event()
+
+        sig.add_terminate_listener(self.__on_terminate)
+        reporter.add_report_listener(self.__on_report)
+        if sig.program_terminate:
+            self.__terminated.set()
+
+        try:
+            while not self.__terminated.is_set():
+                await self.__idle()
+        finally:
+            sig.remove_terminate_listener(self.__on_terminate)
+            reporter.remove_report_listener(self.__on_report)
+            self.adapter.shutdown()
+
+    @staticmethod
+    async def __first(future, *events):
+        """Awaits 'future' or one of the 'events' (asyncio.Event). Returns True if 'future' is done."""
+        waiters = [asyncio.ensure_future(event.wait()) for event in events]
+        try:
+            done, _ = await asyncio.wait([future, *waiters], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+        return future in done
+
+    # ------------- awaitable listening, speech and responses -------------
+    async def __listen(self, function, *args, interrupt_on_reports=False, **kwargs):
+        """
+        Runs a listening function of Listen, until it returns, or the program terminates
+        (or a new report is added, with 'interrupt_on_reports'). Then the listening is cancelled,
+        and its result is the same as if nothing was heard.
+        """
+        future = asyncio.ensure_future(self.adapter.listen(function, *args, **kwargs))
+        events = (self.__terminated, self.__reports) if interrupt_on_reports else (self.__terminated,)
+        if not await self.__first(future, *events):
+            self.alex.cancel_listening()
+        try:
+            return await future
+        finally:
+            self.alex.clear_listening_cancel()
+
+    async def __while_listening(self, work):
+        """
+        Awaits 'work' (the future of an answer or a speech) while listening for the wake-word. This is the only
+        barge-in path: the wake-word stops the speech (see Speech.barge_in()). Returns True if the user barged in.
+        """
+        wakeword = asyncio.ensure_future(self.adapter.listen(self.alex.listen_for_wakeword))
+        terminated = asyncio.ensure_future(self.__terminated.wait())
+
+        done, _ = await asyncio.wait([work, wakeword, terminated], return_when=asyncio.FIRST_COMPLETED)
+        terminated.cancel()
+        if wakeword in done and wakeword.result()[0] >= 0:
+            self.barge_ins += 1
+            print(f"[Alex: Barge-in (wake-word {wakeword.result()[0]})]")
+            self.alex.barge_in(wakeword.result()[0])
+            return True
+
+        # the work is finished (or a ringing message came, it is left for the next listening)
+        if self.__terminated.is_set():
+            self.alex.stop_speaking()
+        self.alex.cancel_listening()
+        try:
+            await wakeword
+        finally:
+            self.alex.clear_listening_cancel()
+        if wakeword.result()[1]:
+            sig.set_ringing_msg(wakeword.result()[1])
+        return False
+
+    async def __speak(self, text, priority=ANSWER, about='general', msg_type='say'):
+        """Speaks a message (see Speech.say()). Returns True if the user barged in."""
+        speech = asyncio.ensure_future(self.adapter.speak(self.alex.say, text, priority=priority, about=about,
+                                                          msg_type=msg_type, wait=True))
+        barged_in = await self.__while_listening(speech)
+        await speech
+        return barged_in
+
+    async def __respond(self, intent, slots):
+        """
+        Responds to a command (the skill and its speech run in the task executor), while listening for the wake-word.
+        The wake-word stops the answer. Returns (the result of respond(), True if the user barged in).
+        """
+        print("[Alex: processing...]")
+        response = asyncio.ensure_future(self.adapter.run(self.alex.respond, intent, slots))
+        barged_in = await self.__while_listening(response)
+
+        try:
+            result = await response
+        except Exception as e:
+            print(f"ERR: while responding to '{intent}': {e}")
+            result = False
+        return result, barged_in
+
+    async def __speak_reports(self):
+        """Speaks all the reports in the queue, as one message (see Speech.deliver_reports()). Returns True on barge-in."""
+        self.__reports.clear()
+        speech = asyncio.ensure_future(self.adapter.speak(self.alex.deliver_reports))
+        barged_in = await self.__while_listening(speech)
+        await speech
+        return barged_in
+
+    # ------------- the conversation -------------
+    async def __idle(self):
+        alex = self.alex
+        alex.is_idle = True
+        preroll = False
+
+        wakeword_index, ringing_msg = await self.__listen(alex.listen_for_wakeword)
+        if self.__terminated.is_set():
+            return
+
+        if wakeword_index == -1 and ringing_msg:
+            # idle listening stopped because PDA has something to say:
+            print(f"Ringing detected: {ringing_msg}")
+            await self.__speak(ringing_msg, priority=ALERT, about='ringing')
+            # at this point the conversation continues to 'engaged' mode, waiting for user response
+
+        elif wakeword_index == -1:
+            if not alex.capture.is_running:
+                print("ERR: the audio capture is stopped. Terminating...")
+                sig.terminate()
+            return
+
+        else:
+            # the user may not wait for the wakeup reply ('hey Alex what's the weather').
+            # If a command is already in flight, it is answered directly, without the wakeup reply.
+            intent, slots, ringing_msg = await self.__listen(alex.listen_for_inflight_cmd)
+            if intent and slots:
+                await self.__respond(intent, slots)
+            elif ringing_msg:
+                await self.__speak(ringing_msg, priority=ALERT, about='ringing')
+            else:
+                timezone = alex.senses.location.timezone
+                with tracer.span('wakeup_response'):
+                    return_msg = alex.wakeup_response(wakeword_index, timezone)  # generating response for the index
+                if not return_msg:
+                    return  # a non-used wakeup phrase: back to idle
+
+                await self.__speak(return_msg, about='wakeup')
+                # if the in-flight check is disabled, the pre-roll is replayed on the first engaged listening.
+                preroll = not alex.PREROLL['skip_wakeup_reply']
+
+        await self.__engage(preroll=preroll)
+
+    async def __engage(self, preroll=False):
+        """
+        Main listening for commands and questions. It uses respond() from the Response class.
+        It has two modes:
+        - Engaged: directly speak the command. It lasts MODE_TIMEOUT['engaged'] from the last command,
+          or until the gibberish (or unused) commands exceed GIBBERISH_LIMIT['engaged'].
+        - Not Engaged: the word "Alex" need to be included in the command.
+        If 'preroll' is True, the first listening starts with the audio captured before the wakeup reply.
+        """
+        alex = self.alex
+        alex.is_idle = False
+        while not self.__terminated.is_set() and not alex.is_idle:
+
+            gibberish_talks = 0
+            while not self.__terminated.is_set() and gibberish_talks <= alex.GIBBERISH_LIMIT['engaged']:
+                print("[Alex: Engaged. Listening...]")
+                intent, slots, ringing_msg = await self.__listen(alex.listen_for_cmd, alex.MODE_TIMEOUT['engaged'],
+                                                                 engaged=True, preroll=preroll,
+                                                                 interrupt_on_reports=True)
+                preroll = False
+                if self.__terminated.is_set():
+                    return
+
+                if ringing_msg and alex.answer_expected is not None:
+                    # This ringing is a reminder that an answer/confirmation is expected ('Sir are you there?).
+                    await self.__speak(ringing_msg, priority=ALERT, about='ringing', msg_type='ask')
+                elif ringing_msg or self.__reports.is_set():
+                    # New reports. There is no 'sir are you there', because PDA is already engaged.
+                    await self.adapter.run(sig.ringing_stop)
+                    await self.__speak_reports()
+                elif intent and slots:
+                    result, barged_in = await self.__respond(intent, slots)
+                    if not result and not barged_in:
+                        gibberish_talks += 1
+                    # after a barge-in, the loop continues to listen (engaged) for the next command
+                else:
+                    # the engaged TIMEOUT passed on silence
+                    break
+
+            # when the 'engaged' timeout pass on silence, the PDA stops to be engaged.
+            # the user needs to include 'Alex' in the command to engage the PDA again.
+            gibberish_talks = 0
+            if self.__terminated.is_set():
+                return
+
+            print("[Alex: Not Engaged. Listening...]")
+            intent, slots, ringing_msg = await self.__listen(alex.listen_for_cmd, alex.MODE_TIMEOUT['disengaged'],
+                                                             engaged=False, interrupt_on_reports=True)
+            if self.__terminated.is_set():
+                return
+
+            if (ringing_msg or self.__reports.is_set()) and not alex.answer_expected:
+                await self.adapter.run(sig.ringing_stop)
+                await self.__speak_reports()
+                # Note: after all the reports are spoken, the PDA goes to 'engaged' mode.
+
+            elif intent and slots:
+                result, barged_in = (False, False) if intent == 'general' else await self.__respond(intent, slots)
+                if not result and not barged_in:
+                    if gibberish_talks <= alex.GIBBERISH_LIMIT['disengaged']:
+                        gibberish_talks += 1
+                    else:
+                        alex.is_idle = True
+            else:
+                # nothing understood: back to idle (listen_for_wakeword).
+                alex.is_idle = True
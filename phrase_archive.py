@@ -0,0 +1,316 @@
+"""
+The PACKED phrase audio archive, used from the offline phrase cache (phrase_cache.py) and the player (playback.py).
+
+The offline cache was thousands of tiny mp3 files in 'offline_audio/': a directory lookup, an open/close
+and a random SD card read for every phrase spoken (and an inode for each one).
+Here, the phrases are packed into ONE append-only file ('offline_audio/phrases.pack'), read through mmap:
+- every record is [header, name, audio]. The name is the file name of the phrase in the cache index.
+  The audio is the decoded PCM (16-bit mono, at the archive sample rate), or the original mp3/wav bytes.
+- the offset index (name -> offset, length) is kept in memory, and saved to 'phrases.pack.idx'.
+  At startup, only the records appended after the saved index are scanned (a broken tail is truncated).
+- a removed phrase is an appended 'tombstone' record. Its space is reclaimed by compact().
+
+Usage:
+    archive = PhraseArchive(directory)
+    archive.append('5ba93c9db0cff93f52b521d7420e43f6eda2784f.mp3', pcm)
+    pcm, is_pcm = archive.read('5ba93c9db0cff93f52b521d7420e43f6eda2784f.mp3')
+"""
+
+# ======================== IMPORT =========================
+import atexit
+import json
+import mmap
+import os
+import struct
+import threading
+
+# ======================= GLOBALS =========================
+ARCHIVE_NAME = 'phrases.pack'
+
+
+# ======================= CLASSES =========================
+
+class PhraseArchive:
+    PCM = 0  # decoded audio, played as it is
+    ORIGINAL = 1  # the mp3/wav bytes, decoded when played
+    TOMBSTONE = 2  # the phrase was removed
+
+    __MAGIC = b'PHRPACK1'
+    __HEADER = struct.Struct('<8sI4x')  # magic, sample rate
+    __RECORD_MAGIC = b'PHR\x00'
+    __RECORD = struct.Struct('<4sBHI')  # magic, kind, name length, audio length
+    __SAVE_EVERY = 20  # the index is saved after every 20 changes (and on program exit)
+
+    def __init__(self, directory, sample_rate=24000, name=ARCHIVE_NAME, read_only=False):
+        self.path = os.path.join(directory, name)
+        self.index_file = self.path + '.idx'
+        self.sample_rate = sample_rate  # of the PCM records. It is the same as the player's (see playback.py).
+        self.read_only = read_only  # opened by another process (a report): nothing is written
+
+        self.__index = {}  # name -> (offset of the audio, length, kind)
+        self.__live_bytes = 0  # the records in the index, with their headers
+        self.__file = None
+        self.__mm = None
+        self.__lock = threading.RLock()
+        self.__unsaved = 0
+
+        self.reads = 0
+        self.appends = 0
+        self.compactions = 0
+
+        self.open()
+        if not read_only:
+            atexit.register(self.close)
+
+    # ------------- opening -------------
+    def open(self):
+        with self.__lock:
+            try:
+                if not self.read_only:
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                if not self.__is_valid_archive():
+                    if self.read_only:
+                        return
+                    self.__create()
+                self.__file = open(self.path, 'rb' if self.read_only else 'r+b')
+                self.__mm = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+
+                index, scanned_to = self.__load_index()
+                self.__index = index
+                self.__scan(scanned_to)
+                self.__live_bytes = sum(self.__record_size(name, entry[1]) for name, entry in self.__index.items())
+            except OSError as e:
+                print(f"ERR: the phrase archive is not available: {e}")
+                self.close()
+
+    def __is_valid_archive(self):
+        try:
+            with open(self.path, 'rb') as file:
+                magic, sample_rate = self.__HEADER.unpack(file.read(self.__HEADER.size))
+        except FileNotFoundError:
+            return False
+        except struct.error:
+            print("ERR: the phrase archive is broken, a new one is created.")
+            return False
+        if magic != self.__MAGIC or sample_rate != self.sample_rate:
+            print(f"ERR: the phrase archive is not compatible ({magic}, {sample_rate} Hz), a new one is created.")
+            return False
+        return True
+
+    def __create(self):
+        with open(self.path, 'wb') as file:
+            file.write(self.__HEADER.pack(self.__MAGIC, self.sample_rate))
+        try:
+            os.remove(self.index_file)
+        except FileNotFoundError:
+            pass
+
+    def __load_index(self):
+        """The saved index, and the archive size it covers. The records after that size are scanned."""
+        try:
+            with open(self.index_file) as file:
+                data = json.load(file)
+            if data['size'] <= len(self.__mm):
+                return {name: tuple(entry) for name, entry in data['records'].items()}, data['size']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"ERR: the phrase archive index is broken, it will be rebuilt: {e}")
+        return {}, self.__HEADER.size
+
+    def __scan(self, offset):
+        """Adds the records from 'offset' to the end of the archive to the index."""
+        size = len(self.__mm)
+        while offset + self.__RECORD.size <= size:
+            magic, kind, name_length, length = self.__RECORD.unpack_from(self.__mm, offset)
+            data_offset = offset + self.__RECORD.size + name_length
+            if magic != self.__RECORD_MAGIC or data_offset + length > size:
+                break
+            name = self.__mm[offset + self.__RECORD.size:data_offset].decode('utf-8')
+            if kind == self.TOMBSTONE:
+                self.__index.pop(name, None)
+            else:
+                self.__index[name] = (data_offset, length, kind)
+            offset = data_offset + length
+
+        if offset < size and not self.read_only:
+            # a record cut by a power loss. It is dropped (its phrase is packed again from the cache).
+            print(f"ERR: the phrase archive has a broken tail ({size - offset} bytes), it is truncated.")
+            self.__mm.close()
+            self.__file.truncate(offset)
+            self.__mm = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        with self.__lock:
+            if self.__file is None:
+                return
+            if not self.read_only:
+                self.save_index()
+            if self.__mm is not None:
+                self.__mm.close()
+            self.__file.close()
+            self.__mm = None
+            self.__file = None
+
+    # ------------- records -------------
+    @property
+    def is_available(self):
+        return self.__mm is not None
+
+    def __contains__(self, name):
+        return name in self.__index
+
+    def __len__(self):
+        return len(self.__index)
+
+    def __record_size(self, name, length):
+        return self.__RECORD.size + len(name.encode('utf-8')) + length
+
+    def read(self, name):
+        """Returns (audio bytes, is_pcm), or None if the phrase is not in the archive. No file is opened."""
+        with self.__lock:
+            entry = self.__index.get(name)
+            if entry is None or self.__mm is None:
+                return None
+            offset, length, kind = entry
+            if offset + length > len(self.__mm):
+                # appended after the last mapping
+                self.__remap()
+            self.reads += 1
+            return self.__mm[offset:offset + length], kind == self.PCM
+
+    def __remap(self):
+        self.__mm.close()
+        self.__mm = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __write_record(self, name, kind, data=b''):
+        name_bytes = name.encode('utf-8')
+        self.__file.seek(0, os.SEEK_END)
+        offset = self.__file.tell()
+        self.__file.write(self.__RECORD.pack(self.__RECORD_MAGIC, kind, len(name_bytes), len(data)) + name_bytes)
+        self.__file.write(data)
+        self.__file.flush()
+        return offset + self.__RECORD.size + len(name_bytes)
+
+    def append(self, name, data, is_pcm=True):
+        """Appends a phrase (online: it can be read while the archive is in use). Returns True if it was written."""
+        with self.__lock:
+            if self.__file is None or self.read_only:
+                return False
+            try:
+                old_entry = self.__index.get(name)
+                data_offset = self.__write_record(name, self.PCM if is_pcm else self.ORIGINAL, data)
+            except OSError as e:
+                print(f"ERR: while appending to the phrase archive: {e}")
+                return False
+            if old_entry is not None:
+                self.__live_bytes -= self.__record_size(name, old_entry[1])
+            self.__index[name] = (data_offset, len(data), self.PCM if is_pcm else self.ORIGINAL)
+            self.__live_bytes += self.__record_size(name, len(data))
+            self.appends += 1
+            self.__changed()
+            return True
+
+    def remove(self, name):
+        """Removes a phrase. Its space is reclaimed by the next compaction."""
+        with self.__lock:
+            entry = self.__index.get(name)
+            if entry is None or self.__file is None or self.read_only:
+                return
+            try:
+                self.__write_record(name, self.TOMBSTONE)
+            except OSError as e:
+                print(f"ERR: while removing from the phrase archive: {e}")
+                return
+            del self.__index[name]
+            self.__live_bytes -= self.__record_size(name, entry[1])
+            self.__changed()
+
+    # ------------- compaction -------------
+    @property
+    def size(self):
+        with self.__lock:
+            if self.__file is None:
+                return 0
+            return os.fstat(self.__file.fileno()).st_size
+
+    @property
+    def dead_bytes(self):
+        """The space taken by the removed and replaced phrases (and the tombstones)."""
+        return max(self.size - self.__HEADER.size - self.__live_bytes, 0)
+
+    def needs_compaction(self, min_ratio=0.25, min_bytes=1024 * 1024):
+        dead_bytes = self.dead_bytes
+        return dead_bytes >= min_bytes and dead_bytes >= min_ratio * self.size
+
+    def compact(self):
+        """Rewrites the archive with the live phrases only (into a temp file first, so a power cut is harmless)."""
+        with self.__lock:
+            if self.__file is None or self.read_only:
+                return
+            dead_bytes = self.dead_bytes
+            tmp_path = self.path + '.tmp'
+            index = {}
+            try:
+                self.__remap()
+                with open(tmp_path, 'wb') as file:
+                    file.write(self.__HEADER.pack(self.__MAGIC, self.sample_rate))
+                    for name, (offset, length, kind) in self.__index.items():
+                        name_bytes = name.encode('utf-8')
+                        file.write(self.__RECORD.pack(self.__RECORD_MAGIC, kind, len(name_bytes), length) + name_bytes)
+                        index[name] = (file.tell(), length, kind)
+                        file.write(self.__mm[offset:offset + length])
+                    file.flush()
+                    os.fsync(file.fileno())
+
+                self.__mm.close()
+                self.__file.close()
+                # the saved index does not match the new offsets. It is saved again below.
+                try:
+                    os.remove(self.index_file)
+                except FileNotFoundError:
+                    pass
+                os.replace(tmp_path, self.path)
+                self.__file = open(self.path, 'r+b')
+                self.__mm = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+            except OSError as e:
+                print(f"ERR: while compacting the phrase archive: {e}")
+                self.close()
+                self.open()
+                return
+
+            self.__index = index
+            self.compactions += 1
+            self.save_index()
+        print(f"Phrase archive compacted: {len(index)} phrases, {dead_bytes // 1024} KB reclaimed.")
+
+    # ------------- index -------------
+    def __changed(self):
+        self.__unsaved += 1
+        if self.__unsaved >= self.__SAVE_EVERY:
+            self.save_index()
+
+    def save_index(self):
+        with self.__lock:
+            if self.__file is None:
+                return
+            data = json.dumps({'size': self.size, 'records': self.__index})
+            self.__unsaved = 0
+        try:
+            tmp_file = self.index_file + '.tmp'
+            with open(tmp_file, 'w') as file:
+                file.write(data)
+            os.replace(tmp_file, self.index_file)
+        except OSError as e:
+            print(f"ERR: while saving the phrase archive index: {e}")
+
+    def status(self):
+        return {
+            'available': self.is_available,
+            'phrases': len(self.__index),
+            'kb': self.size // 1024,
+            'dead_kb': self.dead_bytes // 1024,
+            'reads': self.reads,
+            'appends': self.appends,
+            'compactions': self.compactions,
+        }
@@ -0,0 +1,162 @@
+"""
+OFFLINE PHRASE ASSEMBLY: speaking a templated answer from cached audio fragments.
+
+Most of the answers are templates with a few variable parts ("It's 25 minutes past 7 Sir.", "It's Monday, 17th of October",
+"12 degrees in Keighley"...). The whole-sentence cache misses for every new number or time, so offline,
+such an answer fell back to 'disconnected.mp3'.
+
+Here, the answer is split into FRAGMENTS (numbers 0-100, hours, weekdays, months, unit words, city names and
+the fixed parts of the templates), each one synthesized once and kept in the offline phrase cache.
+At playback time, the decoded PCM of the fragments is concatenated (with the silence around them trimmed,
+and a short pause at the punctuation), so the answer is spoken with no network at all.
+
+The fragments are synthesized in advance by the phrase warmer (see fragment_phrases() and phrase_warmer.py).
+"""
+
+# ======================== IMPORT =========================
+import calendar
+import re
+
+import numpy as np
+
+from sense_skills import SenseSingleton
+
+
+# ======================= CLASSES =========================
+
+class PhraseAssembler:
+    # the fixed parts of the templates (task_skills_v2.py, alex.py)
+    TEMPLATE_WORDS = [
+        "It's", "Sir", "The time now is", "o'clock", "half past", "minutes past", "minutes to", "AM", "PM", "oh",
+        "today is", "tomorrow is", "On", "will be", "It will be", "of", "first", "second", "third",
+        "twenty-first", "twenty-second", "twenty-third", "thirty-first",
+        "Current location is set to", "in", "at", "and", "about", "with probability of", "is",
+    ]
+    UNIT_WORDS = [
+        "degrees", "percent", "mm", "mm per hour", "miles per hour", "meters per second", "kilometers per hour",
+        "minutes", "hours", "seconds", "days",
+    ]
+
+    __MAX_WORDS = 5  # the longest fragment, in words
+    __PAUSE_SEC = {',': 0.12, '.': 0.25, '!': 0.25, '?': 0.25}
+    __SILENCE_LEVEL = 300  # samples below that level are trimmed from the ends of a fragment
+    __MARGIN_SEC = 0.02  # kept around the trimmed fragment, so the words do not sound cut
+
+    __TIME = re.compile(r'^(\d{1,2}):(\d{2})$')
+
+    def __init__(self, cache, player):
+        self.cache = cache  # PhraseCache (phrase_cache.py)
+        self.player = player  # AudioPlayer (playback.py), decoding the fragments into PCM (and keeping the hot ones)
+
+        self.assembled = 0
+        self.misses = 0
+
+    # ------------- fragments -------------
+    @classmethod
+    def fragment_phrases(cls):
+        """All the fragments to be synthesized in advance (see phrase_warmer.py)."""
+        phrases = set(cls.TEMPLATE_WORDS + cls.UNIT_WORDS)
+        phrases.update(str(number) for number in range(101))
+        phrases.update(cls.__ordinal(day) for day in range(4, 31) if day not in (21, 22, 23))
+        phrases.update(calendar.day_name)
+        phrases.update(name for name in calendar.month_name if name)
+        try:
+            city = SenseSingleton.get_instance().location.city
+            if city:
+                phrases.add(city)
+        except Exception as e:
+            print(f"ERR: the city name is not available for the phrase assembly: {e}")
+        return phrases
+
+    @staticmethod
+    def __ordinal(day):
+        # the same as the date answers in TimeQueries.process(): '4th', '25th'... (1, 2, 3, 21... are words)
+        suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(day % 10, 'th')
+        return f"{day}{suffix}"
+
+    def __tokens(self, text):
+        """Splits the text into words, and the pause after each one: [(word, pause_sec), ...]."""
+        tokens = []
+        for word in text.split():
+            pause = 0.0
+            while word and word[-1] in self.__PAUSE_SEC:
+                pause = max(pause, self.__PAUSE_SEC[word[-1]])
+                word = word[:-1]
+            if not word:
+                continue
+
+            # '7:05' is spoken as 'seven oh five', '7:30' as 'seven thirty' and '7:00' as 'seven'
+            match = self.__TIME.match(word)
+            if match:
+                hour, minute = match.groups()
+                tokens.append((str(int(hour)), 0.0))
+                if minute != '00':
+                    if minute[0] == '0':
+                        tokens.append(('oh', 0.0))
+                    tokens.append((str(int(minute)), 0.0))
+                tokens[-1] = (tokens[-1][0], pause)
+            else:
+                tokens.append((word, pause))
+        return tokens
+
+    def plan(self, text, voice=0, rate=0.9):
+        """
+        Covers the text with the longest cached fragments.
+        Returns [(fragment, path, pause_sec), ...], or None if any part of the text is not available.
+        The cache usage is not counted here (most of the tried fragments are not played), see assemble().
+        """
+        tokens = self.__tokens(text)
+        plan = []
+        i = 0
+        while i < len(tokens):
+            for j in range(min(len(tokens), i + self.__MAX_WORDS), i, -1):
+                # a fragment does not span over a pause (the punctuation)
+                if any(pause for _, pause in tokens[i:j - 1]):
+                    continue
+                fragment = " ".join(word for word, _ in tokens[i:j])
+                path = self.cache.peek(fragment, voice, rate)
+                if path is not None:
+                    plan.append((fragment, path, tokens[j - 1][1]))
+                    i = j
+                    break
+            else:
+                return None
+        return plan or None
+
+    def __trim(self, pcm):
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        loud = np.flatnonzero(np.abs(samples) > self.__SILENCE_LEVEL)
+        if len(loud) == 0:
+            return b''
+        margin = int(self.__MARGIN_SEC * self.player.sample_rate)
+        start = max(loud[0] - margin, 0)
+        end = min(loud[-1] + margin, len(samples))
+        return samples[start:end].tobytes()
+
+    def assemble(self, text, voice=0, rate=0.9):
+        """Returns the PCM of the whole text, assembled from the cached fragments, or None if it is not possible."""
+        plan = self.plan(text, voice, rate)
+        if plan is None:
+            self.misses += 1
+            return None
+
+        parts = []
+        for _, path, pause in plan:
+            pcm = self.player.decode(path)
+            if pcm is None:
+                self.misses += 1
+                return None
+            parts.append(self.__trim(pcm))
+            # a short gap between the words, a longer one at the punctuation
+            gap = pause if pause else 0.04
+            parts.append(b'\x00\x00' * int(gap * self.player.sample_rate))
+
+        # only the fragments actually played are counted as used
+        for fragment, _, _ in plan:
+            self.cache.lookup(fragment, voice, rate)
+
+        self.assembled += 1
+        return b''.join(parts)
+
+    def status(self):
+        return {'assembled': self.assembled, 'misses': self.misses}
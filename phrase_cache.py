@@ -0,0 +1,612 @@
+"""
+This module keeps the index of the OFFLINE phrase audio (the phrases already synthesized and saved as mp3),
+used from the Speech class (respond.py).
+
+The phrases are content-addressed: the file name is a hash of (normalised text, voice, rate),
+so a phrase of any length can be saved (the old names, made from the text with 'encode_str()',
+were limited by the 255 bytes max file name). The original text and the usage of every phrase
+are kept in a sidecar manifest ('offline_audio/manifest.json').
+
+The manifest is read ONCE at startup into an in-memory dict. After that, answering
+'is this phrase available offline?' does not touch the disk. The index is updated every time a new phrase is saved.
+The manifest and the usage are saved by the background job (see start_packing()), never from a lookup.
+The phrase store has a size cap. When it is exceeded, the least recently (LRU) or least frequently (LFU)
+used phrases are deleted. The victim is taken among the few least recently used ones, so an admission or an
+eviction does not scan the whole index.
+
+ADMISSION ('tinylfu' policy, the default): every phrase looked up is counted in a small frequency sketch
+(FrequencySketch, with aging), the cached and the missed ones. A new phrase is saved only if it was already
+asked for (should_admit()), and when the store is full, only if it is more frequent than the phrase it would evict.
+So the one-off sentences (with a time or a temperature in them) do not push out the phrases spoken every day.
+The usage (hit rate, the missed phrases and their frequency) is kept in 'offline_audio/usage.json', and listed with:
+    python phrase_cache.py report
+
+Note: the old per-text files ('Good_d_morning_c_.mp3') are still found. They are indexed as the default voice and rate.
+Note: the phrases rendered by the local synthesizer (wav) are flagged 'local', to be replaced with the cloud voice later.
+
+PACKING: the saved phrase files are moved into one memory-mapped archive ('offline_audio/phrases.pack',
+see phrase_archive.py) by a background job (start_packing()), and the loose files are deleted.
+The index entry keeps its file name: the player reads the phrase from the archive if it is there,
+and from the file otherwise (the per-file layout is still read, and a new phrase is a file until it is packed).
+"""
+
+# ======================== IMPORT =========================
+import argparse
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from phrase_archive import PhraseArchive
+from tools import decode_str
+from events import Signals as sig
+
+# ======================= GLOBALS =========================
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OFFLINE_AUDIO_DIR = os.path.join(BASE_DIR, 'offline_audio')
+MANIFEST_NAME = 'manifest.json'
+USAGE_NAME = 'usage.json'
+SKETCH_NAME = 'frequency.npz'
+HITS_FILE = os.path.join(BASE_DIR, 'db', 'phrase_hits.json')  # hit counters of the old versions (migrated)
+
+DEFAULT_VOICE = 0
+DEFAULT_RATE = 0.9
+
+
+# ======================= CLASSES =========================
+
+class FrequencySketch:
+    """
+    A count-min sketch of the phrase frequencies (4-bit counters, as in TinyLFU).
+    Aging: all the counters are halved every 'sample_size' increments, so the old popularity fades.
+    """
+    __DEPTH = 4
+    __MAX_COUNT = 15
+
+    def __init__(self, width=4096, sample_size=None):
+        self.width = width
+        self.sample_size = sample_size or 10 * width
+        self.table = np.zeros((self.__DEPTH, width), dtype=np.uint8)
+        self.additions = 0
+        self.__rows = np.arange(self.__DEPTH)
+
+    def __columns(self, key):
+        # 'key' is a sha1 hex digest (see PhraseCache.key()): 8 hex digits per row
+        return [int(key[8 * row:8 * row + 8], 16) % self.width for row in range(self.__DEPTH)]
+
+    def increment(self, key):
+        columns = self.__columns(key)
+        counts = self.table[self.__rows, columns]
+        minimum = counts.min()
+        if minimum < self.__MAX_COUNT:
+            # conservative update: only the smallest counters are incremented
+            self.table[self.__rows, columns] = np.maximum(counts, minimum + 1)
+
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.table >>= 1
+            self.additions //= 2
+
+    def estimate(self, key):
+        return int(self.table[self.__rows, self.__columns(key)].min())
+
+    def save(self, path):
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'wb') as file:
+            np.savez(file, table=self.table, additions=self.additions)
+        os.replace(tmp_file, path)
+
+    def load(self, path):
+        try:
+            with np.load(path) as data:
+                if data['table'].shape == self.table.shape:
+                    self.table = data['table'].astype(np.uint8)
+                    self.additions = int(data['additions'])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            print(f"ERR: the phrase frequency sketch is broken, it is reset: {e}")
+
+
+class PhraseCache:
+    __SAVE_EVERY = 20  # after 20 changes the background job saves the manifest (else every round, and on program exit)
+    __PACK_EVERY = 60  # seconds between two packing rounds (a new phrase wakes the packer earlier)
+    __PACK_DELAY = 5  # seconds a new phrase stays a file, so the packer does not compete with its first playback
+    __ADMIT_MIN = 2  # with 'tinylfu', a phrase is saved from its second use
+    __MAX_MISSED = 500  # the missed phrases kept for the report
+    __EVICTION_SAMPLE = 8  # the victim is chosen among the 8 least recently used phrases (not a scan of the index)
+
+    def __init__(self, directory=OFFLINE_AUDIO_DIR, max_bytes=200 * 1024 * 1024, policy='tinylfu', sample_rate=24000,
+                 read_only=False):
+        self.directory = directory
+        self.manifest_file = os.path.join(directory, MANIFEST_NAME)
+        self.usage_file = os.path.join(directory, USAGE_NAME)
+        self.sketch_file = os.path.join(directory, SKETCH_NAME)
+        self.max_bytes = max_bytes
+        self.policy = policy  # 'lru' / 'lfu' / 'tinylfu'
+        # read only: a report, while the PDA is running. Nothing is written (the PDA saves the manifest).
+        self.read_only = read_only
+
+        # key -> {'text', 'voice', 'rate', 'file', 'size', 'created', 'last_used', 'hits', 'local', 'packed'}
+        self.__index = {}
+        self.__recency = OrderedDict()  # the keys of the index, the least recently used first
+        self.__total_bytes = 0
+        self.__unsaved = 0
+        self.__lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.admitted = 0
+        self.rejected = 0
+
+        # the phrase frequencies (cached or not), and the recent misses: key -> {'text', 'voice', 'rate', 'misses', 'last_seen'}
+        self.sketch = FrequencySketch()
+        self.__missed = OrderedDict()
+
+        # the packed phrases (see phrase_archive.py). Opened before the scan: a packed phrase has no file.
+        self.archive = PhraseArchive(directory, sample_rate, read_only=read_only)
+        self.packed = 0
+        self.__pack_event = threading.Event()
+
+        # called with the path of a phrase evicted or replaced, so its decoded audio is dropped (see AudioPlayer.forget())
+        self.on_forget = None
+        self.__is_packing = False
+
+        self.scan()
+        self.__load_usage()
+        if not read_only:
+            atexit.register(self.save)
+
+    @staticmethod
+    def normalise(text):
+        """'  Good  morning Sir! ' -> 'good morning sir!' (the punctuation is kept, it changes the intonation)"""
+        return " ".join(text.split()).casefold()
+
+    @classmethod
+    def key(cls, text, voice=DEFAULT_VOICE, rate=DEFAULT_RATE):
+        """The content address of a phrase: a hash of (normalised text, voice, rate)."""
+        data = f"{cls.normalise(text)}|{voice}|{float(rate)}"
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    # ------------- index -------------
+    def scan(self):
+        """Reads the manifest (and the old per-text files) into the in-memory index. Called once at startup."""
+        index = {}
+        try:
+            if not self.read_only:
+                os.makedirs(self.directory, exist_ok=True)
+            try:
+                with open(self.manifest_file) as file:
+                    index = json.load(file)
+            except FileNotFoundError:
+                pass
+            except json.JSONDecodeError as e:
+                print(f"ERR: the offline audio manifest is broken, it will be rebuilt: {e}")
+
+            known_files = {entry['file'] for entry in index.values()}
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not entry.is_file() or not entry.name.endswith(('.mp3', '.wav')) or entry.name in known_files:
+                        continue
+                    if len(entry.name) == 44 and all(c in '0123456789abcdef' for c in entry.name[:40]):
+                        continue  # a hashed file without a manifest entry. Its text is unknown.
+                    if entry.name.endswith('.wav'):
+                        continue
+
+                    # an old per-text file. Indexed as the default voice and rate.
+                    text = decode_str(entry.name[:-4])
+                    stat = entry.stat()
+                    index[self.key(text)] = {
+                        'text': text, 'voice': DEFAULT_VOICE, 'rate': DEFAULT_RATE, 'file': entry.name,
+                        'size': stat.st_size, 'created': int(stat.st_mtime), 'last_used': int(stat.st_mtime), 'hits': 0,
+                    }
+
+            # the entries whose files were deleted outside of the program (or lost from the archive) are dropped
+            index = {key: entry for key, entry in index.items()
+                     if entry['file'] in self.archive or os.path.exists(os.path.join(self.directory, entry['file']))}
+            for entry in index.values():
+                entry['packed'] = entry['file'] in self.archive
+
+        except OSError as e:
+            print(f"ERR: while scanning the offline audio: {e}")
+
+        if not self.read_only:
+            self.__migrate_hits(index)
+
+        with self.__lock:
+            self.__index = index
+            self.__recency = OrderedDict((key, None) for key in sorted(index, key=lambda k: index[k]['last_used']))
+            self.__total_bytes = sum(entry['size'] for entry in index.values())
+        print(f"Offline audio: {len(index)} phrases indexed, {self.__total_bytes // 1024} KB.")
+
+    def __migrate_hits(self, index):
+        # the hit counters of the previous version were kept in a separate file, by text.
+        if not os.path.exists(HITS_FILE):
+            return
+        try:
+            with open(HITS_FILE) as file:
+                old_hits = json.load(file)
+            for entry in index.values():
+                entry['hits'] = max(entry['hits'], old_hits.get(self.normalise(entry['text']), 0))
+            os.rename(HITS_FILE, HITS_FILE + '.migrated')
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"ERR: while migrating the phrase hits: {e}")
+
+    def __len__(self):
+        return len(self.__index)
+
+    @property
+    def total_bytes(self):
+        return self.__total_bytes
+
+    def contains(self, text, voice=DEFAULT_VOICE, rate=DEFAULT_RATE):
+        return self.key(text, voice, rate) in self.__index
+
+    def peek(self, text, voice=DEFAULT_VOICE, rate=DEFAULT_RATE):
+        """Returns the path of the phrase audio, or None. Nothing is counted (see lookup())."""
+        entry = self.__index.get(self.key(text, voice, rate))
+        return os.path.join(self.directory, entry['file']) if entry is not None else None
+
+    def lookup(self, text, voice=DEFAULT_VOICE, rate=DEFAULT_RATE):
+        """Returns the path of the phrase audio, or None. Counts the hits and misses, and the phrase frequency."""
+        key = self.key(text, voice, rate)
+        with self.__lock:
+            self.sketch.increment(key)
+            entry = self.__index.get(key)
+            if entry is None:
+                self.misses += 1
+                self.__record_miss(key, text, voice, rate)
+                self.__unsaved += 1
+                return None
+
+            self.__missed.pop(key, None)
+            self.hits += 1
+            entry['hits'] += 1
+            entry['last_used'] = int(time.time())
+            self.__recency.move_to_end(key)
+            # only marked: the lookup is on the speaking path, the save is done by the background job
+            self.__unsaved += 1
+            return os.path.join(self.directory, entry['file'])
+
+    def __record_miss(self, key, text, voice, rate):
+        missed = self.__missed.pop(key, None) or {'text': text, 'voice': voice, 'rate': rate, 'misses': 0}
+        missed['misses'] += 1
+        missed['last_seen'] = int(time.time())
+        self.__missed[key] = missed  # the most recent last
+        while len(self.__missed) > self.__MAX_MISSED:
+            self.__missed.popitem(last=False)
+
+    def should_admit(self, text, voice=DEFAULT_VOICE, rate=DEFAULT_RATE):
+        """
+        True if a new phrase is worth saving offline. With 'tinylfu', a phrase is admitted from its second use,
+        and when the store is full, only if it is more frequent than the phrase it would evict.
+        """
+        if self.policy != 'tinylfu':
+            return True
+
+        key = self.key(text, voice, rate)
+        with self.__lock:
+            if key in self.__index:
+                return True  # a replacement (a local render)
+            frequency = self.sketch.estimate(key)
+            if frequency >= self.__ADMIT_MIN:
+                if self.__total_bytes < self.max_bytes:
+                    return True
+                victim = self.__victim()
+                if victim is None or frequency > self.sketch.estimate(victim):
+                    return True
+            self.rejected += 1
+            return False
+
+    def path_for(self, text, voice=DEFAULT_VOICE, rate=DEFAULT_RATE, audio_format='mp3'):
+        """Where a new phrase should be saved."""
+        return os.path.join(self.directory, f"{self.key(text, voice, rate)}.{audio_format}")
+
+    def is_local(self, text, voice=DEFAULT_VOICE, rate=DEFAULT_RATE):
+        """True if the phrase was rendered by the local synthesizer (see tts.py)."""
+        entry = self.__index.get(self.key(text, voice, rate))
+        return entry is not None and entry.get('local', False)
+
+    def local_phrases(self):
+        """The phrases rendered by the local synthesizer, to be replaced with the cloud voice: [(text, voice, rate), ...]"""
+        with self.__lock:
+            return [(entry['text'], entry['voice'], entry['rate']) for entry in self.__index.values() if entry.get('local')]
+
+    def add(self, text, path, voice=DEFAULT_VOICE, rate=DEFAULT_RATE, local=False):
+        """Called after a new phrase is saved, so the index stays up to date without a new scan."""
+        try:
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"ERR: the saved phrase is not found: {e}")
+            return
+
+        now = int(time.time())
+        key = self.key(text, voice, rate)
+        with self.__lock:
+            old_entry = self.__index.get(key)
+            if old_entry is not None:
+                self.__total_bytes -= old_entry['size']
+                self.__forget(old_entry['file'])
+                # the new file is read instead of the packed audio, until it is packed again
+                self.archive.remove(old_entry['file'])
+                if old_entry['file'] != os.path.basename(path):
+                    # a local render replaced with the cloud voice (a different file format)
+                    try:
+                        os.remove(os.path.join(self.directory, old_entry['file']))
+                    except OSError:
+                        pass
+            self.__index[key] = {
+                'text': text, 'voice': voice, 'rate': rate, 'file': os.path.basename(path),
+                'size': size, 'created': now, 'last_used': now, 'hits': old_entry['hits'] if old_entry else 0,
+                'local': local, 'packed': False,
+            }
+            self.__recency[key] = None
+            self.__recency.move_to_end(key)
+            self.__total_bytes += size
+            self.__missed.pop(key, None)
+            self.admitted += 1
+            self.__evict(keep=key)
+            self.__changed()
+        self.__pack_event.set()
+
+    # ------------- size cap -------------
+    def __eviction_order(self, key):
+        entry = self.__index[key]
+        if self.policy == 'tinylfu':
+            return self.sketch.estimate(key), entry['last_used']
+        if self.policy == 'lfu':
+            return entry['hits'], entry['last_used']
+        return entry['last_used'], entry['hits']
+
+    def __victim(self, keep=None):
+        """The phrase to evict: the lowest eviction order among the least recently used ones (see __EVICTION_SAMPLE)."""
+        candidates = []
+        for key in self.__recency:
+            if key != keep:
+                candidates.append(key)
+                if len(candidates) >= self.__EVICTION_SAMPLE:
+                    break
+        return min(candidates, key=self.__eviction_order, default=None)
+
+    def __evict(self, keep=None):
+        while self.__total_bytes > self.max_bytes:
+            key = self.__victim(keep)
+            if key is None:
+                break
+            del self.__recency[key]
+            entry = self.__index.pop(key)
+            self.__total_bytes -= entry['size']
+            self.evictions += 1
+            self.__forget(entry['file'])
+            if entry.get('packed'):
+                self.archive.remove(entry['file'])
+                continue
+            try:
+                os.remove(os.path.join(self.directory, entry['file']))
+            except OSError as e:
+                print(f"ERR: while removing an evicted phrase: {e}")
+
+    def __forget(self, file):
+        if self.on_forget is not None:
+            self.on_forget(os.path.join(self.directory, file))
+
+    # ------------- usage -------------
+    def usage(self, count=20):
+        """The most used cached phrases, with their frequency and recency: [{'text', 'hits', 'frequency', 'last_used'}, ...]"""
+        with self.__lock:
+            keys = sorted(self.__index, key=lambda k: self.__index[k]['hits'], reverse=True)[:count]
+            return [{'text': self.__index[k]['text'], 'hits': self.__index[k]['hits'],
+                     'frequency': self.sketch.estimate(k), 'last_used': self.__index[k]['last_used']} for k in keys]
+
+    def prewarm_candidates(self, count=20):
+        """
+        The phrases worth synthesizing in advance: the missed phrases asked for again and again (the most frequent,
+        then the most recent first), and the local renders. [{'text', 'voice', 'rate', 'misses', 'frequency', 'last_seen'}, ...]
+        """
+        with self.__lock:
+            candidates = [dict(missed, frequency=self.sketch.estimate(key)) for key, missed in self.__missed.items()
+                          if key not in self.__index]
+            candidates += [{'text': entry['text'], 'voice': entry['voice'], 'rate': entry['rate'], 'misses': 0,
+                            'frequency': self.sketch.estimate(key), 'last_seen': entry['last_used']}
+                           for key, entry in self.__index.items() if entry.get('local')]
+        candidates = [candidate for candidate in candidates if candidate['frequency'] >= self.__ADMIT_MIN]
+        candidates.sort(key=lambda candidate: (candidate['frequency'], candidate['last_seen']), reverse=True)
+        return candidates[:count]
+
+    def warm_up(self, count=50):
+        """
+        Reads the audio of the most used phrases once, on a background thread,
+        so they are in the OS page cache (the SD card is not touched when they are spoken).
+        """
+        def read_files():
+            with self.__lock:
+                entries = sorted(self.__index.values(), key=lambda entry: entry['hits'], reverse=True)[:count]
+            for entry in entries:
+                if entry.get('packed'):
+                    self.archive.read(entry['file'])
+                    continue
+                try:
+                    with open(os.path.join(self.directory, entry['file']), 'rb') as file:
+                        file.read()
+                except OSError:
+                    pass
+
+        threading.Thread(target=read_files, daemon=True).start()
+
+    # ------------- packing -------------
+    def start_packing(self, decode=None, is_busy=None):
+        """
+        Starts the background job moving the phrase files into the archive (see phrase_archive.py).
+        'decode(path)' returns the PCM of a file (AudioPlayer.decode()): the phrases are packed pre-decoded.
+        If it is None, the original mp3/wav bytes are packed (smaller, but decoded on every playback).
+        'is_busy()' returns True while the PDA is speaking: the packer waits.
+        The same job saves the manifest and the usage. It stops on the program termination (see stop_packing()).
+        """
+        if self.__is_packing:
+            return
+        self.__is_packing = True
+        sig.add_terminate_listener(self.stop_packing)
+        thread = threading.Thread(target=self.__packer_thread, args=(decode, is_busy), daemon=True)
+        thread.start()
+
+    def stop_packing(self):
+        self.__is_packing = False
+        self.__pack_event.set()
+
+    def __wait_idle(self, is_busy):
+        """Waits while the PDA is speaking. Returns False if the job is stopped meanwhile."""
+        while self.__is_packing and is_busy is not None and is_busy():
+            time.sleep(1)
+        return self.__is_packing
+
+    def __loose_entries(self):
+        with self.__lock:
+            return [(key, dict(entry)) for key, entry in self.__index.items() if not entry.get('packed')]
+
+    def __pack(self, key, entry, decode):
+        path = os.path.join(self.directory, entry['file'])
+        try:
+            if decode is not None:
+                data = decode(path)
+            else:
+                with open(path, 'rb') as file:
+                    data = file.read()
+        except OSError:
+            data = None
+        if not data:
+            return False
+        if not self.archive.append(entry['file'], data, is_pcm=decode is not None):
+            return False
+
+        with self.__lock:
+            current = self.__index.get(key)
+            if current is None or current['file'] != entry['file'] or current['created'] != entry['created']:
+                # evicted or saved again while it was packed: the packed audio is stale
+                self.archive.remove(entry['file'])
+                return False
+            current['packed'] = True
+            self.__total_bytes += len(data) - current['size']
+            current['size'] = len(data)
+            self.__changed()
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"ERR: while removing a packed phrase file: {e}")
+        self.packed += 1
+        return True
+
+    def __packer_thread(self, decode, is_busy):
+        wait_time = self.__PACK_EVERY
+        while self.__is_packing:
+            self.__pack_event.wait(wait_time)
+            self.__pack_event.clear()
+            if not self.__is_packing:
+                break
+
+            now = time.time()
+            is_postponed = False
+            if self.archive.is_available:
+                for key, entry in self.__loose_entries():
+                    if now - entry['created'] < self.__PACK_DELAY:
+                        is_postponed = True
+                        continue
+                    if not self.__wait_idle(is_busy):
+                        break
+                    self.__pack(key, entry, decode)
+
+                if self.archive.needs_compaction() and self.__wait_idle(is_busy):
+                    self.archive.compact()
+
+            if self.__unsaved:
+                self.save()
+
+            # the new phrases are packed on the next round, shortly
+            wait_time = self.__PACK_DELAY if is_postponed else self.__PACK_EVERY
+
+    # ------------- manifest -------------
+    def __changed(self):
+        self.__unsaved += 1
+        if self.__unsaved >= self.__SAVE_EVERY:
+            self.__pack_event.set()  # saved by the background job
+
+    def status(self):
+        lookups = self.hits + self.misses
+        return {
+            'phrases': len(self.__index),
+            'kb': self.__total_bytes // 1024,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(100 * self.hits / lookups, 1) if lookups else None,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'evictions': self.evictions,
+            'packed': self.packed,
+            'archive': self.archive.status(),
+        }
+
+    def save(self):
+        if self.read_only:
+            return
+        with self.__lock:
+            data = json.dumps(self.__index)
+            usage = json.dumps({'hits': self.hits, 'misses': self.misses, 'admitted': self.admitted,
+                                'rejected': self.rejected, 'evictions': self.evictions, 'missed': self.__missed})
+            self.__unsaved = 0
+        try:
+            # written to a temp file first, so a power cut can not leave a half-written manifest
+            for path, content in ((self.manifest_file, data), (self.usage_file, usage)):
+                tmp_file = path + '.tmp'
+                with open(tmp_file, 'w') as file:
+                    file.write(content)
+                os.replace(tmp_file, path)
+            with self.__lock:
+                self.sketch.save(self.sketch_file)
+        except OSError as e:
+            print(f"ERR: while saving the offline audio manifest: {e}")
+
+    def __load_usage(self):
+        # the counters are kept across the runs, so the hit rate is the long term one
+        self.sketch.load(self.sketch_file)
+        try:
+            with open(self.usage_file) as file:
+                usage = json.load(file)
+            self.hits = usage['hits']
+            self.misses = usage['misses']
+            self.admitted = usage['admitted']
+            self.rejected = usage['rejected']
+            self.evictions = usage['evictions']
+            self.__missed = OrderedDict(usage['missed'])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            print(f"ERR: the offline audio usage is broken, it is reset: {e}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Usage report of the offline phrase cache.")
+    parser.add_argument('command', choices=['report'])
+    parser.add_argument('--count', type=int, default=20, help="phrases listed")
+    parser.add_argument('--directory', default=OFFLINE_AUDIO_DIR)
+    args = parser.parse_args()
+
+    cache = PhraseCache(args.directory, read_only=True)
+    print("=== offline phrase cache ===")
+    for name, value in cache.status().items():
+        print(f"{name}: {value}")
+
+    print("=== most used ===")
+    for phrase in cache.usage(args.count):
+        last_used = time.strftime('%Y-%m-%d %H:%M', time.localtime(phrase['last_used']))
+        print(f"{phrase['hits']:6} hits | frequency {phrase['frequency']:2} | {last_used} | {phrase['text']}")
+
+    print("=== worth pre-warming ===")
+    for phrase in cache.prewarm_candidates(args.count):
+        last_seen = time.strftime('%Y-%m-%d %H:%M', time.localtime(phrase['last_seen']))
+        print(f"{phrase['misses']:6} misses | frequency {phrase['frequency']:2} | {last_seen} | "
+              f"voice {phrase['voice']}, rate {phrase['rate']} | {phrase['text']}")
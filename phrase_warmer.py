@@ -0,0 +1,162 @@
+"""
+Background warmer of the offline phrase audio.
+
+Most of the short phrases the PDA speaks are known in advance (the wakeup replies, the ringing calls,
+the prior messages like 'Of course!', the feedback replies...). Without the warmer, each of them is synthesized
+on its first use, paying the Google TTS round trip at the moment the user is waiting.
+
+The warmer collects these phrase sets from the modules ('phrase sources', each a function returning a set of texts),
+checks them against the offline cache, and synthesizes the missing ones in the background:
+- only while there is an internet connection,
+- at low priority: one phrase at a time, with a pause in between, and never while the PDA is speaking.
+Its progress and the coverage of the phrase sets are returned from status().
+
+The phrases rendered by the local synthesizer while offline (see tts.py) are replaced with the cloud voice as well.
+BATCH MODE: the cache misses of the answers (spoken assembled, locally rendered, or not at all) are queued
+with request(), and filled in the background the same way.
+"""
+
+# ======================== IMPORT =========================
+import queue
+import threading
+
+from events import Signals as sig
+from sense_skills import SenseSingleton
+
+
+# ======================= CLASSES =========================
+
+class PhraseWarmer:
+    __PAUSE = 1  # seconds between two syntheses
+    __OFFLINE_CHECK = 10  # seconds between the connection checks, while offline
+    __MAX_ATTEMPTS = 3  # a phrase failing that many times is skipped
+    __IDLE_CHECK = 60  # seconds between the checks for new local renders, once everything is synthesized
+
+    def __init__(self, speech, phrase_sources, voice=0, rate=0.9):
+        """
+        'speech' is the Speech instance (its cache and cache_phrase() are used).
+        'phrase_sources' is a list of functions, each returning a set of phrases.
+        """
+        self.speech = speech
+        self.phrase_sources = phrase_sources
+        self.voice = voice
+        self.rate = rate
+
+        self.phrases = []
+        self.synthesized = 0
+        self.failed = {}  # (text, voice, rate) -> failed attempts
+        self.is_finished = False
+
+        self.__requests = queue.Queue()  # the cache misses to fill (batch mode)
+        self.__requested = []  # (text, voice, rate), in the order they were requested
+        self.__stop_event = threading.Event()
+        self.__wake_event = threading.Event()
+        self.thread = threading.Thread(target=self.__warmer_thread, daemon=True)
+
+    def start(self):
+        sig.add_terminate_listener(self.stop)
+        self.thread.start()
+
+    def stop(self):
+        self.__stop_event.set()
+        self.__wake_event.set()
+
+    def request(self, text, voice=0, rate=0.9):
+        """Queues a cache miss, to be synthesized in the background (from any thread)."""
+        self.__requests.put((text, voice, rate))
+        self.__wake_event.set()
+
+    def collect(self):
+        phrases = set()
+        for source in self.phrase_sources:
+            try:
+                phrases.update(phrase for phrase in source() if phrase)
+            except Exception as e:
+                print(f"ERR: while collecting the phrases from {source}: {e}")
+        self.phrases = sorted(phrases)
+        return self.phrases
+
+    def missing(self):
+        """The phrases to synthesize: [(text, voice, rate), ...]. The local renders are replaced as well."""
+        while True:
+            try:
+                item = self.__requests.get_nowait()
+            except queue.Empty:
+                break
+            if item not in self.__requested:
+                self.__requested.append(item)
+        self.__requested = [item for item in self.__requested if not self.speech.cache.contains(*item)]
+
+        # the requested misses first: they were already needed once
+        missing = list(self.__requested)
+        missing += [(phrase, self.voice, self.rate) for phrase in self.phrases
+                    if not self.speech.cache.contains(phrase, self.voice, self.rate)]
+        missing += self.speech.cache.local_phrases()
+        return [item for item in missing if self.failed.get(item, 0) < self.__MAX_ATTEMPTS]
+
+    def status(self):
+        total = len(self.phrases)
+        cached = sum(1 for phrase in self.phrases if self.speech.cache.contains(phrase, self.voice, self.rate)
+                     and not self.speech.cache.is_local(phrase, self.voice, self.rate))
+        return {
+            'total': total,
+            'cached': cached,
+            'coverage': round(100 * cached / total, 1) if total else 100.0,
+            'synthesized': self.synthesized,
+            'local_renders': len(self.speech.cache.local_phrases()),
+            'requested': len(self.__requested) + self.__requests.qsize(),
+            'failed': len([item for item, attempts in self.failed.items() if attempts >= self.__MAX_ATTEMPTS]),
+            'finished': self.is_finished,
+        }
+
+    @staticmethod
+    def __is_online():
+        return SenseSingleton.get_instance().connection.is_internet
+
+    def __wait(self, seconds, wake=False):
+        # returns True if the warmer should stop. With 'wake', a new request ends the wait.
+        if wake:
+            self.__wake_event.wait(seconds)
+            self.__wake_event.clear()
+        else:
+            self.__stop_event.wait(seconds)
+        return self.__stop_event.is_set() or sig.program_terminate
+
+    def __warmer_thread(self):
+        self.collect()
+        print(f"Phrase warmer: {self.status()}")
+
+        while not self.__stop_event.is_set() and not sig.program_terminate:
+            missing = self.missing()
+            if not missing:
+                # everything is synthesized. New local renders may appear while offline, so the warmer keeps checking.
+                if not self.is_finished:
+                    self.is_finished = True
+                    print(f"Phrase warmer finished: {self.status()}")
+                if self.__wait(self.__IDLE_CHECK, wake=True):
+                    break
+                continue
+            self.is_finished = False
+
+            if not self.__is_online():
+                if self.__wait(self.__OFFLINE_CHECK):
+                    break
+                continue
+
+            for item in missing:
+                # low priority: the user is never kept waiting because of the warmer
+                while self.speech.is_speaking:
+                    if self.__wait(self.__PAUSE):
+                        return
+                if not self.__is_online():
+                    break
+
+                if self.speech.cache_phrase(*item):
+                    self.synthesized += 1
+                else:
+                    self.failed[item] = self.failed.get(item, 0) + 1
+
+                if self.__wait(self.__PAUSE):
+                    return
+
+            print(f"Phrase warmer: {self.status()}")
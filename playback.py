@@ -0,0 +1,298 @@
+"""
+This module contains the persistent AUDIO PLAYBACK engine, used from the Speech class (respond.py).
+
+Before, every sentence was played with 'os.system("mpg123 -q ...")': a shell and a decoder process were started
+for every utterance, and the audio device was opened again every time. On a Pi, this costs a noticeable delay
+before every sentence.
+
+Here, ONE output stream ('aplay', raw PCM from its stdin) is kept open all the time, fed by a playback thread:
+- play_file() decodes an mp3 into PCM ('mpg123 -s', only once per phrase), and queues it.
+  The wav files (from the local synthesizer, see tts.py) are read and resampled to the player sample rate.
+- the decoded PCM of the hot phrases is kept in memory (LRU, up to 'cache_bytes').
+- the PCM is written in short chunks, so stop() can interrupt the playback in the middle of an utterance.
+If 'aplay' is not available, the audio is played per file with mpg123, the same way as before.
+The packed phrases (see phrase_archive.py) are read from the memory-mapped archive, before the files.
+"""
+
+# ======================== IMPORT =========================
+import atexit
+import io
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+import wave
+from collections import OrderedDict
+
+import numpy as np
+
+
+# ======================= CLASSES =========================
+
+class PlaybackItem:
+    """One utterance in the playback queue."""
+
+    def __init__(self, pcm, label=None, generation=0):
+        self.pcm = pcm  # bytes, 16-bit mono at the player sample rate
+        self.label = label
+        self.generation = generation  # the player generation it was queued in. A stop() starts a new one.
+        self.done = threading.Event()
+        self.completed = False  # False if it was stopped (or failed)
+        self.drained_at = 0  # time.monotonic() when its end leaves the device buffer
+
+    def wait(self, timeout=None):
+        """Blocks until the utterance is played (or stopped). Returns True if it was played to the end."""
+        if not self.done.wait(timeout):
+            return False
+        if self.completed:
+            # the end of the utterance is still in the device buffer. The player itself does not wait for it,
+            # so the next queued item follows without a gap.
+            time.sleep(max(self.drained_at - time.monotonic(), 0))
+        return self.completed
+
+
+class AudioPlayer:
+    __CHUNK_SEC = 0.032  # the PCM is written in chunks, so a stop is detected within one chunk (one listening frame)
+    __BUFFER_USEC = 100000  # aplay buffer. Small, so a stop is heard quickly
+
+    def __init__(self, sample_rate=24000, cache_bytes=16 * 1024 * 1024):
+        self.sample_rate = sample_rate  # Google TTS: 24 kHz. Every file is resampled to it while decoding.
+        self.cache_bytes = cache_bytes
+
+        self.__pcm_cache = OrderedDict()  # path -> pcm bytes (LRU)
+        self.__pcm_cache_size = 0
+        self.__cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.interruptions = 0  # utterances stopped in the middle
+
+        self.archive = None  # PhraseArchive (phrase_archive.py). The phrases in it have no file.
+
+        self.__queue = queue.Queue()
+        # stop() starts a new generation: the items queued before it are not played. Nothing resets it back,
+        # so a stop is not lost when the next sentence of an utterance is queued (see enqueue()).
+        self.__generation = 0
+        self.__current = None
+        self.__stream = None
+        self.__thread = None
+        self.__is_running = False
+
+        self.is_persistent = shutil.which('aplay') is not None and shutil.which('mpg123') is not None
+
+    # ------------- output stream -------------
+    def start(self):
+        if self.__is_running:
+            return
+        self.__is_running = True
+        if self.is_persistent:
+            self.__thread = threading.Thread(target=self.__playback_thread, daemon=True)
+            self.__thread.start()
+            atexit.register(self.close)
+        else:
+            print("ERR: aplay is not found. The audio is played per file with mpg123.")
+
+    def close(self):
+        self.__is_running = False
+        self.stop()
+        self.__queue.put(None)
+        self.__close_stream()
+
+    @property
+    def generation(self):
+        """The current generation. An utterance keeps it, and queues its parts with it (see enqueue())."""
+        return self.__generation
+
+    @property
+    def is_playing(self):
+        return self.__current is not None or not self.__queue.empty()
+
+    def __open_stream(self):
+        if self.__stream is None or self.__stream.poll() is not None:
+            self.__stream = subprocess.Popen(
+                ['aplay', '-q', '-t', 'raw', '-f', 'S16_LE', '-c', '1', '-r', str(self.sample_rate),
+                 f'--buffer-time={self.__BUFFER_USEC}'],
+                stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return self.__stream
+
+    def __close_stream(self):
+        stream, self.__stream = self.__stream, None
+        if stream is not None and stream.poll() is None:
+            try:
+                stream.stdin.close()
+            except OSError:
+                pass
+            stream.terminate()
+
+    def __playback_thread(self):
+        chunk_bytes = int(self.sample_rate * self.__CHUNK_SEC) * 2
+
+        while self.__is_running:
+            item = self.__queue.get()
+            if item is None:
+                break
+
+            self.__current = item
+            try:
+                stream = self.__open_stream()
+                for i in range(0, len(item.pcm), chunk_bytes):
+                    if item.generation != self.__generation:
+                        break
+                    stream.stdin.write(item.pcm[i:i + chunk_bytes])
+                    stream.stdin.flush()
+
+                if item.generation != self.__generation:
+                    # the audio already in the device buffer is dropped with the stream. It is reopened on next play.
+                    self.interruptions += 1
+                    self.__close_stream()
+                else:
+                    # the end of the utterance is still in the device buffer (see PlaybackItem.wait())
+                    item.drained_at = time.monotonic() + self.__BUFFER_USEC / 1e6
+                    item.completed = True
+
+            except (OSError, ValueError) as e:
+                print(f"ERR: in the playback thread: {e}")
+                self.__close_stream()
+
+            finally:
+                self.__current = None
+                item.done.set()
+
+    # ------------- decoding -------------
+    def decode(self, path, use_cache=True):
+        """Decodes an audio file into PCM (16-bit, mono, at the player sample rate). Returns bytes (or None)."""
+        if use_cache:
+            with self.__cache_lock:
+                pcm = self.__pcm_cache.get(path)
+                if pcm is not None:
+                    self.__pcm_cache.move_to_end(path)
+                    self.cache_hits += 1
+                    return pcm
+                self.cache_misses += 1
+
+        record = self.archive.read(os.path.basename(path)) if self.archive is not None else None
+        if record is not None and record[1]:
+            # pre-decoded: read from the mapped archive, it is not kept in the PCM cache as well
+            return record[0]
+
+        try:
+            if record is not None:
+                # the packed mp3/wav bytes
+                if path.endswith('.wav'):
+                    pcm = self.__read_wav(io.BytesIO(record[0]))
+                else:
+                    pcm = self.__run_mpg123('-', data=record[0])
+            elif path.endswith('.wav'):
+                pcm = self.__read_wav(path)
+            else:
+                pcm = self.__run_mpg123(path)
+        except (OSError, EOFError, wave.Error, subprocess.CalledProcessError) as e:
+            print(f"ERR: while decoding {path}: {e}")
+            return None
+
+        if use_cache and len(pcm) <= self.cache_bytes:
+            with self.__cache_lock:
+                if path not in self.__pcm_cache:
+                    self.__pcm_cache[path] = pcm
+                    self.__pcm_cache_size += len(pcm)
+                while self.__pcm_cache_size > self.cache_bytes:
+                    _, old_pcm = self.__pcm_cache.popitem(last=False)
+                    self.__pcm_cache_size -= len(old_pcm)
+        return pcm
+
+    def __run_mpg123(self, path, data=None):
+        # with path '-', the mp3 is read from 'data'
+        result = subprocess.run(['mpg123', '-q', '-s', '--mono', '-r', str(self.sample_rate), path], input=data,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+        return result.stdout
+
+    def __read_wav(self, path):
+        """Reads a 16-bit wav file (a path or a file object), as mono PCM at the player sample rate."""
+        with wave.open(path, 'rb') as wav_file:
+            if wav_file.getsampwidth() != 2:
+                raise wave.Error("only 16-bit wav files are supported")
+            channels = wav_file.getnchannels()
+            rate = wav_file.getframerate()
+            samples = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype=np.int16)
+
+        if channels > 1:
+            samples = samples.reshape(-1, channels).mean(axis=1)
+        if rate != self.sample_rate and len(samples):
+            # linear interpolation is enough for speech
+            positions = np.arange(0, len(samples), rate / self.sample_rate)
+            samples = np.interp(positions, np.arange(len(samples)), samples)
+        return samples.astype(np.int16).tobytes()
+
+    def forget(self, path):
+        """Drops the decoded PCM of a file, when it is replaced or evicted from the phrase cache (see PhraseCache.on_forget)."""
+        with self.__cache_lock:
+            pcm = self.__pcm_cache.pop(path, None)
+            if pcm is not None:
+                self.__pcm_cache_size -= len(pcm)
+
+    # ------------- playing -------------
+    def enqueue(self, pcm, label=None, generation=None):
+        """
+        Queues PCM for playback. Returns the PlaybackItem (see PlaybackItem.wait()).
+        'generation': of the utterance the PCM belongs to. If the player was stopped since, it is not played.
+        """
+        item = PlaybackItem(pcm, label, self.__generation if generation is None else generation)
+        if item.generation != self.__generation:
+            item.done.set()
+            return item
+        self.__queue.put(item)
+        return item
+
+    def play_file(self, path, use_cache=True, wait=True, generation=None):
+        """
+        Plays an mp3 file. 'use_cache=False' for the temporary files (they are overwritten).
+        If 'wait', blocks until the end of the playback and returns True if it was played to the end.
+        Otherwise, returns the PlaybackItem (or None if the file could not be decoded).
+        """
+        if not self.is_persistent:
+            record = self.archive.read(os.path.basename(path)) if self.archive is not None else None
+            if record is not None and record[1]:
+                subprocess.run(['aplay', '-q', '-t', 'raw', '-f', 'S16_LE', '-c', '1', '-r', str(self.sample_rate)],
+                               input=record[0], stderr=subprocess.DEVNULL)
+            elif record is not None:
+                player = ['aplay', '-q'] if path.endswith('.wav') else ['mpg123', '-q', '-']
+                subprocess.run(player, input=record[0], stderr=subprocess.DEVNULL)
+            else:
+                player = 'aplay' if path.endswith('.wav') else 'mpg123'
+                subprocess.run([player, '-q', path], stderr=subprocess.DEVNULL)
+            item = PlaybackItem(b'', label=path)
+            item.completed = True
+            item.done.set()
+            return True if wait else item
+
+        pcm = self.decode(path, use_cache)
+        if pcm is None:
+            return False if wait else None
+
+        item = self.enqueue(pcm, label=path, generation=generation)
+        return item.wait() if wait else item
+
+    def stop(self):
+        """Stops the current utterance and drops the queued ones."""
+        self.__generation += 1
+        while True:
+            try:
+                item = self.__queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.__queue.put(None)  # the close request is kept
+                break
+            item.done.set()
+
+    def status(self):
+        return {
+            'persistent': self.is_persistent,
+            'playing': self.is_playing,
+            'queued': self.__queue.qsize(),
+            'pcm_cache_items': len(self.__pcm_cache),
+            'pcm_cache_kb': self.__pcm_cache_size // 1024,
+            'pcm_cache_hits': self.cache_hits,
+            'pcm_cache_misses': self.cache_misses,
+        }
@@ -0,0 +1,179 @@
+"""
+Replay harness for the Listen pipeline (sense.py).
+It replays a labelled set of WAV clips through 'Listen.listen_for_wakeword()' and 'Listen.listen_for_cmd()',
+exactly as they run on the device, but with the audio coming from files instead of the microphone.
+This allows regressions to be reproduced, and the detection latency to be measured.
+
+The clip set is a JSON file:
+    [
+        {"path": "clips/hey_alex_weather.wav", "wake": true, "intent": "weather"},
+        {"path": "clips/hey_alex_only.wav", "wake": true},
+        {"path": "clips/tv_noise_10min.wav", "wake": false}
+    ]
+- 'wake': true if the clip contains a wake-word.
+- 'intent': the expected Rhino intent after the wake-word (optional).
+All the clips should be 16 kHz, mono, 16-bit WAV files.
+
+Every engine configuration overrides some of the Listen settings (PREROLL, VAD...):
+    [
+        {"name": "default"},
+        {"name": "no-vad", "VAD": {"enabled": false}},
+        {"name": "no-preroll", "PREROLL": {"enabled": false}}
+    ]
+
+For each configuration, the harness reports:
+- detection rate (wake-word clips detected / wake-word clips)
+- false accepts per hour (detections in the clips without a wake-word, per hour of such audio)
+- intent accuracy and wake-to-intent latency (p50/p95), measured in AUDIO time, so it does not depend on the replay speed.
+
+Usage:
+    python3 replay.py clips.json [--configs configs.json] [--speed 0]
+"""
+
+# ======================== IMPORT =========================
+import argparse
+import json
+import os
+import time
+import wave
+
+from audio import WavFileSource
+from sense import Listen
+
+# ======================= GLOBALS =========================
+DEFAULT_CONFIGS = [
+    {'name': 'default'},
+    {'name': 'no-vad', 'VAD': {'enabled': False}},
+    {'name': 'no-preroll', 'PREROLL': {'enabled': False}},
+]
+
+
+# ======================= FUNCTIONS =======================
+
+def make_listen_class(config):
+    """Returns a Listen subclass with the settings of 'config' merged over the default ones."""
+    attrs = {'STT': {**Listen.STT, 'engine': None}}  # free-form speech to text is not replayed
+    for key in ('PREROLL', 'VAD', 'STT'):
+        if key in config:
+            attrs[key] = {**getattr(Listen, key), **config[key]}
+    return type(f"ReplayListen_{config['name']}", (Listen,), attrs)
+
+
+def clip_duration(path):
+    with wave.open(path, 'rb') as wav_file:
+        return wav_file.getnframes() / wav_file.getframerate()
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(int(round(pct / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def replay_clip(listen, clip, speed=0.0, gap_sec=2.0, cmd_timeout=5):
+    """
+    Replays one clip. Returns a dict with the detection, the intent and the positions (in samples).
+    'gap_sec' of silence are added after the clip, so Rhino can finalize.
+    """
+    source = WavFileSource(clip['path'], frame_length=listen.pc.frame_length, sample_rate=listen.pc.sample_rate,
+                           speed=speed, gap_sec=gap_sec)
+    listen.use_source(source)
+
+    result = {'path': clip['path'], 'detected': 0, 'intent': None, 'latency': None}
+    while listen.capture.is_running:
+        keyword_index, _ = listen.listen_for_wakeword()
+        if keyword_index < 0:
+            break  # end of the clip
+
+        result['detected'] += 1
+        wake_position = listen.capture.consumer_position('porcupine')
+
+        if result['detected'] == 1:
+            # only the first detection is followed by the intent. It is what the user experience.
+            intent, slots, _ = listen.listen_for_cmd(cmd_timeout, engaged=True, preroll=True)
+            if intent:
+                intent_position = listen.capture.consumer_position('rhino')
+                result['intent'] = intent
+                result['latency'] = max(intent_position - wake_position, 0) / source.sample_rate
+
+    listen.capture.stop()
+    if hasattr(listen.rhino, 'reset'):
+        listen.rhino.reset()  # do not carry an unfinished utterance into the next clip
+    return result
+
+
+def run_config(config, clips, speed=0.0):
+    # the capture is started per clip (see replay_clip()): the microphone is never opened
+    listen = make_listen_class(config)(start_capture=False)
+
+    wake_clips, detected, false_accepts = 0, 0, 0
+    negative_sec = 0.0
+    intents_expected, intents_correct = 0, 0
+    latencies = []
+
+    start = time.perf_counter()
+    for clip in clips:
+        result = replay_clip(listen, clip, speed=speed)
+
+        if clip.get('wake'):
+            wake_clips += 1
+            if result['detected']:
+                detected += 1
+            # more than one detection in a wake-word clip is a false accept as well
+            false_accepts += max(result['detected'] - 1, 0)
+
+            if clip.get('intent'):
+                intents_expected += 1
+                if result['intent'] == clip['intent']:
+                    intents_correct += 1
+                    latencies.append(result['latency'])
+        else:
+            negative_sec += clip_duration(clip['path'])
+            false_accepts += result['detected']
+
+    listen.clear_picovoice_res()
+
+    return {
+        'config': config['name'],
+        'clips': len(clips),
+        'detection_rate': round(detected / wake_clips, 3) if wake_clips else None,
+        'false_accepts': false_accepts,
+        'false_accepts_per_hour': round(false_accepts / (negative_sec / 3600), 2) if negative_sec else None,
+        'intent_accuracy': round(intents_correct / intents_expected, 3) if intents_expected else None,
+        'wake_to_intent_p50': percentile(latencies, 50),
+        'wake_to_intent_p95': percentile(latencies, 95),
+        'replay_time': round(time.perf_counter() - start, 1),
+        'vad': listen.vad_report(),
+    }
+
+
+def load_clips(path):
+    with open(path) as file:
+        clips = json.load(file)
+
+    # the clip paths are relative to the clip set file
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for clip in clips:
+        clip['path'] = os.path.join(base_dir, clip['path'])
+    return clips
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay labelled clips through the Listen pipeline.")
+    parser.add_argument('clips', help="JSON file with the labelled clips")
+    parser.add_argument('--configs', default=None, help="JSON file with the engine configurations")
+    parser.add_argument('--speed', type=float, default=0.0, help="1.0 = real time, 0 = as fast as possible")
+    args = parser.parse_args()
+
+    clip_list = load_clips(args.clips)
+    if args.configs:
+        with open(args.configs) as f:
+            configs = json.load(f)
+    else:
+        configs = DEFAULT_CONFIGS
+
+    for cfg in configs:
+        report = run_config(cfg, clip_list, speed=args.speed)
+        print(json.dumps(report, indent=2))
@@ -9,22 +9,30 @@ import time
 
 import os
 import random
-import signal
 
 import threading
 
-from tools import encode_str
+from phrase_cache import PhraseCache
+from tts import TTSWorker, TTSChain, GoogleBackend, LocalBackend
+from playback import AudioPlayer
+from phrase_assembly import PhraseAssembler
+from tools import split_sentences
 
 # ----- Speech ----
 from google.cloud import texttospeech_v1
 
 from sense_skills import SenseSingleton
 # from task_skills import SKILL_LIST, GENERAL_LIST
-from task_skills_v2 import SKILL_LIST, GENERAL_LIST
+# the skills (task_skills_v2.py) are imported on their first use, or by the warm-up after startup
+from skill_registry import SkillRegistry, SkillRunner, TASK_SKILLS, GENERAL_SKILLS, lazy_function
+from response_cache import ResponseCache
+from phrase_warmer import PhraseWarmer
+from speech_scheduler import SpeechScheduler, ANSWER, REPORT
 
 from events import Signals as sig
+from latency import LatencyTracer as tracer
 from brain import ConversationMemory as memory
-# from events import EventReporter as reporter
+from events import EventReporter as reporter
 
 
 # ====================== GLOBAL VARs ======================
@@ -49,25 +57,43 @@ This can be returned along with the response message, in order to be used from t
 """
 
 
-class TimeOutException(Exception):  # used in alarm_handler below
-    pass
+class Speech:
+    # --- class attributes ---
+    VOICE0 = TTSWorker.VOICES[0]
+    VOICE1 = TTSWorker.VOICES[1]
 
+    client = None
 
-def alarm_handler(signum, frame):  # used in class Speech
-    print("ALARM signal received")
-    raise TimeOutException()
+    # the TTS requests go through one worker, with per-request deadlines (see tts.py). Any thread can speak.
+    tts = None
+    # the backends used when the phrase is not offline: Google, then the local synthesizer (see tts.py)
+    chain = None
+    LATENCY_BUDGET = 3.0  # seconds, for the synthesis of one phrase
+    __speak_lock = threading.RLock()  # one utterance at a time, whichever thread is speaking
 
+    # in-memory index of the offline phrase audio (see phrase_cache.py). Shared, and scanned once.
+    cache = None
 
-class Speech:
-    # --- class attributes ---
-    VOICE0 = texttospeech_v1.VoiceSelectionParams(language_code='en-US', name='en-US-Wavenet-F', ssml_gender=texttospeech_v1.SsmlVoiceGender.FEMALE)
-    VOICE1 = texttospeech_v1.VoiceSelectionParams(language_code='en-US', name='en-US-Neural2-F', ssml_gender=texttospeech_v1.SsmlVoiceGender.FEMALE)
+    # the persistent audio output (see playback.py). Shared, and started once.
+    player = None
 
-    client = None
+    # templated answers assembled from cached fragments (see phrase_assembly.py)
+    assembler = None
+    PREFER_ASSEMBLY = True  # an assembled answer is spoken with no network latency, but its intonation is flatter
+
+    # the background phrase warmer (see phrase_warmer.py). Started once, from Response.
+    warmer = None
+
+    # the prioritised speech queue, with barge-in (see speech_scheduler.py). Started once.
+    scheduler = None
 
     def __init__(self):
         # --- Instance attributes ---
         self.__is_error = False
+        self.is_speaking = False  # the background phrase warmer does not synthesize while speaking
+        self.barged_in = False  # the user interrupted the speech with the wake-word (see barge_in())
+        self.last_audio = None  # the PCM of the last utterance, if it was played whole (see speak_audio())
+        self.__recorded = None  # the PlaybackItems of the utterance being spoken
 
         #  constantly updated parameter, keeping information if there is an internet connection or not.
         # self.is_online
@@ -75,12 +101,39 @@ class Speech:
         try:
             os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = "gtts_accnt.json"
             self.client = texttospeech_v1.TextToSpeechClient()
+            if Speech.tts is None:
+                Speech.tts = TTSWorker(self.client, is_online=lambda: self.is_online)
+                Speech.tts.start()
             print("TTS account is now active.")
 
         except Exception as e:
             print(f"An exception raised: {e}")
             self.__is_error = True  # if any error in tts init rise, a flag arise.;
 
+        if Speech.chain is None:
+            google = GoogleBackend(Speech.tts, lambda: self.is_online) if Speech.tts is not None else None
+            Speech.chain = TTSChain([google, LocalBackend()])
+
+        if Speech.cache is None:
+            Speech.cache = PhraseCache()
+            Speech.cache.warm_up()
+
+        if Speech.player is None:
+            Speech.player = AudioPlayer()
+            Speech.player.start()
+            Speech.player.archive = Speech.cache.archive
+            Speech.cache.on_forget = Speech.player.forget
+            # the phrase files are packed into the archive pre-decoded (or as they are, without the persistent player)
+            decode = (lambda path: Speech.player.decode(path, use_cache=False)) if Speech.player.is_persistent else None
+            Speech.cache.start_packing(decode, is_busy=lambda: self.is_speaking)
+
+        if Speech.assembler is None:
+            Speech.assembler = PhraseAssembler(Speech.cache, Speech.player)
+
+        if Speech.scheduler is None:
+            Speech.scheduler = SpeechScheduler(self)
+            Speech.scheduler.start()
+
         print(f"is_online = {self.is_online}")
         print(f"is_error = {self.__is_error}")
 
@@ -90,18 +143,15 @@ class Speech:
     def is_online(self):
         return SenseSingleton.get_instance().connection.is_internet
 
-    @staticmethod
-    def __speak_offline(text):  # this method is not accessed outide of the class
+    def __speak_offline(self, text, voice=0, rate=0.9):  # this method is not accessed outide of the class
         try:
-            # check if a file to speak (with name "text") is available offline
-            encoded = encode_str(text)
-            filename = f"offline_audio/{encoded}.mp3"
-            # print(f"try to speak: {filename}")
-            path = f"/home/alex/lab/alex2.0/{filename}"
-            is_exist = os.path.exists(path)
-            # print(f"The file: {path} exists = {is_exist}")
-            if is_exist:
-                os.system("mpg123 -q '" + filename + "'")
+            # check if a file to speak (with name "text") is available offline. The index is in memory.
+            with tracer.span('speak_lookup'):
+                filename = self.cache.lookup(text, voice, rate)
+            if filename is not None:
+                tracer.mark_once('first_audio')
+                with tracer.span('playback'):
+                    self.__play_file(filename)
                 # os.system("mpg321 '" + filename + "' --stereo")
                 # print(f"ALEX: {text} | speak_online=False")
                 return True
@@ -111,73 +161,265 @@ class Speech:
         except Exception as e:
             print(f"ERR: in __speak_offline(): {e}")
 
+    def __synthesize(self, text, voice, rate, budget, allow_local=True, batch=False):
+        """Synthesis through the backend chain. Returns (audio content, backend), or raises TTSUnavailable."""
+        return self.chain.synthesize(text, voice, rate, budget=budget, allow_local=allow_local, batch=batch)
+
     def __speak_online(self, text, voice, rate, save_it=False):
-        if not self.__is_error and self.is_online:
-            self.audio_config = texttospeech_v1.AudioConfig(audio_encoding=texttospeech_v1.AudioEncoding.MP3, speaking_rate=rate)
-            if voice == 1:
-                voice_to_use = self.VOICE1
-            else:
-                voice_to_use = self.VOICE0
+        # the request has its own deadline (see tts.py), so this works from any thread
+        # a one-off sentence (with a time or a temperature in it) is not saved (see PhraseCache.should_admit())
+        save_it = save_it and self.cache.should_admit(text, voice, rate)
+        filename = self.__synthesize_to_file(text, voice, rate, save_it, budget=self.LATENCY_BUDGET)
+        if filename is None:
+            return False
 
-            # Note: The Ubuntu max file_name is 255. So with the encoding it should not exceed that.
-            if save_it and len(text) < 60:
-                encoded = encode_str(text)
-                filename = f"offline_audio/{encoded}.mp3"
-            else:
-                filename = "speak.mp3"
+        # print(f"ALEX: {text} | rate={rate} | speak_online=True")
+        tracer.mark_once('first_audio')
+        with tracer.span('playback'):
+            # 'speak.mp3' is overwritten every time, so its decoded audio is not kept
+            self.__play_file(filename, use_cache=save_it)
+        # os.system("mpg321 '" + filename + "' --stereo")
+        return True
 
-            # the following is used to raise a timeout exception if the response takes too long
-            signal.signal(signal.SIGALRM, alarm_handler)
-            signal.alarm(3)
+    def __synthesize_to_file(self, text, voice, rate, save_it, budget, allow_local=True, batch=False):
+        """Synthesizes a phrase into a file (saved offline, if 'save_it'). Returns the filename, or None."""
+        try:
+            audio_content, backend = self.__synthesize(text, voice, rate, budget, allow_local, batch)
+        except Exception as e:
+            print(f"ERR: while synthesizing '{text}': {e}")
+            return None
 
-            try:
-                synthesis_input = texttospeech_v1.SynthesisInput(text=text)
-                response = self.client.synthesize_speech(input=synthesis_input, voice=voice_to_use, audio_config=self.audio_config)
+        if backend.is_local:
+            print(f"ALEX: '{text}' rendered by the local synthesizer ({backend.engine}).")
+        if save_it:
+            filename = self.cache.path_for(text, voice, rate, backend.audio_format)
+        else:
+            filename = f"speak.{backend.audio_format}"
+        with open(filename, 'wb') as output:
+            output.write(audio_content)
+        if save_it:
+            # a local render is flagged, to be replaced with the cloud voice when back online (see phrase_warmer.py)
+            self.cache.add(text, filename, voice, rate, local=backend.is_local)
+        return filename
+
+    def cache_phrase(self, text, voice=0, rate=0.9, timeout=10):
+        """
+        Synthesizes a phrase and saves it offline, without speaking it. Used from the background phrase warmer.
+        Only the cloud voice is used: a phrase rendered by the local synthesizer is replaced.
+        Returns True if the phrase is available offline in the cloud voice. It is safe to call from any thread.
+        The request goes in the batch lane of the TTS worker: the speech is always synthesized first.
+        """
+        if self.cache.contains(text, voice, rate) and not self.cache.is_local(text, voice, rate):
+            return True
+        return self.__synthesize_to_file(text, voice, rate, save_it=True, budget=timeout, allow_local=False,
+                                         batch=True) is not None
 
-            except Exception as e:
-                print(f"ERR: in __speak_online(): {e}")
-                signal.alarm(0)
-                return False
+    def __speak_pipelined(self, sentences, voice, rate, save_it, try_offline):
+        """
+        Speaks a long answer sentence by sentence: the next sentence is synthesized while the previous one is playing
+        (the player plays from its queue), so the first audio only waits for the first sentence.
+        The sentences already available offline are not synthesized at all.
+        Returns True if anything was spoken.
+        """
+        generation = self.player.generation  # changed by a stop (see stop_speaking()): the rest is not spoken
+        last_item = None
+        for sentence in sentences:
+            if self.player.generation != generation:
+                break
+
+            item = self.__queue_sentence(sentence, voice, rate, save_it, try_offline, generation)
+            if item is None:
+                if last_item is not None and self.player.generation == generation:
+                    # the answer was cut in the middle. The user should know why.
+                    last_item.wait()
+                    self.__disconnected_prompt()
+                break
 
-            else:
-                signal.alarm(0)
-                # print(f"ALEX: {text} | rate={rate} | speak_online=True")
+            tracer.mark_once('first_audio')
+            last_item = item
 
-                with open(filename, 'wb') as output:
-                    output.write(response.audio_content)
-                os.system("mpg123 -q '" + filename + "'")
-                # os.system("mpg321 '" + filename + "' --stereo")
-                return True
+        if last_item is None:
+            return False
+        last_item.wait()
+        return True
+
+    def __queue_sentence(self, sentence, voice, rate, save_it, try_offline, generation=None):
+        """Queues one sentence for playback, from the first source that has it. Returns the PlaybackItem, or None."""
+        if try_offline:
+            sources = ['offline', 'assembled', 'online'] if self.PREFER_ASSEMBLY else ['offline', 'online', 'assembled']
         else:
+            sources = ['online', 'offline', 'assembled']
+
+        for source in sources:
+            if source == 'offline':
+                filename = self.cache.lookup(sentence, voice, rate)
+                if filename is not None:
+                    return self.__play_file(filename, wait=False, generation=generation)
+
+            elif source == 'assembled':
+                pcm = self.assembler.assemble(sentence, voice, rate)
+                if pcm is not None:
+                    if save_it:
+                        self.__fill_later(sentence, voice, rate)
+                    return self.__enqueue(pcm, label=sentence, generation=generation)
+
+            else:
+                save_it = save_it and self.cache.should_admit(sentence, voice, rate)
+                filename = self.__synthesize_to_file(sentence, voice, rate, save_it, budget=self.LATENCY_BUDGET)
+                if filename is not None:
+                    # the decoded audio of the temporary 'speak.mp3' is queued, so the file can be overwritten
+                    return self.__play_file(filename, use_cache=save_it, wait=False, generation=generation)
+        return None
+
+    def __speak_assembled(self, text, voice, rate, save_it=True):
+        """Speaks a templated answer assembled from the cached fragments (see phrase_assembly.py)."""
+        if not self.player.is_persistent:
             return False
+        pcm = self.assembler.assemble(text, voice, rate)
+        if pcm is None:
+            return False
+        if save_it:
+            self.__fill_later(text, voice, rate)
+
+        tracer.mark_once('first_audio')
+        with tracer.span('playback'):
+            self.__enqueue(pcm, label=text).wait()
+        return True
+
+    def __fill_later(self, text, voice, rate):
+        """A cache miss, spoken without the cloud voice (or not at all). It is synthesized in the background (batch mode)."""
+        if self.warmer is not None and self.cache.should_admit(text, voice, rate):
+            self.warmer.request(text, voice, rate)
+
+    def __play_file(self, filename, use_cache=True, wait=True, generation=None):
+        item = self.player.play_file(filename, use_cache=use_cache, wait=False, generation=generation)
+        self.__record(item)
+        if not wait:
+            return item
+        return item.wait() if item is not None else False
+
+    def __enqueue(self, pcm, label=None, generation=None):
+        item = self.player.enqueue(pcm, label=label, generation=generation)
+        self.__record(item)
+        return item
+
+    def __record(self, item):
+        # the audio of the utterance is kept, so a cached answer is only played again (see response_cache.py)
+        if self.__recorded is not None:
+            if item is None:
+                self.__recorded = None
+            else:
+                self.__recorded.append(item)
 
-    @staticmethod
-    def __disconnected_prompt():
-        os.system("mpg123 -q 'disconnected.mp3'")
+    def __disconnected_prompt(self):
+        self.__recorded = None  # the utterance was not spoken whole
+        self.player.play_file('disconnected.mp3')
         # os.system("mpg321 'disconnected.mp3'")
         print("ALEX: Sorry! My speech engine is disconnected.")
 
     def speak(self, text, about='general', msg_type='say', voice=0, rate=0.9, save_it=True, try_offline=True):
+        """The speech renderer, called from the scheduler thread. Elsewhere, the speech goes through say()."""
         if text:
-            if try_offline:
-
-                # first try offline and if not found, then try online. If not found: say "disconnected".
-                if self.__speak_offline(text):
-                    memory.add_thought(text, about, msg_type)
-                elif self.__speak_online(text, voice, rate, save_it):
+            with self.__speak_lock:
+                self.is_speaking = True
+                self.last_audio = None
+                self.__recorded = []
+                try:
+                    self.__speak(text, about, msg_type, voice, rate, save_it, try_offline)
+                finally:
+                    recorded, self.__recorded = self.__recorded, None
+                    self.is_speaking = False
+
+                if recorded and all(item.completed and item.pcm for item in recorded):
+                    self.last_audio = b''.join(item.pcm for item in recorded)
+
+    def speak_audio(self, text, audio, about='general', msg_type='say'):
+        """Speaks a pre-rendered utterance (the PCM of 'text', see response_cache.py). Without the audio, 'text' is spoken."""
+        if not audio or not self.player.is_persistent:
+            self.speak(text, about, msg_type)
+            return
+
+        with self.__speak_lock:
+            self.is_speaking = True
+            try:
+                tracer.mark_once('first_audio')
+                with tracer.span('playback'):
+                    completed = self.player.enqueue(audio, label=text).wait()
+                if completed:
                     memory.add_thought(text, about, msg_type)
-                else:
-                    self.__disconnected_prompt()
+                self.last_audio = audio if completed else None
+            finally:
+                self.is_speaking = False
+
+    def say(self, text, priority=ANSWER, about='general', msg_type='say', pcm=None, wait=False):
+        """
+        Queues a message in the speech scheduler (see speech_scheduler.py), with its priority. All the speech goes here.
+        'pcm' is the pre-rendered audio of the message, if any (see speak_audio()).
+        With 'wait', it blocks until the message is spoken, or dropped (a barge-in). Returns the SpeechTask.
+        """
+        task = self.scheduler.say(text, priority=priority, about=about, msg_type=msg_type, pcm=pcm)
+        if wait:
+            task.wait()
+        return task
 
+    def deliver_reports(self, title='Sir', wait=True):
+        """
+        The report delivery: all the queued reports are taken at once, composed into ONE message
+        (see EventReporter.compose()), and spoken as one utterance, with one thought in the memory.
+        Returns the message, or None if there were no reports.
+        """
+        report_msg, about = reporter.compose_reports(title=title)
+        if report_msg:
+            self.say(report_msg, priority=REPORT, about=about)
+            if wait:
+                self.scheduler.wait_idle()
+        return report_msg
+
+    def stop_speaking(self):
+        """Stops the current utterance immediately (in the middle of it), and drops the queued ones."""
+        self.player.stop()
+
+    def barge_in(self, keyword_index=None):
+        """The wake-word was detected while speaking: the speech stops, and the queued messages are dropped."""
+        self.barged_in = True
+        if not self.scheduler.barge_in():
+            self.stop_speaking()
+
+    def __speak(self, text, about, msg_type, voice, rate, save_it, try_offline):
+        # a long answer (a forecast, the reports...) is spoken sentence by sentence, unless it is already offline as a whole
+        sentences = split_sentences(text)
+        if len(sentences) > 1 and self.player.is_persistent and not self.cache.contains(text, voice, rate):
+            if self.__speak_pipelined(sentences, voice, rate, save_it, try_offline):
+                memory.add_thought(text, about, msg_type)
+            else:
+                self.__disconnected_prompt()
+
+        elif try_offline:
+
+            # first try offline (as a whole, or assembled from fragments) and if not found, then try online.
+            # If not found: say "disconnected".
+            if self.__speak_offline(text, voice, rate):
+                memory.add_thought(text, about, msg_type)
+            elif self.PREFER_ASSEMBLY and self.__speak_assembled(text, voice, rate, save_it):
+                memory.add_thought(text, about, msg_type)
+            elif self.__speak_online(text, voice, rate, save_it):
+                memory.add_thought(text, about, msg_type)
+            elif not self.PREFER_ASSEMBLY and self.__speak_assembled(text, voice, rate, save_it):
+                memory.add_thought(text, about, msg_type)
             else:
+                self.__disconnected_prompt()
 
-                # first try online and if no connection, then try offline. If not found: say "disconnected".
-                if self.__speak_online(text, voice, rate, save_it):
-                    memory.add_thought(text, about, msg_type)
-                elif self.__speak_offline(text):
-                    memory.add_thought(text, about, msg_type)
-                else:
-                    self.__disconnected_prompt()
+        else:
+
+            # first try online and if no connection, then try offline. If not found: say "disconnected".
+            if self.__speak_online(text, voice, rate, save_it):
+                memory.add_thought(text, about, msg_type)
+            elif self.__speak_offline(text, voice, rate):
+                memory.add_thought(text, about, msg_type)
+            elif self.__speak_assembled(text, voice, rate, save_it):
+                memory.add_thought(text, about, msg_type)
+            else:
+                self.__disconnected_prompt()
 
 
 # the class contains functions to generate a response string from some data.
@@ -186,6 +428,25 @@ class Response(Speech):
     __CONV_HISTORY_LIMIT = 10
     __MAX_ATTEMPT_LIMIT = 2  # limits the number of attempting to execute a TASK, when data is not enough
 
+    # the wakeup replies, by wake-word index (index 4: 'Good morning' before noon, 'Hello Sir.' after it)
+    WAKEUP_PHRASES = {
+        0: ["Hey?", "Sir?", "Boss?", "Tell me?"],
+        1: ["Always!", "I'm here?", "Sir?", "Always Sir.", "Yes."],
+        2: ["At your service Sir.", "At your service!", "Always Sir."],
+        3: ["At your service Sir.", "What can I do for you?", "Tell me?"],
+        4: ["Good morning Sir!", "Good morning!", "Good morning Sir?"],
+    }
+    TASK_FAILED_MSG = "Sorry Sir, I wasn't able to complete your request."
+    NOT_NOW_MSG = ["OK.", "OK then!"]
+
+    # intent -> warm skill (see skill_registry.py)
+    skills = SkillRegistry(TASK_SKILLS)
+    general_skills = SkillRegistry(GENERAL_SKILLS, instantiate=False)
+    # the skill generators run on a worker pool, so the data is fetched while the prior message is spoken
+    skill_runner = SkillRunner()
+    # the final answers (with their audio), until the data they are made from is updated (see response_cache.py)
+    response_cache = ResponseCache()
+
     def __init__(self, senses):
         # Response will need to speak itself, so the speak() should be available here as well.
         super().__init__()
@@ -195,6 +456,25 @@ class Response(Speech):
         # answer_expected is a dictionary that fills with question if an answer is expected...
         self.answer_expected = None  # {'intent': 'system', 'init-slots':{} 'question': 'I need confirmation to shut down the system.'}
 
+        # the predictable phrases are synthesized in the background, so they are spoken from the offline cache
+        if Speech.warmer is None:
+            skills_phrases = lazy_function('task_skills_v2', 'predictable_phrases')
+            Speech.warmer = PhraseWarmer(self, [self.predictable_phrases, sig.predictable_phrases, skills_phrases,
+                                              PhraseAssembler.fragment_phrases])
+            Speech.warmer.start()
+
+        # the skills are loaded (and their warm-up hooks run) in the background
+        self.skills.start_warm_up(senses)
+        self.general_skills.start_warm_up(senses)
+
+    @classmethod
+    def predictable_phrases(cls):
+        """The phrases of this module, known in advance (see phrase_warmer.py)."""
+        phrases = {"Hello Sir.", cls.TASK_FAILED_MSG, *cls.NOT_NOW_MSG}
+        for choices in cls.WAKEUP_PHRASES.values():
+            phrases.update(choices)
+        return phrases
+
     def expectation_clear(self):
         """Method used from AlexAPI to clear the expectations, if for example alex go to sleep..."""
         self.answer_expected = None
@@ -232,37 +512,45 @@ class Response(Speech):
         The method generates response from giving 'wake_word_index'
         The corresponding index is generated when Porcupine detects a wake-word. See 'class Listen' for details.
         """
-        if wake_word_index == 0:
-            chs = ["Hey?", "Sir?", "Boss?", "Tell me?"]
-            return random.choice(chs)
-        elif wake_word_index == 1:
-            chs = ["Always!", "I'm here?", "Sir?", "Always Sir.", "Yes."]
-            return random.choice(chs)
-        elif wake_word_index == 2:
-            chs = ["At your service Sir.", "At your service!", "Always Sir."]
-            return random.choice(chs)
-        elif wake_word_index == 3:
-            chs = ["At your service Sir.", "What can I do for you?", "Tell me?"]
-            return random.choice(chs)
-        elif wake_word_index == 4:
+        if wake_word_index == 4:
             hour = datetime.datetime.now(timezone).hour
             if hour > 11:
                 return "Hello Sir."
-            else:
-                chs = ["Good morning Sir!", "Good morning!", "Good morning Sir?"]
-                return random.choice(chs)
+        if wake_word_index in Response.WAKEUP_PHRASES:
+            return random.choice(Response.WAKEUP_PHRASES[wake_word_index])
         else:
             return False
 
+    @staticmethod
+    def __is_completed(intent, slots):
+        """True if the skill recorded the request as completed (a failure answer is not cached)."""
+        last_request = memory.get_last_request()
+        return (last_request is not None and last_request['intent'] == intent and last_request['slots'] == slots
+                and last_request['status'] in ('complete', 'completed'))
+
     def task_process(self, intent_to_use, slots_to_use, task):
         if task is not None and slots_to_use is not None:
+            # the same question, on the same data: the answer is only played again
+            cache_key = self.response_cache.key(intent_to_use, slots_to_use, task, self.__senses)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                # the skill is not run, but the request is remembered the same way (a follow-up may refer to it)
+                memory.add_request(intent_to_use, slots_to_use, status='complete', note='cached answer')
+                self.say(cached.text, about=intent_to_use, pcm=cached.audio, wait=True)
+                return True
+
             # Task is attempting to process the request...
             processor = task.process(slots_to_use, senses=self.__senses)
 
-            for return_data in processor:
+            # the skill runs ahead on a worker thread: while a message is spoken here, it goes on with its work
+            for return_data in self.skill_runner.run(tracer.timed_generator('task_process', processor)):
+                if self.barged_in:
+                    # the user interrupted the prior message with the wake-word: the new request comes first
+                    break
+
                 if return_data and isinstance(return_data, str):
-                    # if return_data is a string message, it means it is a prior (init) message
-                    self.speak(return_data, about=intent_to_use)
+                    # if return_data is a string message, it means it is a prior (init) message, or a partial result
+                    self.say(return_data, about=intent_to_use, wait=True)
 
                 elif return_data and isinstance(return_data, tuple):
 
@@ -270,17 +558,19 @@ class Response(Speech):
                     return_msg, self.answer_expected = return_data
                     if return_msg:
                         if self.answer_expected is not None:
-                            self.speak(return_msg, about=intent_to_use, msg_type='ask')
+                            self.say(return_msg, about=intent_to_use, msg_type='ask', wait=True)
 
                             # note: an answer is expected. so ringing starts to engage the user:
                             sig.ringing_start('answer-expected')
                         else:
-                            self.speak(return_msg, about=intent_to_use)
+                            answer = self.say(return_msg, about=intent_to_use, wait=True)
+                            if not self.barged_in and self.__is_completed(intent_to_use, slots_to_use):
+                                self.response_cache.put(cache_key, return_msg, answer.pcm)
 
                         return True
 
                     else:
-                        self.speak("Sorry Sir, I wasn't able to complete your request.", about=intent_to_use)
+                        self.say(self.TASK_FAILED_MSG, about=intent_to_use, wait=True)
 
 
             # Note: There may be a TASK functions with no 'prior'/'init' message, but only a final answer.
@@ -296,6 +586,11 @@ class Response(Speech):
     - the RESPOND function only respond if the answer is in ["tell me", "what", "shoot"...] 
     """
     def respond(self, intent, slots):
+        self.barged_in = False
+        with tracer.span('respond'):
+            return self.__respond(intent, slots)
+
+    def __respond(self, intent, slots):
         # print(f"intent = {intent} | slots = {slots}")
         # print(f"Answer expected: {self.answer_expected} | ringing: {sig.is_ringing}")
 
@@ -339,12 +634,11 @@ class Response(Speech):
                     if 'ask' in slots.keys():
                         if slots['ask'] in ask_list1:
                             if 'note' in self.answer_expected:
-                                self.speak(self.answer_expected['note'])
+                                self.say(self.answer_expected['note'], wait=True)
                                 return True
                         elif 'not now' in slots.values():
                             self.expectation_clear()
-                            chs = ["OK.", "OK then!"]
-                            self.speak(random.choice(chs))
+                            self.say(random.choice(self.NOT_NOW_MSG), wait=True)
                             return True
 
                     if 'intent' in self.answer_expected.keys() and self.answer_expected['intent'] is not None:
@@ -355,15 +649,15 @@ class Response(Speech):
                             slots_to_use.update(slots_from_memory)
                         # else slots will be only the slots from the request.
 
-                        if intent_to_use in SKILL_LIST.keys():
-                            task = SKILL_LIST[intent_to_use]()
+                        if intent_to_use in self.skills:
+                            task = self.skills[intent_to_use]
 
-                elif intent in SKILL_LIST.keys():
+                elif intent in self.skills:
 
                     intent_to_use = intent
                     slots_to_use = slots.copy()
 
-                    task = SKILL_LIST[intent_to_use]()
+                    task = self.skills[intent_to_use]
 
                 if task is not None:
                     # Stop the ringing process and clear the expectations
@@ -379,21 +673,21 @@ class Response(Speech):
         # Answer is NOT expected. The user request came out of nothing.
         else:
             # 2. Check what kind of intent was received
-            if intent in SKILL_LIST.keys():
+            if intent in self.skills:
                 # a) The intent is a regular request for a known SKILL
                 # -- it uses self.__senses to get the information.
                 # -- for now it does not need information from the memory, so it is not used.
                 intent_to_use = intent
                 slots_to_use = slots.copy()
-                task = SKILL_LIST[intent_to_use]()
+                task = self.skills[intent_to_use]
 
                 # Attempting to process the task...
                 if self.task_process(intent_to_use=intent_to_use, slots_to_use=slots_to_use, task=task):
                     return True
 
-            elif intent in GENERAL_LIST.keys():
+            elif intent in self.general_skills:
                 # b) The intent is a general request.
-                task = GENERAL_LIST[intent]
+                task = self.general_skills[intent]
                 slots_to_use = slots.copy()
 
                 if task is not None and slots_to_use is not None:
@@ -435,7 +729,7 @@ class Response(Speech):
 
                     return_msg = task.process(slots_to_use)
                     if return_msg and isinstance(return_msg, str):
-                        self.speak(return_msg, about=intent)
+                        self.say(return_msg, about=intent, wait=True)
                         return True
 
 
@@ -0,0 +1,116 @@
+"""
+The RESPONSE CACHE: the final answers of the skills, used from Response.task_process() (respond.py).
+
+The same questions come many times a day ("what's the weather", "forecast for tomorrow"). Before, each one
+ran the whole skill again, and synthesized the same paragraph again.
+Here, an answer is kept with the key (intent, canonical slots, location, data version):
+- the canonical slots: without the words that only change the prior message ('adj', 'id'), normalised and sorted,
+- the DATA VERSION comes from the skill: 'data_version(slots, senses)', for example the 'last_updated' timestamp
+  of the weather data. When the data is updated, the key changes, so the old answer is not found any more.
+  A skill without it (or returning None) is not cached: its answer depends on something else (the time now...).
+- the answer keeps its AUDIO (the PCM played when it was spoken), so a repeated question costs only the playback.
+The TTL is only an upper bound, in case the data version is not updated for a long time.
+"""
+
+# ======================== IMPORT =========================
+import threading
+import time
+from collections import OrderedDict
+
+
+# ======================= CLASSES =========================
+
+class CachedResponse:
+    """One cached answer."""
+
+    def __init__(self, text, audio=None):
+        self.text = text
+        self.audio = audio  # PCM (see playback.py), or None if it was not recorded
+        self.created = time.time()
+        self.hits = 0
+
+
+class ResponseCache:
+    IGNORED_SLOTS = ('id', 'adj')  # they do not change the answer
+
+    def __init__(self, ttl=3 * 3600, max_entries=32, max_bytes=16 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes  # of the kept audio
+
+        self.__entries = OrderedDict()  # key -> CachedResponse (LRU)
+        self.__audio_bytes = 0
+        self.__lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def canonical_slots(cls, slots):
+        """{'ask': "What's the  Weather", 'adj': 'could you'} -> (('ask', "what's the weather"),)"""
+        return tuple(sorted((name, " ".join(str(value).split()).casefold())
+                            for name, value in slots.items() if name not in cls.IGNORED_SLOTS))
+
+    def key(self, intent, slots, skill, senses):
+        """The cache key of a request, or None if the answer of the skill can not be cached."""
+        data_version = getattr(skill, 'data_version', None)
+        if data_version is None:
+            return None
+        try:
+            version = data_version(slots, senses)
+            location = (senses.location.city, senses.location.latitude, senses.location.longitude)
+        except Exception as e:
+            print(f"ERR: while getting the data version of '{intent}': {e}")
+            return None
+        if version is None:
+            return None
+        return intent, self.canonical_slots(slots), location, version
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and time.time() - entry.created > self.ttl:
+                self.__remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            entry.hits += 1
+            self.hits += 1
+            return entry
+
+    def put(self, key, text, audio=None):
+        if key is None or not text:
+            return
+        with self.__lock:
+            if key in self.__entries:
+                self.__remove(key)
+            if audio is not None and len(audio) > self.max_bytes:
+                audio = None
+            self.__entries[key] = CachedResponse(text, audio)
+            self.__audio_bytes += len(audio) if audio else 0
+            while len(self.__entries) > self.max_entries or self.__audio_bytes > self.max_bytes:
+                self.__remove(next(iter(self.__entries)))
+
+    def __remove(self, key):
+        entry = self.__entries.pop(key)
+        self.__audio_bytes -= len(entry.audio) if entry.audio else 0
+
+    def invalidate(self, intent=None):
+        """Drops the answers of an intent (or all of them)."""
+        with self.__lock:
+            for key in [key for key in self.__entries if intent is None or key[0] == intent]:
+                self.__remove(key)
+
+    def status(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.__entries),
+            'audio_kb': self.__audio_bytes // 1024,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(100 * self.hits / lookups, 1) if lookups else None,
+        }
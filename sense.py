@@ -12,17 +12,17 @@ import time
 from datetime import datetime
 
 # ------ Speech Recognition ------
-import wave
-import struct
+import os
 
 import pvporcupine
 import pvrhino
-import pvcheetah
-from pvrecorder import PvRecorder
 
 # ------ My Libraries ------
+from audio import AudioCapture, WavDebugSink, VoiceActivityGate
+import stt
 from sense_skills import SenseSingleton
 from events import Signals as sig
+from latency import LatencyTracer as tracer
 
 # ======================= GLOBALS =========================
 
@@ -70,15 +70,78 @@ class Listen:
     __context_path = "sr/alexis.rhn"  # Rhino speech to intend model path. The newest one.
     __model_path = 'sr/alexis.pv'  # cheetah speech-to-text
 
-    def __init__(self):
+    # Pre-roll: the capture service always keeps the last few seconds of audio.
+    # On wake-word detection they are replayed into Rhino before the live frames,
+    # so a command spoken right after the wake word ('hey Alex what's the weather') is not lost.
+    PREROLL = {
+        'enabled': True,
+        'seconds': 1.5,  # how much audio is kept before the switch to Rhino
+        'inflight_window': 1.0,  # seconds of live audio to wait for a command that is already in flight
+        'skip_wakeup_reply': True,  # if True and a command is in flight, the wakeup reply is not spoken
+    }
+
+    # Recording of the idle (wake-word) audio, for debugging. Written on a background thread.
+    DEBUG_RECORDING = {
+        'enabled': False,
+        'directory': 'debug_audio',
+        'rotate_sec': 300,  # start a new file every 5 minutes of audio
+        'keep_files': 5,
+    }
+
+    # Rhino finalizes an utterance after this much silence. The VAD hangover is never shorter (see __init__).
+    RHINO_ENDPOINT_SEC = 1.0
+
+    # Voice activity gate in front of Rhino. In a silent room, the frames are not processed by Rhino at all.
+    # Use 'vad_report()' to see how much CPU time is saved per mode, and tune the thresholds.
+    VAD = {
+        'enabled': True,
+        'modes': ('engaged', 'disengaged'),  # listening modes where the gate is used
+        'energy_threshold': 300.0,  # minimum RMS energy of a speech frame (int16 scale)
+        'noise_ratio': 3.0,  # speech should be this many times louder than the noise floor
+        'zcr_max': 0.35,  # frames with a higher zero-crossing rate are treated as noise
+        'onset_frames': 2,  # ~64 ms of speech opens the gate
+        'hangover_frames': 36,  # ~1.15 sec after the speech stops, the gate is still open (Rhino sees the endpoint)
+        'pre_speech_frames': 8,  # ~0.25 sec before the onset is released to Rhino
+    }
+
+    # Free-form speech to text (see stt.py). 'engine': 'cheetah' / 'whisper' / None (disabled)
+    # The engine is loaded on the first listen_for_speech(), not at startup (nothing in the conversation uses it yet).
+    STT = {
+        'engine': None,
+        'whisper_model': 'tiny.en',
+    }
+
+    def __init__(self, source=None, start_capture=True):
+        """
+        'source' is an audio.AudioSource. If None, the microphone is used. See replay.py for replaying WAV files.
+        If 'start_capture' is False, no source is opened until use_source() is called (the microphone is not touched).
+        """
         self.__is_error = False
         # self.__is_online = SenseSingleton.get_instance().connection.is_internet
 
-        self.status = 'porcupine'  # 'porcupine', 'rhino', 'cheetah'
+        self.status = 'porcupine'  # 'porcupine', 'rhino', 'stt'
 
         self.pc = None
         self.rhino = None
-        self.cheetah = None
+        self.stt = None  # streaming speech-to-text engine (Cheetah or Whisper), see __load_stt()
+        self.__stt_tried = False
+
+        # set from another thread, to stop the listening within one frame (see cancel_listening())
+        self.__listen_cancelled = False
+
+        # the microphone is owned by the capture service. Listening only switches its active consumer.
+        self.capture = None
+
+        self.wav_sink = WavDebugSink(directory=self.DEBUG_RECORDING['directory'],
+                                     enabled=self.DEBUG_RECORDING['enabled'],
+                                     rotate_sec=self.DEBUG_RECORDING['rotate_sec'],
+                                     keep_files=self.DEBUG_RECORDING['keep_files'])
+
+        vad_params = {key: value for key, value in self.VAD.items() if key not in ('enabled', 'modes')}
+        # the gate should stay open until Rhino has seen the whole endpoint silence (frames of 512 samples at 16 kHz)
+        endpoint_frames = int(self.RHINO_ENDPOINT_SEC * 16000 / 512) + 2
+        vad_params['hangover_frames'] = max(vad_params['hangover_frames'], endpoint_frames)
+        self.vad = VoiceActivityGate(**vad_params)
 
         try:
             self.pc = pvporcupine.create(access_key=self.__access_key, keyword_paths=self.__keyword_path)
@@ -87,49 +150,113 @@ class Listen:
                 access_key=self.__access_key,
                 context_path=self.__context_path,
                 sensitivity=0.2,  # lower value decrease potentially misunderstandings
+                endpoint_duration_sec=self.RHINO_ENDPOINT_SEC,
                 require_endpoint=False,
 
             )
-            # TODO: self.cheetah = ... or Open Ai Whispr
+            preroll_sec = self.PREROLL['seconds'] if self.PREROLL['enabled'] else 0
+            self.__preroll_sec = preroll_sec
+            if start_capture:
+                self.use_source(source)
 
         except Exception as e:
             print(e)
             self.__is_error = True
 
+    def __load_stt(self):
+        """Loads the speech-to-text engine once, on its first use. Returns it, or None if disabled or not available."""
+        if self.stt is None and not self.__stt_tried and self.STT['engine']:
+            self.__stt_tried = True
+            # the speech-to-text engine is optional. If it fails, the wake-word and the intents still work.
+            try:
+                model_path = self.__model_path if os.path.exists(self.__model_path) else None
+                self.stt = stt.create_engine(self.STT['engine'], access_key=self.__access_key, model_path=model_path,
+                                             whisper_model=self.STT['whisper_model'])
+            except Exception as e:
+                print(f"ERR: speech-to-text engine '{self.STT['engine']}' is not available: {e}")
+        return self.stt
+
+    def use_source(self, source=None):
+        """(Re)starts the capture service with a new audio source (None = the microphone)."""
+        if self.capture is not None:
+            self.capture.stop()
+
+        self.capture = AudioCapture(frame_length=self.pc.frame_length, preroll_sec=self.__preroll_sec,
+                                    sample_rate=self.pc.sample_rate, source=source)
+        self.capture.subscribe('porcupine')
+        self.capture.subscribe('rhino')
+        self.capture.subscribe('stt')
+        self.capture.start()
+
+    def __switch_to(self, consumer, with_preroll=False):
+        # changing the mode only changes the active consumer of the (always running) capture service.
+        self.status = consumer
+        return self.capture.activate(consumer, with_preroll=with_preroll)
+
+    def __replay_preroll(self, preroll):
+        """Feeds the pre-roll audio into Rhino. Returns the inference if Rhino finalized on it, else None."""
+        if preroll is None:
+            return None
+
+        for frame in self.capture.preroll.split_frames(preroll, self.rhino.frame_length):
+            if self.rhino.process(frame):
+                return self.rhino.get_inference()
+        return None
+
+    def cancel_listening(self):
+        """Stops the listening running on another thread (it returns with nothing heard). See clear_listening_cancel()."""
+        self.__listen_cancelled = True
+        if self.capture is not None:
+            self.capture.interrupt()
+
+    def clear_listening_cancel(self):
+        """Called once the cancelled listening has returned, so the next listening is not cancelled."""
+        self.__listen_cancelled = False
+
+    def listen_for_inflight_cmd(self):
+        """
+        Used right after a wake-word is detected.
+        It checks if the user did not stop after the wake-word, but continued with a command.
+        Returns (intent, slots, ringing_msg), all None if there is no command in flight or the option is disabled.
+        """
+        if not self.PREROLL['enabled'] or not self.PREROLL['skip_wakeup_reply']:
+            return None, None, None
+
+        return self.listen_for_cmd(self.PREROLL['inflight_window'], engaged=True, preroll=True,
+                                   max_duration=self.PREROLL['inflight_window'])
+
     def listen_for_wakeword(self):
         keyword_index = -1
         ringing_msg = None
-        recorder = None
         try:
-            recorder = PvRecorder(device_index=-1, frame_length=self.pc.frame_length)
-            recorder.start()
-
-            wav_file = wave.open('pc.wav', "w")
-            wav_file.setparams((1, 2, 16000, 512, "NONE", "NONE"))
+            self.__switch_to('porcupine')
 
             print("[Alex: Going Idle...]")
             while not ringing_msg:
-                pcm = recorder.read()
+                pcm = self.capture.read('porcupine')
+                if self.__listen_cancelled:
+                    break  # also a cancel that came before this listening took the audio
+                if pcm is None:
+                    # the read is interrupted when a ringing message arrives (see AudioCapture.interrupt())
+                    ringing_msg = sig.get_ringing_msg()
+                    if not self.capture.is_running:
+                        break
+                    continue
 
-                if wav_file is not None:
-                    wav_file.writeframes(struct.pack("h" * len(pcm), *pcm))
+                self.wav_sink.write(pcm)  # never blocks. Returns immediately if debug recording is off.
 
+                frame_start = time.perf_counter()
                 keyword_index = self.pc.process(pcm)
                 if keyword_index >= 0:
                     # check for each keyword_index (0, 1, 2, 3, 4)
+                    tracer.begin_turn(started_at=frame_start)
+                    tracer.record('wake', time.perf_counter() - frame_start)
                     break
-                else:
-                    ringing_msg = sig.get_ringing_msg()
-
-            recorder.stop()
 
         except Exception as e:
             print(f"Error in porcupine: {e}")
-            if recorder is not None:
-                recorder.delete()
         finally:
-            if recorder is not None:
-                recorder.delete()
+            self.capture.deactivate('porcupine')
             return keyword_index, ringing_msg
 
     # Capturing commands. Uses 2 regimes:
@@ -137,22 +264,67 @@ class Listen:
     #   - Active longer time allowing directly speaking the command only by including the name of PDA.
     # 2. Additional interaction, without 'ident' required. Active for short time
     # Note: 'ident' will be checked as a rhino slot.
-    def listen_for_cmd(self, silent_timeout, engaged=False):
-        recorder = None
+    # If 'preroll' is True, the audio captured just before listening started, is processed first.
+    # 'max_duration' limits the listening time, even if Rhino is still in the middle of an utterance.
+    def listen_for_cmd(self, silent_timeout, engaged=False, preroll=False, max_duration=None):
         intent, slots = None, None
         ringing_msg = None
+        is_finalized = True  # False while Rhino holds a part of an utterance
         try:
-            recorder = PvRecorder(device_index=-1, frame_length=self.rhino.frame_length)
+            preroll_pcm = self.__switch_to('rhino', with_preroll=preroll and self.PREROLL['enabled'])
             silent_time = time.time()
 
-            recorder.start()
+            mode = 'engaged' if engaged else 'disengaged'
+            use_gate = self.VAD['enabled'] and mode in self.VAD['modes']
+            self.vad.reset(mode)
+
+            inference = self.__replay_preroll(preroll_pcm)
+            is_finalized = preroll_pcm is None or inference is not None
+            if inference is not None and inference.is_understood:
+                tracer.mark('rhino_final')
+                print(f"YOU (pre-roll): intent={inference.intent} | slots={inference.slots}")
+                return inference.intent, inference.slots, None
+
             while not ringing_msg:
-                # note: if a ringing occur, the loop will break and PDA will return the response.
-                pcm = recorder.read()
-                is_finalized = self.rhino.process(pcm)
+                if max_duration is not None and time.time() - silent_time >= max_duration:
+                    break
+
+                # note: if a ringing occur, the read is interrupted, the loop will break and PDA will return the response.
+                pcm = self.capture.read('rhino')
+                if self.__listen_cancelled:
+                    break  # also a cancel that came before this listening took the audio
+                if pcm is None:
+                    ringing_msg = sig.get_ringing_msg()
+                    if not self.capture.is_running:
+                        break
+                    continue
+
+                if use_gate:
+                    frames = self.vad.process(pcm)
+                    if not frames:
+                        # silence: Rhino is not running, so the timeout is checked here.
+                        if time.time() - silent_time >= silent_timeout:
+                            break
+                        continue
+                else:
+                    frames = (pcm,)
+
+                is_finalized = False
+                for frame in frames:
+                    start = time.perf_counter()
+                    is_finalized = self.rhino.process(frame)
+                    if use_gate:
+                        self.vad.record_engine_time(time.perf_counter() - start)
+                    if is_finalized:
+                        break
+
                 if is_finalized:
                     inference = self.rhino.get_inference()
                     if inference.is_understood:
+                        if preroll:
+                            tracer.mark('rhino_final')  # the command right after the wake-word, same turn
+                        else:
+                            tracer.begin_turn()  # a command without wake-word starts a new turn
 
                         intent = inference.intent
                         slots = inference.slots
@@ -173,32 +345,86 @@ class Listen:
                         if time.time() - silent_time >= silent_timeout:
                             break  # exit if nothing is understood for 10 minutes. This will cause the Ai to go-sleep
 
-                    ringing_msg = sig.get_ringing_msg()
-
-            recorder.stop()
-
         except Exception as e:
             print(e)
             self.__is_error = True
-            if recorder is not None:
-                recorder.delete()
 
         finally:
-            if recorder is not None:
-                recorder.delete()
+            self.capture.deactivate('rhino')
+            if not is_finalized and self.rhino is not None:
+                # the listening stopped in the middle of an utterance (a timeout, cancel or ringing).
+                # Without a reset, Rhino would append the next listening to it.
+                self.rhino.reset()
 
         return intent, slots, ringing_msg
 
+    def listen_for_speech(self, silent_timeout, on_partial=None):
+        """
+        Free-form listening, using the speech-to-text engine (not the Rhino intents).
+        The frames are streamed to the engine one by one. 'on_partial(text)' receives the transcript while it is built.
+        Returns (transcript, ringing_msg). The transcript is None if nothing was said in 'silent_timeout' seconds.
+        """
+        transcript = None
+        ringing_msg = None
+        if self.__load_stt() is None:
+            return transcript, ringing_msg
+
+        self.stt.on_partial = on_partial
+        self.stt.reset()
+        try:
+            self.__switch_to('stt')
+            start_time = time.time()
+
+            while not ringing_msg:
+                pcm = self.capture.read('stt')
+                if self.__listen_cancelled:
+                    break  # also a cancel that came before this listening took the audio
+                if pcm is None:
+                    ringing_msg = sig.get_ringing_msg()
+                    if not self.capture.is_running:
+                        break
+                    continue
+
+                if self.stt.process(pcm):
+                    transcript = self.stt.flush() or None
+                    if transcript:
+                        print(f"YOU: {transcript}")
+                        break
+                    start_time = time.time()  # only noise was transcribed. Listen again.
+
+                elif not self.stt.transcript and time.time() - start_time >= silent_timeout:
+                    break
+
+        except Exception as e:
+            print(f"ERR: in speech-to-text: {e}")
+
+        finally:
+            self.capture.deactivate('stt')
+            self.stt.on_partial = None
+
+        return transcript, ringing_msg
+
+    def vad_report(self):
+        """Per-mode statistics of the voice activity gate (frames held back from Rhino, CPU time saved)."""
+        return self.vad.report()
+
     # use this method to clear the resources taken from Porcupine, Rhino and Cheetah
     def clear_picovoice_res(self):
+        if self.capture is not None:
+            self.capture.stop()
+        self.wav_sink.stop()
+
+        for mode, stats in self.vad_report().items():
+            print(f"VAD [{mode}]: {stats}")
+
         if self.pc is not None:
             self.pc.delete()
 
         if self.rhino is not None:
             self.rhino.delete()
 
-        if self.cheetah is not None:
-            self.cheetah.delete()
+        if self.stt is not None:
+            self.stt.delete()
 
-        if not self.pc and not self.rhino and not self.cheetah:
+        if not self.pc and not self.rhino and not self.stt:
             print("Picovoice resources cleared successfully.")
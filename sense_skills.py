@@ -418,12 +418,8 @@ class Connection:
             # time.sleep(1)
             # self.is_mqtt = self.check_for_mqtt()
 
-            # checking connectivity every 30 seconds... Do not wait if a program_terminate signal is set
-            for i in range(30):
-                if not sig.program_terminate:
-                    time.sleep(1)
-                else:
-                    break
+            # checking connectivity every 30 seconds... The waiting is interrupted on the program termination.
+            sig.terminate_event.wait(30)
 
         self.thread_is_finished = True  # assures the method finished its work, after 'stop_thread' flag raises True
 
@@ -994,13 +990,9 @@ class Environment:
         while not sig.program_terminate:
             self.update_environment_data()
 
-            # we update weather every 5 min, so we wait 300 x 1sec,
+            # we update weather every 2 min,
             # but if a 'program_terminate' signal is set, the waiting is terminated.
-            for i in range(120):
-                if not sig.program_terminate:
-                    time.sleep(1)
-                else:
-                    break
+            sig.terminate_event.wait(120)
 
         self.thread_is_finished = True  # Flag, proving the method finished its work.
 
@@ -0,0 +1,169 @@
+"""
+The SKILL REGISTRY: intent -> skill, used from the Response class (respond.py).
+
+Before, respond.py imported all of 'task_skills_v2' at startup (with pytz, timezonefinder...), even for the skills
+never used, and a new skill object was built on every request ('SKILL_LIST[intent]()').
+Here, the skills are registered by name (module, class), and:
+- a skill module is imported on the first use of one of its skills (or by the warm-up, whichever is first),
+- every skill is instanced ONCE, and kept warm. The dispatch is a dict lookup: 'registry[intent].process(...)',
+- after startup, a background thread loads all the skills and runs their WARM-UP hooks:
+  a skill may declare 'warm_up(self, senses)' (loading an index, priming a cache...). A failing hook is only logged.
+
+Note: the skill instances are shared, so a skill keeps its per-request data in local variables
+(its history is a class attribute, as before).
+
+The SKILL RUNNER drives a skill generator on a worker pool, ahead of the caller: right after the skill yields
+its prior message ('Of course!'), it goes on fetching its data, while the caller speaks the message.
+Every string a skill yields is spoken in order, so a skill can also stream PARTIAL results before the final answer.
+"""
+
+# ======================== IMPORT =========================
+import importlib
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# ======================= GLOBALS =========================
+# the same as SKILL_LIST and GENERAL_LIST in task_skills_v2.py, by name, so the module is not imported at startup
+TASK_SKILLS = {
+    'time': ('task_skills_v2', 'TimeQueries'),
+    'schedule': ('task_skills_v2', 'ScheduleQueries'),
+    'weather': ('task_skills_v2', 'WeatherQueries'),
+    'system': ('task_skills_v2', 'SystemQueries'),
+    'music': ('task_skills_v2', 'MusicQueries'),
+}
+
+# the general skills have a static process(): the class itself is used
+GENERAL_SKILLS = {
+    'general': ('task_skills_v2', 'General'),
+    'feedback': ('task_skills_v2', 'Feedback'),
+    'greeting': ('task_skills_v2', 'Greetings'),
+}
+
+
+# ======================= FUNCTIONS =======================
+
+def lazy_function(module_name, function_name):
+    """A function of a module, imported on its first call (for example a phrase source of the phrase warmer)."""
+    def call(*args, **kwargs):
+        return getattr(importlib.import_module(module_name), function_name)(*args, **kwargs)
+    return call
+
+
+# ======================= CLASSES =========================
+
+class SkillRegistry:
+    __WARM_UP_DELAY = 5  # seconds after startup, so the warm-up does not compete with the first requests
+
+    def __init__(self, skills, instantiate=True):
+        """'skills' is a dict: intent -> (module name, class name). With 'instantiate', the class is instanced once."""
+        self.__names = dict(skills)
+        self.instantiate = instantiate
+
+        self.__skills = {}  # intent -> the warm skill (the instance, or the class)
+        self.__lock = threading.RLock()
+        self.__warm_up_thread = None
+
+        self.load_time = {}  # intent -> seconds spent to import and instance the skill
+        self.warm_up_errors = {}
+
+    def __contains__(self, intent):
+        return intent in self.__names
+
+    def __getitem__(self, intent):
+        skill = self.__skills.get(intent)
+        if skill is None:
+            skill = self.__load(intent)
+        return skill
+
+    def keys(self):
+        return self.__names.keys()
+
+    def register(self, intent, module_name, class_name):
+        with self.__lock:
+            self.__names[intent] = (module_name, class_name)
+            self.__skills.pop(intent, None)
+
+    def __load(self, intent):
+        """Imports the module of the skill (on the first use), and instances the skill. Raises KeyError if not registered."""
+        module_name, class_name = self.__names[intent]
+        with self.__lock:
+            skill = self.__skills.get(intent)
+            if skill is not None:
+                return skill  # loaded by another thread meanwhile
+
+            start = time.perf_counter()
+            skill_class = getattr(importlib.import_module(module_name), class_name)
+            skill = skill_class() if self.instantiate else skill_class
+            self.load_time[intent] = round(time.perf_counter() - start, 3)
+            self.__skills[intent] = skill
+            return skill
+
+    # ------------- warm-up -------------
+    def start_warm_up(self, senses=None):
+        """Loads all the skills and runs their warm-up hooks, on a background thread. Called once, after startup."""
+        with self.__lock:
+            if self.__warm_up_thread is not None:
+                return
+            self.__warm_up_thread = threading.Thread(target=self.__warm_up, args=(senses,), daemon=True)
+            self.__warm_up_thread.start()
+
+    def __warm_up(self, senses):
+        time.sleep(self.__WARM_UP_DELAY)
+        for intent in list(self.__names):
+            try:
+                skill = self[intent]
+                warm_up = getattr(skill, 'warm_up', None)
+                if warm_up is not None:
+                    warm_up(senses)
+            except Exception as e:
+                self.warm_up_errors[intent] = str(e)
+                print(f"ERR: while warming up the skill '{intent}': {e}")
+
+    def status(self):
+        return {
+            'registered': len(self.__names),
+            'loaded': len(self.__skills),
+            'load_time': dict(self.load_time),
+            'warm_up_errors': dict(self.warm_up_errors),
+        }
+
+
+class SkillRunner:
+    __DONE = object()
+
+    def __init__(self, max_workers=2):
+        self.__pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='skill')
+
+    def run(self, generator):
+        """
+        Runs the skill generator on a worker thread, and yields its items as they are ready.
+        The worker does not wait for the consumer. If the consumer stops early (a barge-in), the skill is closed
+        at its next yield. An exception of the skill is raised here, in the consumer.
+        """
+        items = queue.Queue()
+        stop_event = threading.Event()
+        self.__pool.submit(self.__drive, generator, items, stop_event)
+        try:
+            while True:
+                item, error = items.get()
+                if error is not None:
+                    raise error
+                if item is self.__DONE:
+                    return
+                yield item
+        finally:
+            stop_event.set()
+
+    def __drive(self, generator, items, stop_event):
+        try:
+            for item in generator:
+                items.put((item, None))
+                if stop_event.is_set():
+                    generator.close()
+                    break
+        except Exception as e:
+            items.put((None, e))
+        finally:
+            items.put((self.__DONE, None))
@@ -0,0 +1,235 @@
+"""
+The SPEECH SCHEDULER: a prioritised output queue in front of Speech.speak() (respond.py).
+
+Before, all the speech was synchronous, in the order it was issued: a long report could not be interrupted,
+and an urgent message waited behind the routine ones.
+
+Here, ALL the speech is queued with a priority (see Speech.say()), and spoken one by one from the scheduler thread.
+Speech.speak() is only the renderer, called from here.
+- ALERT: the ringing messages ('Sir, are you there?'). An alert also interrupts a lower priority message being
+  spoken, which is repeated after it,
+- ANSWER: the answers to the commands, and the wake-up replies,
+- REPORT: the reports (see Speech.deliver_reports()),
+- CHITCHAT: the rest (the start-up messages),
+- the adjacent low priority messages (REPORT, CHITCHAT) are MERGED into one utterance (one TTS request, one pause).
+- every queued message can be cancelled (cancel(), cancel_all()).
+- BARGE-IN: barge_in() stops the message being spoken immediately (see AudioPlayer.stop()), and drops the queued
+  ones, except the alerts. It is called when the wake-word is detected during the speech (see orchestrator.py).
+
+Usage:
+    task = scheduler.say("Sir, the battery is low.", priority=ALERT, about='system')
+    scheduler.wait_idle()
+"""
+
+# ======================== IMPORT =========================
+import heapq
+import itertools
+import threading
+
+from events import Signals as sig
+
+# ======================= GLOBALS =========================
+ALERT = 0
+ANSWER = 1
+REPORT = 2
+CHITCHAT = 3
+
+PRIORITY_NAMES = {ALERT: 'alert', ANSWER: 'answer', REPORT: 'report', CHITCHAT: 'chitchat'}
+
+
+# ======================= CLASSES =========================
+
+class SpeechTask:
+    """One queued message."""
+
+    def __init__(self, text, priority, about='general', msg_type='say', voice=0, rate=0.9, pcm=None):
+        self.text = text
+        self.priority = priority
+        self.about = about
+        self.msg_type = msg_type
+        self.voice = voice
+        self.rate = rate
+        # the PCM of the message: pre-rendered (see Speech.speak_audio()), or as it was played whole, once spoken
+        self.pcm = pcm
+
+        self.cancelled = False
+        self.interrupted = False  # stopped in the middle by a barge-in
+        self.preempted = False  # stopped in the middle by an alert. It is spoken again after the alert.
+        self.done = threading.Event()
+
+    def cancel(self):
+        self.cancelled = True
+        self.done.set()
+
+    def wait(self, timeout=None):
+        """Blocks until the message is spoken (or cancelled). Returns True if it was spoken to the end."""
+        self.done.wait(timeout)
+        return self.done.is_set() and not self.cancelled and not self.interrupted
+
+
+class SpeechScheduler:
+    MERGEABLE = (REPORT, CHITCHAT)
+    __MAX_MERGED = 4  # messages merged into one utterance
+
+    def __init__(self, speech):
+        self.speech = speech  # the Speech instance. Its speak() is called from the scheduler thread.
+
+        self.__heap = []  # (priority, sequence, task)
+        self.__sequence = itertools.count()
+        self.__cond = threading.Condition()
+        self.__current = []  # the tasks being spoken (more than one if merged)
+        self.__is_running = False
+        self.__thread = threading.Thread(target=self.__scheduler_thread, daemon=True)
+
+        self.spoken = 0
+        self.merged = 0
+        self.cancelled = 0
+        self.barge_ins = 0
+
+    def start(self):
+        if not self.__is_running:
+            self.__is_running = True
+            sig.add_terminate_listener(self.stop)
+            self.__thread.start()
+
+    def stop(self):
+        with self.__cond:
+            self.__is_running = False
+            # nobody waits for a message that will not be spoken
+            for _, _, task in self.__heap:
+                task.cancel()
+            self.__heap = []
+            self.__cond.notify_all()
+
+    # ------------- queueing -------------
+    def say(self, text, priority=ANSWER, about='general', msg_type='say', voice=0, rate=0.9, pcm=None):
+        """Queues a message (from any thread). Returns the SpeechTask."""
+        task = SpeechTask(text, priority, about, msg_type, voice, rate, pcm)
+        if not text:
+            task.done.set()
+            return task
+
+        with self.__cond:
+            if not self.__is_running:
+                task.cancel()
+                return task
+            heapq.heappush(self.__heap, (priority, next(self.__sequence), task))
+            # an alert does not wait for a lower priority message to finish
+            if priority == ALERT and any(current.priority > ALERT for current in self.__current):
+                for current in self.__current:
+                    current.preempted = True
+                self.speech.stop_speaking()
+            self.__cond.notify_all()
+        return task
+
+    def cancel(self, task):
+        with self.__cond:
+            task.cancel()
+            self.cancelled += 1
+            if task in self.__current:
+                self.speech.stop_speaking()
+            self.__cond.notify_all()
+
+    def cancel_all(self, min_priority=ANSWER, about=None):
+        """Cancels the queued messages with priority >= 'min_priority' (and the given 'about', if any)."""
+        with self.__cond:
+            kept = []
+            for item in self.__heap:
+                task = item[2]
+                if task.priority >= min_priority and (about is None or task.about == about):
+                    task.cancel()
+                    self.cancelled += 1
+                else:
+                    kept.append(item)
+            heapq.heapify(kept)
+            self.__heap = kept
+            self.__cond.notify_all()
+
+    def barge_in(self):
+        """The user started to talk (the wake-word was detected): stop speaking, and drop the queued messages."""
+        with self.__cond:
+            if not self.__current and not self.__heap:
+                return False
+            self.barge_ins += 1
+            for current in self.__current:
+                current.interrupted = True
+            self.speech.stop_speaking()
+        self.cancel_all(min_priority=ANSWER)
+        return True
+
+    @property
+    def is_busy(self):
+        return bool(self.__current) or bool(self.__heap)
+
+    def wait_idle(self, timeout=None):
+        """Blocks until everything queued is spoken (or cancelled). Returns True if idle."""
+        with self.__cond:
+            return self.__cond.wait_for(lambda: not self.is_busy, timeout)
+
+    # ------------- speaking -------------
+    def __next_tasks(self):
+        """Pops the next task. The adjacent low priority tasks with the same priority are merged into one utterance."""
+        while self.__heap:
+            priority, _, task = heapq.heappop(self.__heap)
+            if task.cancelled:
+                continue
+
+            tasks = [task]
+            if priority in self.MERGEABLE and task.pcm is None:
+                while (self.__heap and len(tasks) < self.__MAX_MERGED and self.__heap[0][0] == priority
+                       and self.__heap[0][2].pcm is None):
+                    _, _, next_task = heapq.heappop(self.__heap)
+                    if not next_task.cancelled:
+                        tasks.append(next_task)
+            return tasks
+        return []
+
+    def __scheduler_thread(self):
+        while True:
+            with self.__cond:
+                self.__cond.wait_for(lambda: self.__heap or not self.__is_running or sig.program_terminate)
+                if not self.__is_running or sig.program_terminate:
+                    break
+                tasks = self.__next_tasks()
+                self.__current = tasks
+                if not tasks:
+                    self.__cond.notify_all()
+                    continue
+
+            first = tasks[0]
+            text = " ".join(task.text for task in tasks)
+            if len(tasks) > 1:
+                self.merged += len(tasks) - 1
+            interruptions = self.speech.player.interruptions
+            try:
+                if first.pcm is not None:
+                    self.speech.speak_audio(text, first.pcm, about=first.about, msg_type=first.msg_type)
+                else:
+                    self.speech.speak(text, about=first.about, msg_type=first.msg_type, voice=first.voice,
+                                      rate=first.rate)
+            except Exception as e:
+                print(f"ERR: in the speech scheduler: {e}")
+            was_stopped = self.speech.player.interruptions != interruptions
+            if len(tasks) == 1:
+                first.pcm = self.speech.last_audio
+
+            with self.__cond:
+                for task in tasks:
+                    if task.preempted and was_stopped and not task.interrupted and not task.cancelled:
+                        # interrupted by an alert: queued again, it is spoken right after the alert
+                        task.preempted = False
+                        heapq.heappush(self.__heap, (task.priority, next(self.__sequence), task))
+                        continue
+                    task.done.set()
+                    self.spoken += 1
+                self.__current = []
+                self.__cond.notify_all()
+
+    def status(self):
+        with self.__cond:
+            queued = {PRIORITY_NAMES[p]: 0 for p in PRIORITY_NAMES}
+            for priority, _, task in self.__heap:
+                if not task.cancelled:
+                    queued[PRIORITY_NAMES[priority]] += 1
+        return {'queued': queued, 'spoken': self.spoken, 'merged': self.merged, 'cancelled': self.cancelled,
+                'barge_ins': self.barge_ins}
@@ -0,0 +1,367 @@
+"""
+This module contains the streaming SPEECH TO TEXT engines, used from the Listen class (sense.py)
+for free-form speech (when the Rhino intents are not enough).
+
+Every engine has the same interface, so the listen loop can drive any of them frame by frame:
+- process(pcm) is called with every captured frame. It returns True when the utterance is finished (endpoint).
+- flush() finishes the current utterance and returns the final transcript.
+- 'on_partial' / 'on_final' callbacks receive the transcript while it is being built, and when it is final.
+
+Engines:
+- CheetahEngine: Picovoice Cheetah, running on device, in the same process.
+- WhisperEngine: OpenAi Whisper, CPU only. The inference runs in a worker PROCESS, on chunks of audio,
+  so the (slow) transcription never stalls the capture thread.
+
+Run this module directly to benchmark the engines (real-time factor) on recorded WAV clips:
+    python3 stt.py --engine cheetah --engine whisper clip1.wav clip2.wav
+"""
+
+# ======================== IMPORT =========================
+import argparse
+import multiprocessing
+import queue
+import threading
+import time
+import wave
+from array import array
+
+import numpy as np
+
+from audio import VoiceActivityGate
+
+
+# ======================= CLASSES =========================
+
+class SpeechToTextEngine:
+    """Base class for the streaming speech-to-text engines."""
+
+    name = 'base'
+
+    def __init__(self, on_partial=None, on_final=None, frame_length=512, sample_rate=16000):
+        self.on_partial = on_partial  # callback(text) - the transcript so far
+        self.on_final = on_final  # callback(text) - the final transcript of an utterance
+        self.frame_length = frame_length
+        self.sample_rate = sample_rate
+
+        self.transcript = ""
+
+    def process(self, pcm):
+        """Process one frame. Returns True if the end of the utterance is detected."""
+        raise NotImplementedError
+
+    def flush(self):
+        """Finish the current utterance. Returns the final transcript (and clears it)."""
+        raise NotImplementedError
+
+    def reset(self):
+        self.transcript = ""
+
+    def delete(self):
+        ...
+
+    def _emit_partial(self, text):
+        if self.on_partial is not None and text:
+            self.on_partial(text)
+
+    def _emit_final(self, text):
+        if self.on_final is not None:
+            self.on_final(text)
+
+
+class CheetahEngine(SpeechToTextEngine):
+    """Picovoice Cheetah streaming engine. The endpoint is detected by Cheetah itself."""
+
+    name = 'cheetah'
+
+    def __init__(self, access_key, model_path=None, endpoint_duration_sec=1.0, on_partial=None, on_final=None):
+        import pvcheetah
+
+        self.__cheetah = pvcheetah.create(access_key=access_key,
+                                          model_path=model_path,
+                                          endpoint_duration_sec=endpoint_duration_sec,
+                                          enable_automatic_punctuation=True)
+
+        super().__init__(on_partial, on_final,
+                         frame_length=self.__cheetah.frame_length,
+                         sample_rate=self.__cheetah.sample_rate)
+
+    def process(self, pcm):
+        partial, is_endpoint = self.__cheetah.process(pcm)
+        if partial:
+            self.transcript += partial
+            self._emit_partial(self.transcript)
+        return is_endpoint
+
+    def flush(self):
+        self.transcript += self.__cheetah.flush()
+        final = self.transcript.strip()
+        self.transcript = ""
+        self._emit_final(final)
+        return final
+
+    def delete(self):
+        if self.__cheetah is not None:
+            self.__cheetah.delete()
+            self.__cheetah = None
+
+
+def _whisper_worker(model_name, jobs, results):
+    """
+    Runs in a separate process. Loads the Whisper model once, and transcribes the chunks from 'jobs'.
+    A job is (utterance_id, pcm_bytes, is_final). A result is (utterance_id, text, is_final, inference_time).
+    """
+    import whisper  # imported here, so the main process does not load torch at all
+
+    model = whisper.load_model(model_name, device='cpu')
+    results.put(('ready', None, None, None))
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+
+        utterance_id, pcm_bytes, is_final = job
+        start = time.perf_counter()
+        text = ""
+        if pcm_bytes:
+            samples = np.frombuffer(pcm_bytes, dtype=np.int16).astype(np.float32) / 32768.0
+            try:
+                text = model.transcribe(samples, fp16=False, language='en')['text'].strip()
+            except Exception as e:
+                print(f"ERR: in whisper worker: {e}")
+        results.put((utterance_id, text, is_final, time.perf_counter() - start))
+
+
+class WhisperEngine(SpeechToTextEngine):
+    """
+    OpenAi Whisper, CPU only, running in a worker process.
+    - The frames are collected into chunks of 'chunk_sec' seconds. Every full chunk is sent to the worker,
+      and its text is returned as a partial transcript. The chunks OVERLAP by 'overlap_sec', so a word cut at
+      the boundary is heard whole in the next chunk. The words repeated by the overlap are dropped (see _merge()).
+    - The end of the utterance is detected by a voice activity gate (silence after speech).
+      Then the rest of the audio is sent as the final chunk.
+    - flush() waits (up to 'final_timeout') for the worker to return the final chunk.
+    """
+
+    name = 'whisper'
+
+    __MAX_JOBS = 8  # if the worker is that far behind, the oldest audio chunks are not queued
+
+    def __init__(self, model_name='tiny.en', chunk_sec=4.0, overlap_sec=0.5, final_timeout=15, on_partial=None,
+                 on_final=None, frame_length=512, sample_rate=16000):
+        super().__init__(on_partial, on_final, frame_length=frame_length, sample_rate=sample_rate)
+
+        self.chunk_samples = int(chunk_sec * sample_rate)
+        self.overlap_samples = int(overlap_sec * sample_rate)
+        self.final_timeout = final_timeout
+        # False: if the worker is behind, the partial chunks are dropped (live). True: they wait (the benchmark).
+        self.blocking = False
+
+        self.__chunk = array('h')
+        self.__sent_samples = 0  # the samples at the start of the chunk, already sent with the previous one
+        self.__utterance_id = 0
+        self.__parts = []  # texts of the chunks of the current utterance
+        self.__final_ready = threading.Event()
+        self.__lock = threading.Lock()
+        self.dropped_chunks = 0
+        self.inference_time = 0.0  # seconds spent in the worker, for the benchmark
+
+        self.__vad = VoiceActivityGate()
+        self.__vad.reset('whisper')
+        self.__heard_speech = False
+
+        ctx = multiprocessing.get_context('spawn')  # fork is not safe with the running capture thread
+        self.__jobs = ctx.Queue(maxsize=self.__MAX_JOBS)
+        self.__results = ctx.Queue()
+        self.__process = ctx.Process(target=_whisper_worker, args=(model_name, self.__jobs, self.__results), daemon=True)
+        self.__process.start()
+
+        self.__is_ready = threading.Event()
+        self.__receiver = threading.Thread(target=self.__receiver_thread, daemon=True)
+        self.__receiver.start()
+
+    def wait_ready(self, timeout=None):
+        """Loading the model takes a while. Returns True when the worker is ready."""
+        return self.__is_ready.wait(timeout)
+
+    def __receiver_thread(self):
+        while True:
+            try:
+                result = self.__results.get(timeout=1)
+            except queue.Empty:
+                if not self.__process.is_alive():
+                    break
+                continue
+
+            utterance_id, text, is_final, inference_time = result
+            if utterance_id == 'ready':
+                self.__is_ready.set()
+                continue
+
+            with self.__lock:
+                if utterance_id != self.__utterance_id:
+                    continue  # a late result of an utterance that was already flushed
+                self.inference_time += inference_time
+                if text and self.__parts:
+                    text = self._merge(self.__parts[-1], text)
+                if text:
+                    self.__parts.append(text)
+                self.transcript = " ".join(self.__parts)
+
+            if is_final:
+                self.__final_ready.set()
+            else:
+                self._emit_partial(self.transcript)
+
+    @staticmethod
+    def _merge(previous, text, max_words=6):
+        """'text' without its first words, if they repeat the last words of 'previous' (the overlap of the chunks)."""
+        previous_words = [word.strip('.,!?;:').casefold() for word in previous.split()]
+        words = text.split()
+        for count in range(min(max_words, len(previous_words), len(words)), 0, -1):
+            if previous_words[-count:] == [word.strip('.,!?;:').casefold() for word in words[:count]]:
+                return " ".join(words[count:])
+        return text
+
+    def __send(self, is_final):
+        # a final chunk with only the overlap has nothing new
+        pcm = self.__chunk.tobytes() if len(self.__chunk) > self.__sent_samples else b''
+        job = (self.__utterance_id, pcm, is_final)
+        if is_final or self.overlap_samples == 0:
+            self.__chunk = array('h')
+        else:
+            self.__chunk = self.__chunk[len(self.__chunk) - self.overlap_samples:]
+        self.__sent_samples = len(self.__chunk)
+        if not self.__process.is_alive():
+            print("ERR: the whisper worker is not running.")
+            self.__final_ready.set()
+            return
+        try:
+            if is_final or self.blocking:
+                self.__jobs.put(job, timeout=self.final_timeout)
+            else:
+                self.__jobs.put_nowait(job)
+        except queue.Full:
+            self.dropped_chunks += 1
+            if is_final:
+                self.__final_ready.set()
+
+    def process(self, pcm):
+        self.__chunk.extend(pcm)
+        if len(self.__chunk) >= self.chunk_samples:
+            self.__send(is_final=False)
+
+        # the end of the utterance: the gate closes after speech was heard
+        if self.__vad.process(pcm):
+            self.__heard_speech = True
+        elif self.__heard_speech and not self.__vad.is_speech:
+            return True
+        return False
+
+    def flush(self):
+        self.__final_ready.clear()
+        self.__send(is_final=True)
+        self.__final_ready.wait(self.final_timeout)
+
+        with self.__lock:
+            final = self.transcript.strip()
+            self.__utterance_id += 1
+            self.__parts = []
+            self.transcript = ""
+        self.__heard_speech = False
+        self.__vad.reset('whisper')
+
+        self._emit_final(final)
+        return final
+
+    def reset(self):
+        with self.__lock:
+            self.__utterance_id += 1
+            self.__parts = []
+            self.transcript = ""
+        self.__chunk = array('h')
+        self.__sent_samples = 0
+        self.__heard_speech = False
+        self.__vad.reset('whisper')
+
+    def delete(self):
+        if self.__process.is_alive():
+            self.__jobs.put(None)
+            self.__process.join(timeout=5)
+            if self.__process.is_alive():
+                self.__process.terminate()
+
+
+def create_engine(name, access_key=None, model_path=None, whisper_model='tiny.en', on_partial=None, on_final=None):
+    """Creates the speech-to-text engine by its name ('cheetah' / 'whisper')."""
+    if name == 'cheetah':
+        return CheetahEngine(access_key, model_path=model_path, on_partial=on_partial, on_final=on_final)
+    elif name == 'whisper':
+        return WhisperEngine(model_name=whisper_model, on_partial=on_partial, on_final=on_final)
+    else:
+        raise ValueError(f"Unknown speech-to-text engine: {name}")
+
+
+# ====================== BENCHMARK ========================
+
+def read_wav(path):
+    """Reads a 16 kHz, mono, 16-bit WAV file into array('h')."""
+    with wave.open(path, 'rb') as wav_file:
+        if wav_file.getnchannels() != 1 or wav_file.getsampwidth() != 2 or wav_file.getframerate() != 16000:
+            raise ValueError(f"{path}: only 16 kHz, mono, 16-bit WAV files are supported")
+        pcm = array('h')
+        pcm.frombytes(wav_file.readframes(wav_file.getnframes()))
+    return pcm
+
+
+def benchmark(engine, wav_paths):
+    """
+    Feeds every clip to the engine as fast as possible, and measures the real-time factor:
+    RTF = processing time / audio duration. RTF < 1 means the engine is faster than real time.
+    No audio is dropped: Whisper waits for its worker, so the time covers the transcription of the whole clip.
+    """
+    if isinstance(engine, WhisperEngine):
+        engine.blocking = True
+
+    results = []
+    for path in wav_paths:
+        pcm = read_wav(path)
+        duration = len(pcm) / engine.sample_rate
+        dropped = getattr(engine, 'dropped_chunks', 0)
+
+        start = time.perf_counter()
+        for i in range(0, len(pcm) - engine.frame_length + 1, engine.frame_length):
+            engine.process(pcm[i:i + engine.frame_length])
+        text = engine.flush()
+        elapsed = time.perf_counter() - start
+
+        results.append({'clip': path, 'duration': round(duration, 2), 'time': round(elapsed, 2),
+                        'rtf': round(elapsed / duration, 3) if duration else None, 'text': text,
+                        'dropped': getattr(engine, 'dropped_chunks', 0) - dropped})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Real-time factor of the speech-to-text engines.")
+    parser.add_argument('clips', nargs='+', help="16 kHz mono WAV files")
+    parser.add_argument('--engine', action='append', choices=['cheetah', 'whisper'], help="engine to test (repeatable)")
+    parser.add_argument('--access-key', default=None, help="picovoice access key (for cheetah)")
+    parser.add_argument('--whisper-model', default='tiny.en')
+    args = parser.parse_args()
+
+    for engine_name in args.engine or ['cheetah', 'whisper']:
+        stt_engine = create_engine(engine_name, access_key=args.access_key, whisper_model=args.whisper_model)
+        if isinstance(stt_engine, WhisperEngine):
+            stt_engine.wait_ready()  # the model loading time is not part of the real-time factor
+
+        clip_results = benchmark(stt_engine, args.clips)
+        stt_engine.delete()
+
+        total_audio = sum(r['duration'] for r in clip_results)
+        total_time = sum(r['time'] for r in clip_results)
+        print(f"=== {engine_name} ===")
+        for r in clip_results:
+            dropped = f", {r['dropped']} chunks DROPPED (the RTF is not valid)" if r['dropped'] else ""
+            print(f"{r['clip']}: {r['duration']} s audio, {r['time']} s, RTF={r['rtf']}{dropped} | {r['text']}")
+        if total_audio:
+            print(f"TOTAL: RTF={total_time / total_audio:.3f}")
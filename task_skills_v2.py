@@ -24,31 +24,35 @@ class Messages:
     Used to generate a messages to user, during the task processing.
     For example, some methods will return a prior message like 'Ok', 'Sure!', 'Of course!' before the process starts.
     """
+    # the choices of prior messages, by the kind of request. Also synthesized in advance (see predictable_phrases()).
+    PRIOR_MSG = {
+        'can you': ["Of course!", "Absolutely!"],
+        'could you': ["Of course!", "I'd be delighted to.", "Yes."],
+        'tell me': ["OK.", "Of course!", "Yes Sir.", "Sure.", "Sir!"],
+        'do you know': ["Yes.", "I do Sir."],
+        'can i have': ["Always Sir!", "Of course!", "Sure.", "Absolutely!", "Certainly!"],
+        'cmd': ["Sure.", "OK.", "Sir!", "Yes Sir."],
+    }
+
     @staticmethod
     def generate_prior_msg(slots):
 
         if 'adj' in slots.keys():
             if "can you" in slots['adj']:
-                chs = ["Of course!", "Absolutely!"]
-                return random.choice(chs)
+                return random.choice(Messages.PRIOR_MSG['can you'])
             elif "could you" in slots['adj']:
-                chs = ["Of course!", "I'd be delighted to.", "Yes."]
-                return random.choice(chs)
+                return random.choice(Messages.PRIOR_MSG['could you'])
 
         if 'ask' in slots.keys():
             if "tell me" in slots['ask'] or "give me" in slots['ask'] or "can you" in slots['ask']:
-                chs = ["OK.", "Of course!", "Yes Sir.", "Sure.", "Sir!"]
-                return random.choice(chs)
+                return random.choice(Messages.PRIOR_MSG['tell me'])
             elif "have you got" in slots['ask'] or "do you know" in slots['ask']:
-                chs = ["Yes.", "I do Sir."]
-                return random.choice(chs)
+                return random.choice(Messages.PRIOR_MSG['do you know'])
             elif "can i have" in slots['ask'] or "may i have" in slots['ask']:
-                chs = ["Always Sir!", "Of course!", "Sure.", "Absolutely!", "Certainly!"]
-                return random.choice(chs)
+                return random.choice(Messages.PRIOR_MSG['can i have'])
 
         elif 'cmd' in slots.keys():
-            chs = ["Sure.", "OK.", "Sir!", "Yes Sir."]
-            return random.choice(chs)
+            return random.choice(Messages.PRIOR_MSG['cmd'])
 
         return None
 
@@ -59,6 +63,9 @@ class SystemQueries(Messages):
     """
     INTENT = 'system'
 
+    SHUTDOWN_CONFIRMED = ['OK.', 'All right!']
+    SHUTDOWN_CONFIRM_ASK = ["Are you sure?", "Please confirm."]
+
     # This will help to process the request if insufficient data provided.
     # - for example, if only answer slots were given, but no 'cmd' or 'ask'... THEY WILL BE TAKEN from history
     # history remembers the last 5 requests...
@@ -106,14 +113,12 @@ class SystemQueries(Messages):
                     if slots['ans'] in ["no cancel it", "cancel it", "rejected", "i reject", "no i don't", "no"]:
                         return_msg = "Shutting down cancelled."
                     elif slots['ans'] in ["yes", "yes i do", "i confirm", "yes do it", "confirmed", "yes i confirm"]:
-                        chs = ['OK.', 'All right!']
-                        return_msg = f"{random.choice(chs)} Shutting down..."
+                        return_msg = f"{random.choice(self.SHUTDOWN_CONFIRMED)} Shutting down..."
                         self.__shutdown()
 
                 else:
                     # return a question for confirmation:
-                    chs = ["Are you sure?", "Please confirm."]
-                    return_msg = f"Preparing to shutdown... {random.choice(chs)}"
+                    return_msg = f"Preparing to shutdown... {random.choice(self.SHUTDOWN_CONFIRM_ASK)}"
                     note = "You requested a shutdown. I asked for confirmation."
 
                     answer_expected = {
@@ -148,7 +153,7 @@ class SystemQueries(Messages):
 
     @staticmethod
     def __shutdown():
-        sig.program_terminate = True
+        sig.terminate()
 
 
 class TimeQueries(Messages):
@@ -344,6 +349,31 @@ class WeatherQueries(Messages):
     # history remember the last 5 requests.
     history = deque(maxlen=5)
 
+    @staticmethod
+    def data_version(slots, senses):
+        """The version of the data an answer is made from (see response_cache.py). None: the answer is not cached."""
+        if 'where' in slots.keys() or 'ask' not in slots.keys():
+            return None  # another location: its weather is fetched for the request
+        if 'weather' in slots['ask']:
+            # the current weather is read from the last environment data (see process())
+            environment_data = senses.environment.last_environment_data
+            last_updated = environment_data['time'] if environment_data else None
+        else:
+            # the forecasts and the events are read from the last weather_raw
+            last_updated = senses.environment.last_weather.last_updated
+        if last_updated is None:
+            return None
+        # 'today', 'tomorrow' and the week days change their meaning at midnight
+        return last_updated, datetime.date.today().isoformat()
+
+    @staticmethod
+    def warm_up(senses):
+        """Called once in the background after startup (see skill_registry.py)."""
+        # pytz reads the time zone from the disk on its first use. The forecast uses the time zone of the weather data.
+        weather_raw = senses.environment.last_weather.weather_raw if senses is not None else None
+        if weather_raw and 'timezone' in weather_raw:
+            pytz.timezone(weather_raw['timezone'])
+
     @staticmethod
     def summary_from_condition_description(event_main, description, when_start, info=None, where_to=""):
         # TODO: implement this method for more naturally respond for bad weather search requests.
@@ -1448,6 +1478,7 @@ class MusicQueries:
 
 
 class General:
+    NO_REPORT_MSG = "I didn't say nothing Sir."
 
     @staticmethod
     def process(slots: dict):
@@ -1472,16 +1503,8 @@ class General:
                 if answer_me:
                     # Get all the reports and return them as one message
                     sig.ringing_stop()
-                    # use the 'generator version' of reports to speak them all...
-                    reports = reporter.get_reports()
-                    return_msg = ""
-                    for report in reports:
-                        # report[0]: element -> dict {'msg', 'about'}
-                        # report[1]: elements left -> int
-                        if report is not None and isinstance(report[0], dict) and isinstance(report[0]['msg'], str):
-                            return_msg += report[0]['msg']
-
-                    return return_msg
+                    return_msg, _ = reporter.compose_reports()
+                    return return_msg or General.NO_REPORT_MSG
 
                 else:
                     return "OK."
@@ -1501,7 +1524,7 @@ class General:
 
         if 'cmd' in slots.keys():
             if 'tell me' in slots['cmd'] or 'shoot' in slots['cmd']:
-                return "I didn't say nothing Sir."
+                return General.NO_REPORT_MSG
 
         elif 'ask' in slots.keys():
 
@@ -1521,6 +1544,9 @@ class General:
 
 
 class Feedback:
+    POSITIVE_MSG = ["Always!", "Always Sir.", "Any time Sir.", "You're welcome Sir."]
+    NEGATIVE_MSG = ["Well, no one is perfect!", "Sorry!", "I'm sorry to hear that."]
+
     @staticmethod
     def process(slots: dict):
         # a property that is added to the total mood of Alex (feeling good or bad)
@@ -1531,14 +1557,14 @@ class Feedback:
 
         if 'positive' in slots.keys():
             if 'thank' in slots['positive']:
-                chs = ["Always!", "Always Sir.", "Any time Sir.", "You're welcome Sir."]
+                chs = Feedback.POSITIVE_MSG
             # else:
             #     chs = ['Thank you!', 'Thanks!']
 
                 return_msg = random.choice(chs)
 
         elif 'negative' in slots.keys():
-            chs = ["Well, no one is perfect!", "Sorry!", "I'm sorry to hear that."]
+            chs = Feedback.NEGATIVE_MSG
             return_msg = random.choice(chs)
 
         # return return_msg, data_required, mood_points
@@ -1572,4 +1598,21 @@ GENERAL_LIST = {
     'general': General,
     'feedback': Feedback,
     'greeting': Greetings,
-}
\ No newline at end of file
+}
+
+
+def predictable_phrases():
+    """
+    All the fixed phrases the skills may speak (no variable parts).
+    Used to synthesize them in advance, while online (see phrase_warmer.py).
+    """
+    phrases = set()
+    for choices in Messages.PRIOR_MSG.values():
+        phrases.update(choices)
+    phrases.update(f"{msg} Shutting down..." for msg in SystemQueries.SHUTDOWN_CONFIRMED)
+    phrases.update(f"Preparing to shutdown... {msg}" for msg in SystemQueries.SHUTDOWN_CONFIRM_ASK)
+    phrases.add("Shutting down cancelled.")
+    phrases.update(Feedback.POSITIVE_MSG)
+    phrases.update(Feedback.NEGATIVE_MSG)
+    phrases.update(["OK.", General.NO_REPORT_MSG])
+    return phrases
@@ -0,0 +1,87 @@
+"""FrequencySketch and the TinyLFU admission of the phrase cache (phrase_cache.py)."""
+
+import hashlib
+
+from phrase_cache import FrequencySketch, PhraseCache
+
+
+def key(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def test_estimate_counts_the_increments():
+    sketch = FrequencySketch(width=256)
+    for _ in range(3):
+        sketch.increment(key('good morning'))
+
+    assert sketch.estimate(key('good morning')) == 3
+    assert sketch.estimate(key('good night')) == 0
+
+
+def test_counters_saturate():
+    sketch = FrequencySketch(width=256)
+    for _ in range(40):
+        sketch.increment(key('yes sir'))
+
+    assert sketch.estimate(key('yes sir')) == 15  # 4-bit counters
+
+
+def test_aging_halves_the_counters():
+    sketch = FrequencySketch(width=256, sample_size=20)
+    for _ in range(10):
+        sketch.increment(key('old phrase'))
+    for i in range(9):
+        sketch.increment(key(f'phrase {i}'))
+    assert sketch.estimate(key('old phrase')) == 10
+
+    sketch.increment(key('new phrase'))  # the 20th increment: everything is halved
+
+    assert sketch.estimate(key('old phrase')) == 5
+    assert sketch.additions == 10
+
+
+def test_save_and_load(tmp_path):
+    sketch = FrequencySketch(width=256)
+    sketch.increment(key('hello'))
+    sketch.save(str(tmp_path / 'frequency.npz'))
+
+    loaded = FrequencySketch(width=256)
+    loaded.load(str(tmp_path / 'frequency.npz'))
+    assert loaded.estimate(key('hello')) == 1
+    assert loaded.additions == 1
+
+
+def add_phrase(cache, text, size):
+    path = cache.path_for(text)
+    with open(path, 'wb') as file:
+        file.write(b'\x00' * size)
+    cache.add(text, path)
+
+
+def test_admission_from_the_second_use(tmp_path):
+    cache = PhraseCache(str(tmp_path), max_bytes=1000, policy='tinylfu')
+
+    cache.lookup("It's a sunny day.")
+    assert not cache.should_admit("It's a sunny day.")
+    cache.lookup("It's a sunny day.")
+    assert cache.should_admit("It's a sunny day.")
+
+
+def test_admission_when_full_compares_with_the_victim(tmp_path):
+    cache = PhraseCache(str(tmp_path), max_bytes=100, policy='tinylfu')
+    add_phrase(cache, 'popular', 100)  # the store is full
+    for _ in range(5):
+        cache.lookup('popular')
+
+    for _ in range(3):
+        cache.lookup('rare')
+    assert not cache.should_admit('rare')  # less frequent than the phrase it would evict
+
+    for _ in range(5):
+        cache.lookup('rare')
+    assert cache.should_admit('rare')
+
+
+def test_other_policies_admit_everything(tmp_path):
+    cache = PhraseCache(str(tmp_path), policy='lru')
+    assert cache.should_admit('never seen')
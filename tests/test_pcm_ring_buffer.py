@@ -0,0 +1,66 @@
+"""PcmRingBuffer (audio.py): the pre-roll buffer keeps the last N seconds, in order, across the wraparound."""
+
+from array import array
+
+from audio import PcmRingBuffer
+
+
+def samples(start, count):
+    return array('h', range(start, start + count))
+
+
+def test_partial_fill():
+    ring = PcmRingBuffer(seconds=1, sample_rate=10)
+    ring.write(samples(0, 4))
+
+    assert len(ring) == 4
+    assert ring.snapshot() == samples(0, 4)
+
+
+def test_wraparound_keeps_the_order():
+    ring = PcmRingBuffer(seconds=1, sample_rate=10)
+    for start in range(0, 25, 5):
+        ring.write(samples(start, 5))
+
+    assert len(ring) == 10
+    assert ring.snapshot() == samples(15, 10)
+
+
+def test_write_across_the_end():
+    ring = PcmRingBuffer(seconds=1, sample_rate=10)
+    ring.write(samples(0, 7))
+    ring.write(samples(7, 6))  # 3 samples at the end, 3 at the start
+
+    assert ring.snapshot() == samples(3, 10)
+
+
+def test_write_longer_than_the_capacity():
+    ring = PcmRingBuffer(seconds=1, sample_rate=10)
+    ring.write(samples(0, 3))
+    ring.write(samples(100, 25))
+
+    assert ring.snapshot() == samples(115, 10)
+
+
+def test_snapshot_of_the_last_seconds():
+    ring = PcmRingBuffer(seconds=1, sample_rate=10)
+    ring.write(samples(0, 8))
+    ring.write(samples(8, 8))
+
+    assert ring.snapshot(seconds=0.5) == samples(11, 5)
+    assert ring.snapshot(seconds=5) == samples(6, 10)
+
+
+def test_clear():
+    ring = PcmRingBuffer(seconds=1, sample_rate=10)
+    ring.write(samples(0, 8))
+    ring.clear()
+
+    assert len(ring) == 0
+    assert ring.snapshot() == array('h')
+
+
+def test_split_frames_drops_the_incomplete_first_frame():
+    frames = list(PcmRingBuffer.split_frames(samples(0, 10), 4))
+
+    assert frames == [samples(2, 4), samples(6, 4)]
@@ -0,0 +1,100 @@
+"""PhraseArchive (phrase_archive.py): the records, the tombstones, the compaction and the recovery at startup."""
+
+import os
+
+from phrase_archive import PhraseArchive
+
+
+def reopen(archive, drop_index=False):
+    """Closes the archive and opens it again, as at the next startup (optionally without its saved index)."""
+    archive.close()
+    if drop_index:
+        os.remove(archive.index_file)
+    return PhraseArchive(os.path.dirname(archive.path), archive.sample_rate)
+
+
+def test_append_and_read(tmp_path):
+    archive = PhraseArchive(str(tmp_path))
+    assert archive.append('a.mp3', b'\x01\x02' * 100)
+    assert archive.append('b.mp3', b'mp3 bytes', is_pcm=False)
+
+    assert archive.read('a.mp3') == (b'\x01\x02' * 100, True)
+    assert archive.read('b.mp3') == (b'mp3 bytes', False)
+    assert archive.read('missing.mp3') is None
+    assert len(archive) == 2
+
+
+def test_tombstone_removes_the_phrase(tmp_path):
+    archive = PhraseArchive(str(tmp_path))
+    archive.append('a.mp3', b'a' * 100)
+    archive.append('b.mp3', b'b' * 100)
+    archive.remove('a.mp3')
+
+    assert 'a.mp3' not in archive
+    assert archive.read('a.mp3') is None
+    assert archive.dead_bytes > 100  # the removed record, and its tombstone
+
+    # without the saved index, the records are scanned again: the tombstone is replayed
+    archive = reopen(archive, drop_index=True)
+    assert 'a.mp3' not in archive
+    assert archive.read('b.mp3') == (b'b' * 100, True)
+    archive.close()
+
+
+def test_replaced_phrase_is_read_from_the_last_record(tmp_path):
+    archive = PhraseArchive(str(tmp_path))
+    archive.append('a.mp3', b'old' * 10)
+    archive.append('a.mp3', b'new' * 10)
+
+    assert archive.read('a.mp3') == (b'new' * 10, True)
+    archive = reopen(archive, drop_index=True)
+    assert archive.read('a.mp3') == (b'new' * 10, True)
+    archive.close()
+
+
+def test_compaction_reclaims_the_dead_records(tmp_path):
+    archive = PhraseArchive(str(tmp_path))
+    for i in range(10):
+        archive.append(f'{i}.mp3', bytes([i]) * 1000)
+    for i in range(0, 10, 2):
+        archive.remove(f'{i}.mp3')
+    size_before = archive.size
+    assert archive.needs_compaction(min_ratio=0.25, min_bytes=1)
+
+    archive.compact()
+
+    assert archive.size < size_before
+    assert archive.dead_bytes == 0
+    assert archive.compactions == 1
+    assert len(archive) == 5
+    for i in range(1, 10, 2):
+        assert archive.read(f'{i}.mp3') == (bytes([i]) * 1000, True)
+
+    # the index saved by the compaction matches the new offsets
+    archive = reopen(archive)
+    for i in range(1, 10, 2):
+        assert archive.read(f'{i}.mp3') == (bytes([i]) * 1000, True)
+    assert '0.mp3' not in archive
+    archive.close()
+
+
+def test_broken_tail_is_truncated(tmp_path):
+    archive = PhraseArchive(str(tmp_path))
+    archive.append('a.mp3', b'a' * 100)
+    archive.close()
+    os.remove(archive.index_file)
+    size = os.path.getsize(archive.path)
+    with open(archive.path, 'ab') as file:
+        file.write(b'PHR\x00\x00')  # a record cut by a power loss
+
+    archive = PhraseArchive(str(tmp_path))
+    assert archive.size == size
+    assert archive.read('a.mp3') == (b'a' * 100, True)
+    archive.close()
+
+
+def test_read_only_writes_nothing(tmp_path):
+    archive = PhraseArchive(str(tmp_path / 'missing'), read_only=True)
+    assert not archive.is_available
+    assert not archive.append('a.mp3', b'a')
+    assert not os.path.exists(tmp_path / 'missing')
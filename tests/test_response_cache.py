@@ -0,0 +1,107 @@
+"""ResponseCache (response_cache.py): the keys, the data versions, the TTL and the limits."""
+
+from types import SimpleNamespace
+
+from response_cache import ResponseCache
+
+
+SENSES = SimpleNamespace(location=SimpleNamespace(city='Keighley', latitude=53.87, longitude=-1.89))
+
+
+class Skill:
+    def __init__(self, version):
+        self.version = version
+
+    def data_version(self, slots, senses):
+        return self.version
+
+
+def test_canonical_slots():
+    assert (ResponseCache.canonical_slots({'ask': "What's the  Weather", 'adj': 'could you', 'id': 'x'})
+            == (('ask', "what's the weather"),))
+
+
+def test_put_and_get():
+    cache = ResponseCache()
+    key = cache.key('weather', {'ask': 'weather'}, Skill(1), SENSES)
+    cache.put(key, "It is sunny.", b'pcm')
+
+    entry = cache.get(key)
+    assert entry.text == "It is sunny."
+    assert entry.audio == b'pcm'
+    assert cache.hits == 1
+
+
+def test_skill_without_data_version_is_not_cached():
+    cache = ResponseCache()
+    assert cache.key('time', {}, object(), SENSES) is None
+    assert cache.key('time', {}, Skill(None), SENSES) is None
+
+    cache.put(None, "It is noon.")
+    assert cache.get(None) is None
+
+
+def test_new_data_version_misses():
+    cache = ResponseCache()
+    old_key = cache.key('weather', {'ask': 'weather'}, Skill(1), SENSES)
+    cache.put(old_key, "It is sunny.")
+
+    new_key = cache.key('weather', {'ask': 'weather'}, Skill(2), SENSES)
+    assert new_key != old_key
+    assert cache.get(new_key) is None
+    assert cache.misses == 1
+
+
+def test_location_is_part_of_the_key():
+    cache = ResponseCache()
+    elsewhere = SimpleNamespace(location=SimpleNamespace(city='Leeds', latitude=53.8, longitude=-1.55))
+    assert cache.key('weather', {}, Skill(1), SENSES) != cache.key('weather', {}, Skill(1), elsewhere)
+
+
+def test_ttl_expires_the_answer():
+    cache = ResponseCache(ttl=60)
+    key = cache.key('weather', {}, Skill(1), SENSES)
+    cache.put(key, "It is sunny.")
+    cache.get(key).created -= 61
+
+    assert cache.get(key) is None
+    assert cache.status()['entries'] == 0
+
+
+def test_least_recently_used_answer_is_dropped():
+    cache = ResponseCache(max_entries=2)
+    keys = [cache.key('weather', {'day': str(day)}, Skill(1), SENSES) for day in range(3)]
+    cache.put(keys[0], "Monday.")
+    cache.put(keys[1], "Tuesday.")
+    cache.get(keys[0])
+    cache.put(keys[2], "Wednesday.")
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]).text == "Monday."
+    assert cache.get(keys[2]).text == "Wednesday."
+
+
+def test_audio_limit():
+    cache = ResponseCache(max_bytes=10)
+    first = cache.key('weather', {'day': '1'}, Skill(1), SENSES)
+    second = cache.key('weather', {'day': '2'}, Skill(1), SENSES)
+    cache.put(first, "Monday.", b'x' * 6)
+    cache.put(second, "Tuesday.", b'x' * 6)
+
+    assert cache.get(first) is None  # dropped to keep the audio under the limit
+    assert cache.get(second).audio == b'x' * 6
+
+    cache.put(first, "Monday.", b'x' * 11)  # too big: the text is kept, without the audio
+    assert cache.get(first).audio is None
+
+
+def test_invalidate():
+    cache = ResponseCache()
+    weather = cache.key('weather', {}, Skill(1), SENSES)
+    trains = cache.key('trains', {}, Skill(1), SENSES)
+    cache.put(weather, "It is sunny.")
+    cache.put(trains, "On time.")
+
+    cache.invalidate('weather')
+    assert cache.get(weather) is None
+    assert cache.get(trains) is not None
@@ -1,4 +1,5 @@
 import datetime
+import re
 
 from statistics import mean
 
@@ -65,6 +66,31 @@ def decode_str(text):
     return text2
 
 
+# ============== Split a long answer into sentences (for the pipelined speech) =================
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9"\'])')
+
+
+def split_sentences(text, min_length=12):
+    """
+    'Good morning! It's 7 AM, the weather is 12 degrees. The rain stops at 3pm.'
+     -> ["Good morning! It's 7 AM, the weather is 12 degrees.", 'The rain stops at 3pm.']
+    A sentence shorter than 'min_length' is joined with the next one (not worth a separate TTS request).
+    """
+    sentences = []
+    fragment = ""
+    for part in SENTENCE_END.split(text.strip()):
+        fragment = f"{fragment} {part}" if fragment else part
+        if len(fragment) >= min_length:
+            sentences.append(fragment)
+            fragment = ""
+    if fragment:
+        if sentences:
+            sentences[-1] = f"{sentences[-1]} {fragment}"
+        else:
+            sentences.append(fragment)
+    return sentences
+
+
 # ============ FUNCTIONS FOR HELPING WEATHER AND TIME RESPONSE ===============
 # get time with TODAY/TOMORROW / Weekday stamp
 
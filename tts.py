@@ -0,0 +1,393 @@
+"""
+This module contains the TTS WORKER, used from the Speech class (respond.py) to synthesize speech with Google TTS.
+
+Before, the timeout of the TTS request was raised with SIGALRM, which only works on the main thread
+(and interferes with any other alarm user). So the speech could only be synthesized from the main thread.
+
+Here:
+- every request has its own DEADLINE. The remaining time is passed to the TTS client call as its 'timeout',
+  and a request that waited in the queue past its deadline is not sent at all.
+- the requests are accepted from ANY thread (submit() returns a Future), and sent one by one from a worker thread.
+  There are two LANES: the INTERACTIVE requests (the speech) are always sent before the BATCH ones
+  (the phrase warmer, see phrase_warmer.py), so an answer never waits behind a warm-up.
+- a CIRCUIT BREAKER: after a number of failures in a row, the online synthesis is skipped for a cool-down period,
+  so every sentence does not pay the timeout while the service is unreachable.
+  Only the requests actually sent count: a deadline that passed in the queue is not a failure of the service.
+- the BACKEND CHAIN (Google, then a local synthesizer), selected by connectivity, latency and the request budget.
+- the channel to Google is kept WARM with a cheap request (list_voices) while idle and online,
+  so the first request after a pause does not pay the connection setup.
+- identical requests in flight ((text, voice, rate), for example from the ringing and a reply) share ONE Future.
+"""
+
+# ======================== IMPORT =========================
+import itertools
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+from google.cloud import texttospeech_v1
+
+from latency import LatencyTracer as tracer
+
+
+# ======================= CLASSES =========================
+
+class TTSUnavailable(Exception):
+    """The online synthesis is not available (circuit open, deadline passed or the request failed)."""
+    pass
+
+
+class CircuitBreaker:
+    """
+    'closed': the requests are sent.
+    'open': too many failures in a row. The requests are refused until the cool-down passes.
+    'half-open': the cool-down passed. One request is let through: its success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, max_failures=3, cool_down=30):
+        self.max_failures = max_failures
+        self.cool_down = cool_down  # seconds
+
+        self.__failures = 0
+        self.__opened_at = None
+        self.__trial_running = False
+        self.__lock = threading.Lock()
+        self.trips = 0  # how many times the circuit was opened
+
+    @property
+    def state(self):
+        if self.__opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.__opened_at < self.cool_down:
+            return 'open'
+        return 'half-open'
+
+    def allow(self):
+        with self.__lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.__trial_running:
+                self.__trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.__lock:
+            self.__failures = 0
+            self.__opened_at = None
+            self.__trial_running = False
+
+    def record_skipped(self):
+        """A request was not sent (its deadline passed in the queue). It is not a failure, but the trial is free again."""
+        with self.__lock:
+            self.__trial_running = False
+
+    def record_failure(self):
+        with self.__lock:
+            self.__failures += 1
+            if self.__trial_running or self.__failures >= self.max_failures:
+                if self.state != 'open':
+                    self.trips += 1
+                self.__opened_at = time.monotonic()
+            self.__trial_running = False
+
+    def status(self):
+        return {'state': self.state, 'failures': self.__failures, 'trips': self.trips}
+
+
+class TTSWorker:
+    VOICES = {
+        0: texttospeech_v1.VoiceSelectionParams(language_code='en-US', name='en-US-Wavenet-F', ssml_gender=texttospeech_v1.SsmlVoiceGender.FEMALE),
+        1: texttospeech_v1.VoiceSelectionParams(language_code='en-US', name='en-US-Neural2-F', ssml_gender=texttospeech_v1.SsmlVoiceGender.FEMALE),
+    }
+
+    KEEPALIVE_SEC = 45  # a keep-alive request is sent after that much idle time (while online)
+
+    # the lanes of the queue, in the order they are served
+    INTERACTIVE = 0
+    BATCH = 1
+
+    def __init__(self, client, timeout=3, breaker=None, is_online=None):
+        self.client = client
+        self.timeout = timeout  # the default deadline of a request, in seconds
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.is_online = is_online  # callable, returning the connection status. Without it, there are no keep-alives.
+
+        self.__queue = queue.PriorityQueue()  # (lane, sequence, request)
+        self.__sequence = itertools.count()
+        self.__inflight = {}  # (text, voice, rate) -> (Future, lane)
+        self.__inflight_lock = threading.Lock()
+        self.__thread = threading.Thread(target=self.__worker_thread, daemon=True)
+        self.__is_running = False
+
+        self.requests = 0
+        self.failures = 0
+        self.expired = 0  # requests not sent, because their deadline passed in the queue
+        self.refused = 0  # requests refused by the open circuit
+        self.coalesced = 0  # requests answered by an identical request already in flight
+        self.keepalives = 0
+
+    def start(self):
+        if not self.__is_running:
+            self.__is_running = True
+            self.__thread.start()
+
+    def stop(self):
+        self.__is_running = False
+        self.__queue.put((-1, next(self.__sequence), None))
+
+    def submit(self, text, voice=0, rate=0.9, timeout=None, batch=False):
+        """
+        Queues a synthesis request, from any thread. Returns a Future with the mp3 audio content.
+        The Future fails with TTSUnavailable if the circuit is open, or the deadline passed.
+        A 'batch' request is only sent when no interactive request is waiting.
+        An identical request already in flight is not sent again: its Future is returned
+        (a batch request joined by an interactive one is queued again, in the interactive lane).
+        """
+        key = (text, voice, float(rate))
+        lane = self.BATCH if batch else self.INTERACTIVE
+        deadline = time.monotonic() + (timeout if timeout is not None else self.timeout)
+        with self.__inflight_lock:
+            inflight = self.__inflight.get(key)
+            if inflight is not None:
+                self.coalesced += 1
+                future, inflight_lane = inflight
+                if lane < inflight_lane:
+                    self.__inflight[key] = (future, lane)
+                    self.__queue.put((lane, next(self.__sequence), (text, voice, rate, deadline, future)))
+                return future
+
+            future = Future()
+            if not self.breaker.allow():
+                self.refused += 1
+                future.set_exception(TTSUnavailable("the online synthesis is paused (circuit open)"))
+                return future
+
+            self.__inflight[key] = (future, lane)
+        future.add_done_callback(lambda _: self.__done(key))
+
+        self.__queue.put((lane, next(self.__sequence), (text, voice, rate, deadline, future)))
+        return future
+
+    def __done(self, key):
+        with self.__inflight_lock:
+            self.__inflight.pop(key, None)
+
+    def synthesize(self, text, voice=0, rate=0.9, timeout=None, batch=False):
+        """Blocking synthesis, from any thread. Returns the mp3 audio content, or raises TTSUnavailable."""
+        timeout = timeout if timeout is not None else self.timeout
+        future = self.submit(text, voice, rate, timeout, batch)
+        try:
+            # a little more than the deadline: the worker itself fails the request at the deadline
+            return future.result(timeout=timeout + 1)
+        except TTSUnavailable:
+            raise
+        except Exception as e:
+            raise TTSUnavailable(str(e)) from e
+
+    def __keepalive(self):
+        # the cheapest request of the API. It only keeps the channel (and its connection) open.
+        if self.is_online is None or not self.is_online() or self.breaker.state == 'open':
+            return
+        try:
+            self.client.list_voices(language_code='en-US', timeout=2)
+            self.keepalives += 1
+        except Exception as e:
+            print(f"ERR: TTS keep-alive failed: {e}")
+
+    def __worker_thread(self):
+        while self.__is_running:
+            try:
+                lane, _, request = self.__queue.get(timeout=self.KEEPALIVE_SEC)
+            except queue.Empty:
+                # idle: only then the keep-alive is sent, so it never delays a real request
+                self.__keepalive()
+                continue
+            if request is None:
+                break
+
+            text, voice, rate, deadline, future = request
+            if future.running() or future.done():
+                continue  # already sent from the interactive lane (see submit())
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # the requests before it were too slow: the service was not even asked. It may be the half-open trial.
+                self.expired += 1
+                self.breaker.record_skipped()
+                future.set_exception(TTSUnavailable("the deadline passed before the request was sent"))
+                continue
+            if lane == self.BATCH:
+                # a batch request holds the channel no longer than an interactive one would
+                remaining = min(remaining, self.timeout)
+
+            self.requests += 1
+            try:
+                audio_config = texttospeech_v1.AudioConfig(audio_encoding=texttospeech_v1.AudioEncoding.MP3, speaking_rate=rate)
+                synthesis_input = texttospeech_v1.SynthesisInput(text=text)
+                with tracer.span('tts_synthesis'):
+                    response = self.client.synthesize_speech(input=synthesis_input, voice=self.VOICES.get(voice, self.VOICES[0]),
+                                                             audio_config=audio_config, timeout=remaining)
+            except Exception as e:
+                self.failures += 1
+                self.breaker.record_failure()
+                future.set_exception(TTSUnavailable(str(e)))
+            else:
+                self.breaker.record_success()
+                future.set_result(response.audio_content)
+
+    def status(self):
+        return {'requests': self.requests, 'failures': self.failures, 'expired': self.expired, 'refused': self.refused,
+                'coalesced': self.coalesced, 'keepalives': self.keepalives, 'queued': self.__queue.qsize(),
+                'circuit': self.breaker.status()}
+
+
+# ======================= BACKENDS ========================
+"""
+The TTS backend chain: Google TTS first, then a local on-device synthesizer (pico2wave / espeak-ng).
+(The offline phrase cache, the first tier, is searched by the Speech class before the chain is used.)
+
+The backend is selected per request, by:
+- connectivity: Google is not used while offline, or while its circuit breaker is open.
+- the measured latency of each backend (a moving average), against the latency BUDGET of the request.
+  A backend expected to be slower than the remaining budget is tried only after the ones that fit.
+The local renders are flagged in the cache, so they are replaced with the cloud voice when back online (phrase_warmer.py).
+"""
+
+
+class TTSBackend:
+    name = 'base'
+    is_local = False
+    audio_format = 'mp3'
+    min_timeout = 0.0  # the backend is tried with at least that much time, even if the budget is exceeded
+
+    __EWMA = 0.3  # weight of the last request in the latency average
+
+    def __init__(self, initial_latency=1.0):
+        self.latency = initial_latency  # the moving average of the request time, seconds
+        self.uses = 0
+        self.failures = 0
+
+    def available(self):
+        return True
+
+    def expected_latency(self):
+        return self.latency
+
+    def _synthesize(self, text, voice, rate, timeout, batch=False):
+        raise NotImplementedError
+
+    def synthesize(self, text, voice=0, rate=0.9, timeout=3.0, batch=False):
+        """Returns the audio content (in 'audio_format'), or raises TTSUnavailable."""
+        start = time.monotonic()
+        try:
+            audio = self._synthesize(text, voice, rate, timeout, batch)
+        except TTSUnavailable:
+            self.failures += 1
+            if not batch:
+                self.__measured(time.monotonic() - start)
+            raise
+        self.uses += 1
+        # a batch request waits behind the interactive ones: its time is not the latency of the backend
+        if not batch:
+            self.__measured(time.monotonic() - start)
+        return audio
+
+    def __measured(self, seconds):
+        self.latency = (1 - self.__EWMA) * self.latency + self.__EWMA * seconds
+
+    def status(self):
+        return {'uses': self.uses, 'failures': self.failures, 'latency_ms': round(1000 * self.latency)}
+
+
+class GoogleBackend(TTSBackend):
+    name = 'google'
+
+    def __init__(self, worker, is_online):
+        super().__init__(initial_latency=0.8)
+        self.worker = worker  # TTSWorker
+        self.is_online = is_online  # callable, returning the connection status
+
+    def available(self):
+        return self.is_online() and self.worker.breaker.state != 'open'
+
+    def _synthesize(self, text, voice, rate, timeout, batch=False):
+        return self.worker.synthesize(text, voice, rate, timeout=timeout, batch=batch)
+
+
+class LocalBackend(TTSBackend):
+    """A local synthesizer. The voice is robotic, but it works without a network and never times out the answer."""
+
+    name = 'local'
+    is_local = True
+    audio_format = 'wav'
+    min_timeout = 2.0
+
+    ENGINES = ['pico2wave', 'espeak-ng', 'espeak']  # in the order of preference (pico sounds more natural)
+
+    def __init__(self, engine=None):
+        super().__init__(initial_latency=0.3)
+        if engine is None:
+            engine = next((name for name in self.ENGINES if shutil.which(name)), None)
+        self.engine = engine
+
+    def available(self):
+        return self.engine is not None
+
+    def _synthesize(self, text, voice, rate, timeout, batch=False):
+        file = tempfile.NamedTemporaryFile(suffix='.wav', delete=False)
+        file.close()
+        try:
+            if self.engine == 'pico2wave':
+                cmd = ['pico2wave', '-l', 'en-US', '-w', file.name, text]
+            else:
+                cmd = [self.engine, '-v', 'en-us', '-s', str(int(175 * rate)), '-w', file.name, text]
+            subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout, check=True)
+            with open(file.name, 'rb') as wav_file:
+                return wav_file.read()
+        except (OSError, subprocess.SubprocessError) as e:
+            raise TTSUnavailable(f"{self.engine}: {e}") from e
+        finally:
+            try:
+                os.remove(file.name)
+            except OSError:
+                pass
+
+
+class TTSChain:
+    def __init__(self, backends):
+        self.backends = [backend for backend in backends if backend is not None]
+
+    def synthesize(self, text, voice=0, rate=0.9, budget=3.0, allow_local=True, batch=False):
+        """
+        Synthesizes with the best backend for the latency 'budget' (seconds). 'batch' is a background request.
+        Returns (audio content, backend), or raises TTSUnavailable if no backend could do it.
+        """
+        deadline = time.monotonic() + budget
+        candidates = [backend for backend in self.backends
+                      if (allow_local or not backend.is_local) and backend.available()]
+        # the backends expected to fit the budget first, keeping the chain order
+        candidates.sort(key=lambda backend: backend.expected_latency() > budget)
+
+        errors = []
+        for backend in candidates:
+            timeout = max(deadline - time.monotonic(), backend.min_timeout)
+            if timeout <= 0:
+                break
+            try:
+                return backend.synthesize(text, voice, rate, timeout=timeout, batch=batch), backend
+            except TTSUnavailable as e:
+                errors.append(f"{backend.name}: {e}")
+
+        raise TTSUnavailable("; ".join(errors) if errors else "no TTS backend available")
+
+    def status(self):
+        return {backend.name: backend.status() for backend in self.backends}